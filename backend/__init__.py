@@ -0,0 +1,5 @@
+import os
+from dotenv import load_dotenv
+
+# Loaded once here, before any module reads its configuration at import time
+load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
@@ -1,14 +1,20 @@
 import os
+import time
 import secrets
-from typing import Optional, Dict
+import threading
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlencode
+
+import httpx
 from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import RedirectResponse, HTMLResponse
-from google_auth_oauthlib.flow import Flow
 from jose import jwt, JWTError
-from dotenv import load_dotenv
 from pydantic import BaseModel
 
-load_dotenv()
+from backend.database import AsyncSessionLocal
+from backend.services import db_async
+from backend.services import credentials
 
 router = APIRouter()
 
@@ -18,6 +24,19 @@ GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI", "http://localhost:8000/auth/google/callback")
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(32))
 ALGORITHM = "HS256"
+# Session lifetime: the JWT's exp and the cookie's max-age
+JWT_TTL_SECONDS = int(os.getenv("JWT_TTL_SECONDS", str(3600 * 24 * 7)))
+# Verified tokens kept per process; an entry lives until the token expires or for
+# AUTH_CACHE_TTL_SECONDS, whichever is sooner (bounds how long a rotated SECRET_KEY is ignored)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+# Users allowed to see everyone's usage and set quotas
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+GOOGLE_AUTH_URI = "https://accounts.google.com/o/oauth2/auth"
+GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+# Same response as the discovery-built oauth2 v2 client's userinfo().get()
+GOOGLE_USERINFO_URI = "https://www.googleapis.com/oauth2/v2/userinfo"
 
 # Scopes required
 SCOPES = [
@@ -27,12 +46,66 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive.file"
 ]
 
-# In-memory storage for simplicity (REPLACE with DB in production)
-# mapping google_id -> refresh_token
-user_refresh_tokens: Dict[str, str] = {}
+class TokenCache:
+    """
+    LRU of verified JWT -> its claims, so repeat requests skip the signature
+    check. The cached dict is shared by those requests, which is how the
+    internal user id learned by one of them (remember_user_id) reaches the rest.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # token -> (expires_at epoch, claims)
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._data[token]
+                return None
+            self._data.move_to_end(token)
+            return entry[1]
+
+    def set(self, token: str, claims: dict):
+        expires_at = time.time() + self.ttl
+        if claims.get("exp"):
+            expires_at = min(expires_at, claims["exp"])
+        with self._lock:
+            self._data[token] = (expires_at, claims)
+            self._data.move_to_end(token)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, token: str):
+        with self._lock:
+            self._data.pop(token, None)
+
+_token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Pooled client for Google's token and userinfo endpoints.
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=10, limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+    return _client
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
 def create_jwt_token(data: dict):
-    return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
+    now = int(time.time())
+    claims = {"iat": now, "exp": now + JWT_TTL_SECONDS, **data}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
 
 def decode_jwt_token(token: str):
     try:
@@ -41,74 +114,90 @@ def decode_jwt_token(token: str):
     except JWTError:
         return None
 
-
-def get_current_user(request: Request):
+async def get_current_user(request: Request):
+    """
+    The token's claims: `sub` (Google ID), `email` and, once known, `uid`
+    (internal User.id). Async so it runs on the event loop, not a threadpool.
+    """
     token = request.cookies.get("fastapi_token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    payload = decode_jwt_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    payload = _token_cache.get(token)
+    if payload is None:
+        payload = decode_jwt_token(token)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        _token_cache.set(token, payload)
     return payload
 
+async def require_admin(user: dict = Depends(get_current_user)):
+    if (user.get("email") or "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return user
+
+def remember_user_id(user: dict, user_id: int):
+    """
+    Records the internal User.id on the (cached) claims of a token issued
+    before it carried `uid`, once the user row is known to be committed.
+    """
+    user["uid"] = user_id
+
 @router.get("/auth/google")
 async def login_google():
     if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
         raise HTTPException(status_code=500, detail="Server misconfigured: Missing Google Credentials")
-    
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-            }
-        },
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI
-    )
-    
-    authorization_url, state = flow.authorization_url(
-        access_type='offline',
-        include_granted_scopes='true',
-        prompt='consent'
-    )
-    return RedirectResponse(authorization_url)
+
+    params = {
+        "response_type": "code",
+        "client_id": GOOGLE_CLIENT_ID,
+        "redirect_uri": REDIRECT_URI,
+        "scope": " ".join(SCOPES),
+        "state": secrets.token_urlsafe(24),
+        "access_type": "offline",
+        "include_granted_scopes": "true",
+        "prompt": "consent",
+    }
+    return RedirectResponse(f"{GOOGLE_AUTH_URI}?{urlencode(params)}")
+
+async def exchange_code(code: str) -> dict:
+    """
+    Authorization code -> Google's token response (access_token, refresh_token, scope, ...).
+    """
+    response = await get_client().post(GOOGLE_TOKEN_URI, data={
+        "code": code,
+        "client_id": GOOGLE_CLIENT_ID,
+        "client_secret": GOOGLE_CLIENT_SECRET,
+        "redirect_uri": REDIRECT_URI,
+        "grant_type": "authorization_code",
+    })
+    response.raise_for_status()
+    return response.json()
+
+async def fetch_userinfo(access_token: str) -> dict:
+    response = await get_client().get(GOOGLE_USERINFO_URI, headers={"Authorization": f"Bearer {access_token}"})
+    response.raise_for_status()
+    return response.json()
 
 @router.get("/auth/google/callback")
 async def auth_google_callback(code: str, state: Optional[str] = None):
     try:
-        flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": GOOGLE_CLIENT_ID,
-                    "client_secret": GOOGLE_CLIENT_SECRET,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                }
-            },
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI
-        )
-        flow.fetch_token(code=code)
-        credentials = flow.credentials
-        
-        # Get user info
-        from googleapiclient.discovery import build
-        service = build('oauth2', 'v2', credentials=credentials)
-        user_info = service.userinfo().get().execute()
-        
+        tokens = await exchange_code(code)
+        user_info = await fetch_userinfo(tokens["access_token"])
+
         google_id = user_info['id']
         email = user_info['email']
-        
-        # Store refresh token (encrypted in real app)
-        if credentials.refresh_token:
-            user_refresh_tokens[google_id] = credentials.refresh_token
-        
-        # Issue JWT
-        token = create_jwt_token({"sub": google_id, "email": email})
-        
+
+        # Create the user and store the refresh token (encrypted) where every process can read it
+        async with AsyncSessionLocal() as db:
+            db_user = await db_async.get_or_create_user(db, google_id, email, commit=False)
+            if tokens.get("refresh_token"):
+                await credentials.store_refresh_token(db, db_user.id, tokens["refresh_token"], tokens.get("scope"))
+            await db.commit()
+            user_id = db_user.id
+
+        # Issue JWT; uid saves every later request the user lookup
+        token = create_jwt_token({"sub": google_id, "email": email, "uid": user_id})
+
         # Return HTML with script to close window and notify opener
         html_content = """
         <html>
@@ -125,7 +214,7 @@ async def auth_google_callback(code: str, state: Optional[str] = None):
         </html>
         """
         response = HTMLResponse(content=html_content)
-        
+
         # Set Secure, HttpOnly, SameSite=None cookie for cross-site usage (extension context)
         response.set_cookie(
             key="fastapi_token",
@@ -133,7 +222,7 @@ async def auth_google_callback(code: str, state: Optional[str] = None):
             httponly=True,
             secure=True,
             samesite="None",
-            max_age=3600 * 24 * 7 # 7 days
+            max_age=JWT_TTL_SECONDS
         )
         return response
 
@@ -145,7 +234,10 @@ async def auth_status(user: dict = Depends(get_current_user)):
     return {"status": "authenticated", "user": user.get("email")}
 
 @router.post("/auth/logout")
-async def logout():
+async def logout(request: Request):
+    token = request.cookies.get("fastapi_token")
+    if token:
+        _token_cache.discard(token)
     response = HTMLResponse(content="Logged out")
     response.delete_cookie("fastapi_token")
     return response
@@ -0,0 +1,92 @@
+"""
+Import-time budget check for the API, run in CI and before deploys:
+
+    python -m backend.bench.import_time [--budget-ms 1500] [--runs 3]
+
+Imports `backend.main` in fresh interpreters (local SQLite mode, no network)
+and fails if the best time exceeds the budget, or if any module that should
+only load lazily (Gemini SDK, GCS client, Cloud SQL connector, OAuth flow)
+was pulled in at import time. Prints the slowest imports on failure.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+# Loaded on first use, never by importing the app
+LAZY_MODULES = [
+    "google.genai",
+    "google.cloud.storage",
+    "google.cloud.sql.connector",
+    "google_auth_oauthlib",
+    "googleapiclient",
+    "zstandard",
+    "youtube_transcript_api",
+]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import backend.main
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({"ms": elapsed_ms, "modules": sorted(sys.modules)}))
+"""
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.update({
+        "ENVIRONMENT": "development",
+        "DATABASE_URL_LOCAL": env.get("DATABASE_URL_LOCAL", "sqlite:///./import_probe.db"),
+        "PYTHONPATH": os.getcwd() + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    return env
+
+def measure() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], env=_env(), capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def slowest_imports(limit: int = 15) -> list:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        env=_env(), capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        rows.append((int(self_us), int(cumulative_us), name))
+    return sorted(rows, reverse=True)[:limit]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    best_ms = min(r["ms"] for r in results)
+    eager = [m for m in LAZY_MODULES if any(loaded == m or loaded.startswith(m + ".") for loaded in results[0]["modules"])]
+
+    print(f"import backend.main: best {best_ms:.0f}ms of {args.runs} runs (budget {args.budget_ms:.0f}ms)")
+    failed = False
+    if eager:
+        print(f"FAIL: loaded at import time but should be lazy: {', '.join(eager)}")
+        failed = True
+    if best_ms > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    if failed:
+        print("Slowest imports (self us, cumulative us, module):")
+        for self_us, cumulative_us, name in slowest_imports():
+            print(f"  {self_us:>9} {cumulative_us:>9}  {name}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
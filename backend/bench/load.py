@@ -0,0 +1,518 @@
+"""
+Offline load test of the API, run before deploys:
+
+    python -m backend.bench.load [--scenario all] [--update-baseline]
+
+Boots `backend.main:app` under uvicorn in a subprocess against local
+stand-ins: SQLite, the filesystem note store, the fake Gemini backend
+(configurable latency and error rate), no transcripts, and a stub oEmbed
+server in this process for titles. Requests are authenticated with JWTs
+signed with the server's SECRET_KEY, so nothing talks to Google.
+
+Scenarios:
+  - generate_burst: many users POST /generate-notes at once (half the
+    videos shared between users), then wait for every note to be READY
+  - event_streams: thousands of concurrent /notes/{video_id}/events
+    streams; measures time to first event, then starts their generations
+    and measures how long until every stream has seen READY
+  - download_storm: concurrent downloads of READY notes
+
+Each scenario reports requests/sec, latency percentiles, and per request
+the DB statements, log records and microseconds spent logging (from the
+server's /metrics). Results are compared with backend/bench/baselines.json:
+a throughput drop or latency rise beyond --tolerance, or more DB statements
+or log records per request, fails the run.
+Baselines are machine-specific; regenerate them with --update-baseline on
+the machine that runs the check.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import httpx
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+SECRET_KEY = "bench-secret-key"
+
+# Metrics where bigger is better; everything else compared is lower-is-better
+HIGHER_IS_BETTER = {"rps"}
+# Machine-independent, so compared tightly; the slack covers background
+# title updates landing inside or outside the measured window
+COUNT_METRICS = {"queries_per_request", "log_records_per_request"}
+COUNT_SLACK = 0.1
+COMPARED_METRICS = {"rps", "p50_ms", "p99_ms", "completion_s", "queries_per_request", "log_records_per_request"}
+
+# Server counters read around each measured window: name -> /metrics sample prefix (summed over labels)
+SERVER_COUNTERS = {
+    "queries": 'db_queries_total{engine="async"}',
+    "log_records": "log_records_total{",
+    "log_emit_seconds": "log_emit_seconds_total",
+}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def latency_summary(latencies_s: List[float], elapsed_s: float) -> dict:
+    return {
+        "requests": len(latencies_s),
+        "rps": round(len(latencies_s) / elapsed_s, 1) if elapsed_s else 0.0,
+        "p50_ms": round(percentile(latencies_s, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies_s, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies_s, 99) * 1000, 1),
+    }
+
+# ---------------------------------------------------------------- stand-ins
+
+def start_fake_oembed(latency: float) -> ThreadingHTTPServer:
+    """
+    Answers oEmbed lookups with a made-up title after `latency` seconds.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = json.dumps({"title": "Benchmark video", "author_name": "Bench"}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def server_env(args, workdir: str, oembed_port: int) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "ENVIRONMENT": "development",
+        "DATABASE_URL_LOCAL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "RUN_MIGRATIONS_ON_STARTUP": "true",
+        "SECRET_KEY": SECRET_KEY,
+        "NOTE_STORE": "local",
+        "NOTE_STORE_DIR": os.path.join(workdir, "notes"),
+        "GEMINI_BACKEND": "fake",
+        "GEMINI_FAKE_LATENCY_SECONDS": str(args.gemini_latency),
+        "GEMINI_FAKE_ERROR_RATE": str(args.gemini_error_rate),
+        "GEMINI_RETRY_BASE_SECONDS": "0.1",
+        "TRANSCRIPT_PROVIDER": "none",
+        "YOUTUBE_API_KEY": "",
+        "YOUTUBE_OEMBED_URL": f"http://127.0.0.1:{oembed_port}/oembed",
+        "WORKER_MODE": "inprocess",
+        "WORKER_CONCURRENCY": str(args.workers),
+        "WORKER_POLL_INTERVAL": "0.05",
+        "JOB_MAX_LEASED_PER_USER": "0",
+        "JOB_RETRY_BASE_SECONDS": "0.1",
+        # Measure the pipeline, not the admission limits
+        "GENERATE_RATE_PER_MINUTE": "1000000",
+        "GENERATE_BURST": "1000000",
+        "MAX_QUEUE_DEPTH": "0",
+        "SSE_MAX_CONNECTIONS": "1000000",
+        "SSE_MAX_CONNECTIONS_PER_USER": "1000000",
+        "DB_POOL_SIZE": str(args.pool_size),
+        "PYTHONPATH": os.getcwd() + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    return env
+
+class Server:
+    """
+    The API under uvicorn in a subprocess.
+    """
+
+    def __init__(self, env: dict, log_path: str):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.log_path = log_path
+        self.log = open(log_path, "w")
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(self.port),
+                "--log-level", "warning",
+                # Outlive the client's idle connections, so none is closed just as it is reused
+                "--timeout-keep-alive", "120",
+            ],
+            env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("API server exited during startup")
+            try:
+                if httpx.get(f"{self.base_url}/metrics", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("API server did not start")
+
+    def rss_kb(self) -> int:
+        with open(f"/proc/{self.process.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+        return 0
+
+    def log_tail(self, lines: int = 30) -> str:
+        """
+        The last warnings, errors and tracebacks the server logged.
+        """
+        with open(self.log_path) as f:
+            return "".join([line for line in f if not line.startswith("INFO:") and '"level": "INFO"' not in line][-lines:])
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+# ---------------------------------------------------------------- client side
+
+def user_cookies(google_id: str) -> Dict[str, str]:
+    # Minted here rather than with backend.auth, which needs the server's database settings
+    from jose import jwt
+    claims = {"sub": google_id, "email": f"{google_id}@bench.test", "exp": int(time.time()) + 24 * 3600}
+    return {"fastapi_token": jwt.encode(claims, SECRET_KEY, algorithm="HS256")}
+
+async def server_counters(client: httpx.AsyncClient) -> Dict[str, float]:
+    """
+    SERVER_COUNTERS from the server's /metrics: statements run by API
+    handlers, log records written and the time spent logging them.
+    """
+    totals = dict.fromkeys(SERVER_COUNTERS, 0.0)
+    for line in (await client.get("/metrics")).text.splitlines():
+        sample, _, value = line.rpartition(" ")
+        for name, prefix in SERVER_COUNTERS.items():
+            if sample.startswith(prefix):
+                totals[name] += float(value)
+    return totals
+
+def per_request(before: Dict[str, float], after: Dict[str, float], requests: int) -> dict:
+    delta = {name: after[name] - before[name] for name in SERVER_COUNTERS}
+    return {
+        "queries_per_request": round(delta["queries"] / requests, 2),
+        "log_records_per_request": round(delta["log_records"] / requests, 2),
+        "log_emit_us_per_request": round(delta["log_emit_seconds"] / requests * 1e6, 1),
+    }
+
+def video_id(prefix: str, i: int) -> str:
+    return f"{prefix}{i:0{11 - len(prefix)}d}"
+
+async def timed(coro_factory, latencies: List[float], errors: List[str]):
+    started = time.perf_counter()
+    try:
+        response = await coro_factory()
+        if response.status_code >= 400:
+            errors.append(str(response.status_code))
+    except httpx.HTTPError as e:
+        errors.append(type(e).__name__)
+    latencies.append(time.perf_counter() - started)
+
+async def generate(client: httpx.AsyncClient, google_id: str, vid: str) -> httpx.Response:
+    return await client.post(
+        "/generate-notes",
+        json={"videoUrl": f"https://www.youtube.com/watch?v={vid}", "videoId": vid},
+        cookies=user_cookies(google_id),
+    )
+
+async def wait_until_done(client: httpx.AsyncClient, wanted: Dict[str, List[str]], timeout: float) -> bool:
+    """
+    Polls /notes/status until every user's videos are READY or FAILED.
+    """
+    deadline = time.monotonic() + timeout
+    pending = dict(wanted)
+    while pending and time.monotonic() < deadline:
+        for google_id, vids in list(pending.items()):
+            response = await client.post("/notes/status", json={"videoIds": vids}, cookies=user_cookies(google_id))
+            notes = response.json().get("notes", [])
+            if len(notes) == len(vids) and all(note["status"] in ("ready", "failed") for note in notes):
+                del pending[google_id]
+        await asyncio.sleep(0.2)
+    return not pending
+
+# ---------------------------------------------------------------- scenarios
+
+async def generate_burst(client: httpx.AsyncClient, server: Server, args) -> dict:
+    wanted = {}
+    requests = []
+    for u in range(args.users):
+        google_id = f"burst-user-{u}"
+        vids = [
+            # Even videos are shared by every user, odd ones are per user
+            video_id("gs", i) if i % 2 == 0 else video_id(f"g{u}x", i)
+            for i in range(args.videos_per_user)
+        ]
+        wanted[google_id] = vids
+        requests.extend((google_id, vid) for vid in vids)
+
+    latencies, errors = [], []
+    counters_before = await server_counters(client)
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(lambda g=g, v=v: generate(client, g, v), latencies, errors) for g, v in requests))
+    elapsed = time.perf_counter() - started
+    counters_after = await server_counters(client)
+
+    done = await wait_until_done(client, wanted, args.timeout)
+    result = latency_summary(latencies, elapsed)
+    result.update({
+        "errors": len(errors),
+        "error_kinds": sorted(set(errors)),
+        "completion_s": round(time.perf_counter() - started, 2),
+        "all_done": done,
+        **per_request(counters_before, counters_after, len(requests)),
+    })
+    return result
+
+async def event_streams(client: httpx.AsyncClient, server: Server, args) -> dict:
+    streams = [
+        (f"stream-user-{i % args.users}", video_id("es", i))
+        for i in range(args.streams)
+    ]
+    # Streams need the users to exist: give each one a note first
+    warmup = {f"stream-user-{u}": [video_id("ew", u)] for u in range(min(args.users, args.streams))}
+    await asyncio.gather(*(generate(client, g, vids[0]) for g, vids in warmup.items()))
+    if not await wait_until_done(client, warmup, args.timeout):
+        raise RuntimeError("event_streams: warm-up notes did not finish")
+    connected = asyncio.Event()
+    first_event_latencies: List[float] = []
+    finished_at: Dict[int, float] = {}
+    errors: List[str] = []
+    open_count = 0
+    # Clients connect over a short ramp, not all in the same instant: at most
+    # `concurrency` streams are being set up at once (each costs one DB read)
+    connecting = asyncio.Semaphore(args.concurrency)
+
+    async def watch(index: int, google_id: str, vid: str):
+        nonlocal open_count
+        await connecting.acquire()
+        started = time.perf_counter()
+        got_first = False
+        try:
+            async with client.stream("GET", f"/notes/{vid}/events", cookies=user_cookies(google_id), timeout=None) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if not got_first:
+                        got_first = True
+                        connecting.release()
+                        first_event_latencies.append(time.perf_counter() - started)
+                        open_count += 1
+                        if open_count == len(streams):
+                            connected.set()
+                    if json.loads(line[6:]).get("status") in ("ready", "failed"):
+                        finished_at[index] = time.perf_counter()
+                        return
+            errors.append("stream closed early")
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        finally:
+            if not got_first:
+                connecting.release()
+                open_count += 1
+                if open_count == len(streams):
+                    connected.set()
+
+    rss_before = server.rss_kb()
+    connect_started = time.perf_counter()
+    tasks = [asyncio.create_task(watch(i, g, v)) for i, (g, v) in enumerate(streams)]
+    try:
+        await asyncio.wait_for(connected.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    connect_elapsed = time.perf_counter() - connect_started
+    rss_per_stream_kb = (server.rss_kb() - rss_before) / len(streams)
+
+    # Every stream is open and waiting: start their generations, as clients
+    # would, a few at a time (generate_burst covers the all-at-once case)
+    generate_started = time.perf_counter()
+    gen_latencies, gen_errors = [], []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def start(google_id: str, vid: str):
+        async with semaphore:
+            await timed(lambda: generate(client, google_id, vid), gen_latencies, gen_errors)
+
+    await asyncio.gather(*(start(g, v) for g, v in streams))
+    _, pending = await asyncio.wait(tasks, timeout=args.timeout)
+    for task in pending:
+        task.cancel()
+
+    result = latency_summary(first_event_latencies, connect_elapsed)
+    result.update({
+        "streams": len(streams),
+        "errors": len(errors) + len(gen_errors),
+        "error_kinds": sorted(set(errors + gen_errors)),
+        "completion_s": round(max(finished_at.values(), default=generate_started) - generate_started, 2),
+        "all_done": len(finished_at) == len(streams),
+        "rss_per_stream_kb": round(rss_per_stream_kb, 1),
+    })
+    return result
+
+async def download_storm(client: httpx.AsyncClient, server: Server, args) -> dict:
+    google_id = "download-user"
+    vids = [video_id("ds", i) for i in range(args.download_notes)]
+    await asyncio.gather(*(generate(client, google_id, vid) for vid in vids))
+    if not await wait_until_done(client, {google_id: vids}, args.timeout):
+        raise RuntimeError("download_storm: notes did not become READY")
+
+    cookies = user_cookies(google_id)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], []
+
+    async def download(i: int):
+        async with semaphore:
+            await timed(
+                lambda: client.get(f"/notes/{vids[i % len(vids)]}/download", cookies=cookies, headers={"Accept-Encoding": "gzip"}),
+                latencies, errors,
+            )
+
+    counters_before = await server_counters(client)
+    started = time.perf_counter()
+    await asyncio.gather(*(download(i) for i in range(args.downloads)))
+    elapsed = time.perf_counter() - started
+    counters_after = await server_counters(client)
+
+    result = latency_summary(latencies, elapsed)
+    result.update({
+        "errors": len(errors),
+        "error_kinds": sorted(set(errors)),
+        **per_request(counters_before, counters_after, args.downloads),
+    })
+    return result
+
+SCENARIOS = {
+    "generate_burst": generate_burst,
+    "event_streams": event_streams,
+    "download_storm": download_storm,
+}
+
+# Arguments that shape each scenario; results are only compared with a
+# baseline recorded with the same values
+SCENARIO_PARAMS = {
+    "generate_burst": ["users", "videos_per_user", "workers", "gemini_latency", "gemini_error_rate"],
+    "event_streams": ["users", "streams", "concurrency", "workers", "gemini_latency", "gemini_error_rate"],
+    "download_storm": ["download_notes", "downloads", "concurrency"],
+}
+
+# ---------------------------------------------------------------- baselines
+
+def compare(results: dict, baselines: dict, tolerance: float) -> List[str]:
+    """
+    Regressions of results against baselines, as readable lines.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        baseline = baselines.get(scenario, {})
+        if baseline and baseline.get("params") != metrics["params"]:
+            print(f"Skipping baseline comparison for {scenario}: recorded with {baseline.get('params')}")
+            baseline = {}
+        if metrics.get("errors"):
+            regressions.append(f"{scenario}: {metrics['errors']} failed requests")
+        if metrics.get("all_done") is False:
+            regressions.append(f"{scenario}: not every note finished within the timeout")
+        for name in COMPARED_METRICS & metrics.keys() & baseline.keys():
+            value, expected = metrics[name], baseline[name]
+            if name in COUNT_METRICS:
+                worse = value > expected * (1 + COUNT_SLACK) + 0.05
+            elif name in HIGHER_IS_BETTER:
+                worse = value < expected * (1 - tolerance)
+            else:
+                worse = value > expected * (1 + tolerance)
+            if worse:
+                regressions.append(f"{scenario}.{name}: {value} vs baseline {expected}")
+    return regressions
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="note-bench-") as workdir:
+        oembed = start_fake_oembed(args.oembed_latency)
+        server = Server(server_env(args, workdir, oembed.server_address[1]), os.path.join(workdir, "server.log"))
+        try:
+            await asyncio.to_thread(server.wait_ready)
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=args.timeout) as client:
+                results = {}
+                names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+                for name in names:
+                    print(f"Running {name}...", flush=True)
+                    results[name] = await SCENARIOS[name](client, server, args)
+                    results[name]["params"] = {param: getattr(args, param) for param in SCENARIO_PARAMS[name]}
+                    print(f"  {json.dumps(results[name])}", flush=True)
+                    if results[name].get("errors") or results[name].get("all_done") is False:
+                        print(f"Server log:\n{server.log_tail()}", flush=True)
+                return results
+        finally:
+            server.stop()
+            oembed.shutdown()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["all"] + list(SCENARIOS), default="all")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--videos-per-user", type=int, default=10)
+    parser.add_argument("--streams", type=int, default=2000)
+    parser.add_argument("--download-notes", type=int, default=20)
+    parser.add_argument("--downloads", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--oembed-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative throughput/latency regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Mint tokens with the key the server is started with
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.update_baseline:
+        baselines.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance)
+    for line in regressions:
+        print(f"FAIL: {line}")
+    if not regressions:
+        print("No regressions against baselines" if baselines else "No baselines to compare with (run with --update-baseline)")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,71 @@
 import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
+import asyncio
+import threading
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from google.cloud.sql.connector import Connector, IPTypes
 
-# Load .env
-load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+from backend.services import metrics
+
+ENVIRONMENT = os.getenv("ENVIRONMENT", "production")
+# SQLite URL for local development; used unless ENVIRONMENT is 'production'
+DATABASE_URL_LOCAL = os.getenv("DATABASE_URL_LOCAL")
+USE_LOCAL_DB = bool(DATABASE_URL_LOCAL) and ENVIRONMENT != "production"
 
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME")
 
-if not all([DB_USER, DB_PASS, DB_NAME, INSTANCE_CONNECTION_NAME]):
+# Per engine: the API uses the async engine, workers the sync one
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "2"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+if not USE_LOCAL_DB and not all([DB_USER, DB_PASS, DB_NAME, INSTANCE_CONNECTION_NAME]):
     raise RuntimeError("Missing required Cloud SQL environment variables")
 
-# Create ONE connector instance
-connector = Connector()
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+
+# Seconds a SQLite writer waits for the database lock before "database is locked"
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer (API and workers share the file)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def _async_sqlite_url(url: str) -> str:
+    return url.replace("sqlite://", "sqlite+aiosqlite://", 1) if url.startswith("sqlite://") else url
+
+# Cloud SQL connectors are built on first connection, not at import:
+# constructing one resolves credentials and starts a background thread
+_connector = None
+_connector_lock = threading.Lock()
+_async_connector = None
+_async_connector_lock = None
+
+def get_connector():
+    global _connector
+    if _connector is None:
+        with _connector_lock:
+            if _connector is None:
+                from google.cloud.sql.connector import Connector
+                _connector = Connector()
+    return _connector
 
 def getconn():
-    return connector.connect(
+    from google.cloud.sql.connector import IPTypes
+    return get_connector().connect(
         INSTANCE_CONNECTION_NAME,
         "pg8000",
         user=DB_USER,
@@ -29,16 +74,62 @@ def getconn():
         ip_type=IPTypes.PUBLIC,
     )
 
-engine = create_engine(
-    "postgresql+pg8000://",
-    creator=getconn,
-    pool_size=5,
-    max_overflow=2,
-    pool_timeout=30,
-    pool_recycle=1800,
-)
+async def get_async_connector():
+    # The async connector is bound to the event loop, so it is created from within it
+    global _async_connector, _async_connector_lock
+    if _async_connector is None:
+        if _async_connector_lock is None:
+            _async_connector_lock = asyncio.Lock()
+        async with _async_connector_lock:
+            if _async_connector is None:
+                from google.cloud.sql.connector import create_async_connector
+                _async_connector = await create_async_connector()
+    return _async_connector
+
+async def async_getconn():
+    from google.cloud.sql.connector import IPTypes
+    async_connector = await get_async_connector()
+    return await async_connector.connect_async(
+        INSTANCE_CONNECTION_NAME,
+        "asyncpg",
+        user=DB_USER,
+        password=DB_PASS,
+        db=DB_NAME,
+        ip_type=IPTypes.PUBLIC,
+    )
+
+if USE_LOCAL_DB:
+    # SQLite connections are shared across the API's threadpool and worker threads
+    engine = create_engine(
+        DATABASE_URL_LOCAL,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT},
+        **POOL_OPTIONS,
+    )
+    async_engine = create_async_engine(
+        _async_sqlite_url(DATABASE_URL_LOCAL),
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT},
+        **POOL_OPTIONS,
+    )
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+else:
+    engine = create_engine(
+        "postgresql+pg8000://",
+        creator=getconn,
+        **POOL_OPTIONS,
+    )
+    async_engine = create_async_engine(
+        "postgresql+asyncpg://",
+        async_creator=async_getconn,
+        **POOL_OPTIONS,
+    )
+
+metrics.instrument_pool(engine, "sync")
+metrics.instrument_pool(async_engine.sync_engine, "async")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attribute access after commit would need an implicit (sync) refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 def get_db():
@@ -47,3 +138,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def close_engines():
+    """
+    Disposes both engines and closes whichever connectors were created.
+    """
+    global _connector, _async_connector
+    await async_engine.dispose()
+    if _async_connector is not None:
+        await _async_connector.close_async()
+        _async_connector = None
+    await asyncio.to_thread(engine.dispose)
+    if _connector is not None:
+        await asyncio.to_thread(_connector.close)
+        _connector = None
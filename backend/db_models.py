@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, String, DateTime, Date, ForeignKey, Enum, Text, Index, Float, Boolean, JSON
 from sqlalchemy.orm import relationship
 from backend.database import Base
 import datetime
@@ -10,6 +10,13 @@ class NoteStatus(str, enum.Enum):
     READY = "ready"
     FAILED = "failed"
 
+class GenerationPath(str, enum.Enum):
+    TRANSCRIPT = "transcript"  # generated from captions
+    VIDEO = "video"            # generated from the whole video
+    SEGMENTED = "segmented"    # long video generated in parallel windows
+    CACHE = "cache"            # reused a note another request generated earlier
+    SHARED = "shared"          # joined a generation already in flight
+
 class User(Base):
     __tablename__ = "users"
 
@@ -28,9 +35,210 @@ class Note(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     video_id = Column(String, index=True, nullable=False)
     video_title = Column(String, nullable=True)
-    gcs_object_key = Column(String, nullable=True)
+    channel_title = Column(String, nullable=True)
+    duration_seconds = Column(Integer, nullable=True)
+    gcs_object_key = Column(String, nullable=True) # blob of the current version, kept while a regeneration runs
+    current_version_id = Column(Integer, nullable=True) # NoteVersion.id (no FK: the two tables would reference each other)
     status = Column(String, default=NoteStatus.PENDING) # Storing Enum as string for simplicity
+    generation_path = Column(String, nullable=True) # GenerationPath of the last successful generation
+    generation_ms = Column(Integer, nullable=True)
+    stage_timings = Column(JSON, nullable=True) # {"<stage>_ms": ...} of the last generation, see services/metrics.py
+    content_hash = Column(String, nullable=True) # sha256 of the markdown, used as the download ETag
+    content_size = Column(Integer, nullable=True) # uncompressed bytes
+    content_encoding = Column(String, nullable=True) # encoding the blob is stored with
+    indexed_content_hash = Column(String, nullable=True) # content_hash last written to the search index
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     owner = relationship("User", back_populates="notes")
+
+    __table_args__ = (
+        # Every lookup is by (user_id, video_id); also the create_note upsert's conflict target
+        Index("ix_notes_user_id_video_id", "user_id", "video_id", unique=True),
+        # Keyset pagination of a user's library, newest first
+        Index("ix_notes_user_id_updated_at_id", "user_id", "updated_at", "id"),
+    )
+
+class NoteVersion(Base):
+    """
+    One READY generation of a note, pointing at its content-addressed blob.
+    The note's current_version_id (and its content columns) switch to a new
+    version in the same UPDATE that marks it READY; `python -m backend.prune`
+    removes old versions and blobs nothing references.
+    """
+    __tablename__ = "note_versions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False)
+    blob_key = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True) # None for cache entries from before content hashes
+    content_size = Column(Integer, nullable=True)
+    content_encoding = Column(String, nullable=True)
+    generation_path = Column(String, nullable=True)
+    generation_ms = Column(Integer, nullable=True)
+    # Gemini usage of the generation (0 when it reused a cached or shared one), see services/usage.py
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    thinking_tokens = Column(Integer, nullable=True)
+    gemini_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # A note's versions, newest first
+        Index("ix_note_versions_note_id_id", "note_id", "id"),
+    )
+
+class NoteSection(Base):
+    """
+    One heading-delimited section of a note's markdown, as plain text.
+    Base table of the full-text index (see services/search.py): SQLite keeps
+    an FTS5 table in sync with it, Postgres a generated tsvector column.
+    """
+    __tablename__ = "note_sections"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    section_index = Column(Integer, nullable=False)
+    heading = Column(String, nullable=True)
+    body = Column(Text, nullable=False)
+
+class GenerationCache(Base):
+    """
+    Generated content shared across users, keyed on (video_id, prompt hash, model).
+    """
+    __tablename__ = "generation_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String, unique=True, index=True, nullable=False)
+    video_id = Column(String, index=True, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_hash = Column(String, nullable=False)
+    gcs_object_key = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True)
+    content_size = Column(Integer, nullable=True)
+    content_encoding = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class GenerationClaim(Base):
+    """
+    The worker currently generating a generation_cache key, so workers in
+    other processes wait for its result instead of calling Gemini too.
+    The holder renews expires_at while it runs; a crashed holder's claim
+    expires and a waiting worker takes over (see services/cache.py).
+    """
+    __tablename__ = "generation_claims"
+
+    cache_key = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+class Job(Base):
+    """
+    Durable generation job. Workers lease jobs for a visibility timeout;
+    a job whose lease expires is handed to another worker.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    video_id = Column(String, nullable=False)
+    video_url = Column(String, nullable=False)
+    status = Column(String, default=JobStatus.QUEUED, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    available_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    lease_expires_at = Column(DateTime, nullable=True)
+    locked_by = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    request_id = Column(String, nullable=True) # X-Request-ID of the API request that enqueued it, for log correlation
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_jobs_status_available_at", "status", "available_at"),
+        # Per-user in-flight counts for the fair scheduler
+        Index("ix_jobs_status_user_id", "status", "user_id"),
+    )
+
+class Batch(Base):
+    """
+    A group of notes requested together (a list of videos or a playlist),
+    tracked for aggregated progress.
+    """
+    __tablename__ = "batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    playlist_id = Column(String, nullable=True)
+    total = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class BatchNote(Base):
+    __tablename__ = "batch_notes"
+
+    batch_id = Column(Integer, ForeignKey("batches.id"), primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), primary_key=True)
+
+class RateLimitBucket(Base):
+    """
+    Per-user token bucket for admission control when buckets are shared
+    between API processes (ADMISSION_BACKEND=database, see services/admission.py).
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # epoch seconds
+    # Whether the last request was admitted, read back through RETURNING
+    granted = Column(Boolean, nullable=False)
+
+class UserCredential(Base):
+    """
+    A user's Google OAuth refresh token, encrypted (see services/credentials.py),
+    so every API process can act for the user after a login on any of them.
+    """
+    __tablename__ = "user_credentials"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    refresh_token_encrypted = Column(Text, nullable=False)
+    scopes = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class UsageDaily(Base):
+    """
+    Gemini usage per user per UTC day, added to in batches by every process
+    that generates (see services/usage.py). Counts failed generations too.
+    """
+    __tablename__ = "usage_daily"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    generations = Column(Integer, nullable=False, default=0)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    thinking_tokens = Column(Integer, nullable=False, default=0)
+    gemini_ms = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # Today's totals for quota checks and the usage report across users
+        Index("ix_usage_daily_day", "day"),
+    )
+
+class UserQuota(Base):
+    """
+    Per-user override of the daily token quota (USAGE_DAILY_TOKEN_QUOTA).
+    """
+    __tablename__ = "user_quotas"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    daily_token_limit = Column(Integer, nullable=True) # None: the default; 0: unlimited
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
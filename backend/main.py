@@ -1,37 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, Response
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse, Response, FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 import asyncio
 import json
 import logging
 import datetime
 
-from backend.auth import router as auth_router, get_current_user
-from backend.models import GenerateNotesRequest, GenerateNotesResponse
+from backend.auth import router as auth_router, get_current_user, remember_user_id, require_admin
+from typing import Optional
+from backend.models import (
+    GenerateNotesRequest, GenerateNotesResponse,
+    NoteStatusRequest, NoteStatusResponse, NoteListResponse, NoteSummary,
+    SearchResult, SearchResponse,
+    BatchGenerateRequest, BatchGenerateResponse, BatchProgress,
+    UsageDay, UsageResponse, UserUsage, UsageReportResponse, QuotaRequest, QuotaResponse,
+)
 from backend.db_models import NoteStatus
-from backend.services.gemini import generate_notes
-from backend.services.gcs import upload_note, get_note_content
-from backend.services import db as db_service
-from backend.database import engine, Base, get_db
-import requests
+from backend.services import downloads
+from backend.services import queue as job_queue
+from backend.services import db_async as db_service
+from backend.services import db as db_sync_service
+from backend.services import events
+from backend.services import metadata as metadata_service
+from backend.services import search as search_service
+from backend.services import batches
+from backend.services import user_events
+from backend.services import metrics
+from backend.services import logs
+from backend.services import usage as usage_service
+from backend.services import admission
+from backend.services.admission import admit_generation
+from backend.services.note_store import get_store, verify_local_signature
+from backend.database import get_async_db, AsyncSessionLocal
+from backend.resources import lifespan
+from starlette.concurrency import run_in_threadpool
 
-# Create Tables
-Base.metadata.create_all(bind=engine)
+# Schema changes are applied by `python -m backend.migrate`, not at import
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+SSE_KEEPALIVE_SECONDS = 15
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: queued JSON output, one access line per request (see services/logs.py)
+logs.configure_logging()
 logger = logging.getLogger(__name__)
 
-@app.middleware("http")
-async def log_origin(request: Request, call_next):
-    origin = request.headers.get("origin")
-    logger.info(f"Incoming request from origin: {origin}")
-    response = await call_next(request)
-    return response
-
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://www.youtube.com"], 
@@ -39,86 +52,75 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the extension: download filename, when to retry after 429/503, and the ID to quote in bug reports
+    expose_headers=["Content-Disposition", "Retry-After", "X-Request-ID"],
 )
+# Added last so it wraps everything, CORS preflights included
+app.add_middleware(logs.RequestContextMiddleware)
 
 app.include_router(auth_router)
 
-def get_video_title(video_url: str) -> str:
+# Keep references to fire-and-forget tasks so they aren't garbage collected mid-flight
+_background_tasks = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def resolve_note_metadata(note_id: int, video_id: str):
+    """
+    Fills in title/channel/duration after the endpoint has already responded.
+    """
+    with metrics.stage("metadata"):
+        meta = await metadata_service.get_video_metadata(video_id)
+    if meta is None:
+        meta = metadata_service.VideoMetadata(video_id=video_id, title=metadata_service.DEFAULT_TITLE)
     try:
-        if "youtube.com" in video_url or "youtu.be" in video_url:
-            oembed_url = f"https://www.youtube.com/oembed?url={video_url}&format=json"
-            resp = requests.get(oembed_url, timeout=5)
-            if resp.status_code == 200:
-                data = resp.json()
-                return data.get("title", "Untitled Video")
+        async with AsyncSessionLocal() as db:
+            await db_service.update_note_metadata(db, note_id, meta.title, meta.channel, meta.duration_seconds)
     except Exception as e:
-        logger.error(f"Error fetching video title: {e}")
-    return "YouTube Note"
+        logger.error(f"Error storing video metadata: {e}")
 
-def background_generate_note(db: Session, note_id: int, user_id: str, video_id: str, video_url: str):
+async def resolve_batch_metadata(notes):
     """
-    Background task to generate note and upload to GCS.
-    Updates DB status through the process.
+    Fills in titles for a batch's notes that had no cached metadata,
+    with batched Data API calls where possible.
     """
+    untitled = {note.video_id: note.id for note in notes if not note.video_title}
+    if not untitled:
+        return
+    with metrics.stage("metadata"):
+        found = await metadata_service.get_videos_metadata(untitled)
     try:
-        # Update status to generating
-        db_service.update_note_status(db, note_id, NoteStatus.GENERATING)
-
-        # 1. Generate Content
-        try:
-            content = generate_notes(video_url)
-        except Exception as e:
-            logger.error(f"Gemini generation failed: {e}")
-            db_service.update_note_status(db, note_id, NoteStatus.FAILED)
-            return
-
-        # 2. Upload to GCS
-        try:
-            gcs_key = upload_note(user_id, video_id, content)
-        except Exception as e:
-            logger.error(f"GCS upload failed: {e}")
-            db_service.update_note_status(db, note_id, NoteStatus.FAILED)
-            return
-
-        # 3. Update Status to Ready
-        db_service.update_note_status(db, note_id, NoteStatus.READY, gcs_key)
-        
-        logger.info(f"Note generated successfully for user {user_id} video {video_id}")
-
+        async with AsyncSessionLocal() as db:
+            for video_id, note_id in untitled.items():
+                meta = found.get(video_id) or metadata_service.VideoMetadata(video_id=video_id, title=metadata_service.DEFAULT_TITLE)
+                await db.execute(db_sync_service.note_metadata_statement(note_id, meta.title, meta.channel, meta.duration_seconds))
+            await db.commit()
     except Exception as e:
-        logger.exception(f"Unexpected error in background task: {e}")
-        try:
-             db_service.update_note_status(db, note_id, NoteStatus.FAILED)
-        except:
-            pass
-    finally:
-        db.close() # Important for background tasks in a separate thread context if manually managed, 
-                   # but here we used a fresh session typically or need to be careful. 
-                   # Simplest is to pass a new session generator or handle it.
-                   # Actually, Dependency injection sessions are closed after request.
-                   # For background tasks, we need a fresh session.
-        pass
-
-# Wrapper for background task to manage session
-def run_background_generate_task(note_id: int, user_id: str, video_id: str, video_url: str):
-    db = next(get_db())
-    try:
-        background_generate_note(db, note_id, user_id, video_id, video_url)
-    finally:
-        db.close()
+        logger.error(f"Error storing batch video metadata: {e}")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus scrape endpoint for this process.
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-@app.post("/generate-notes", response_model=GenerateNotesResponse)
+@app.post("/generate-notes", response_model=GenerateNotesResponse, dependencies=[Depends(admit_generation)])
 async def generate_notes_endpoint(
     request: GenerateNotesRequest,
-    background_tasks: BackgroundTasks,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user_id = user.get("sub")
-    email = user.get("email")
-    
-    # Ensure user exists in DB (syncing local DB with Auth info)
-    db_user = db_service.get_or_create_user(db, user_id, email)
+    # Tokens issued at login carry the internal user id; older ones need the
+    # user upserted once (committed together with the note below)
+    db_user_id = user.get("uid")
+    if db_user_id is None:
+        db_user = await db_service.get_or_create_user(db, user.get("sub"), user.get("email"), commit=False)
+        db_user_id = db_user.id
 
     video_id = request.videoId
     if not video_id:
@@ -127,18 +129,286 @@ async def generate_notes_endpoint(
         else:
              raise HTTPException(status_code=400, detail="Could not extract video ID")
 
-    video_title = get_video_title(request.videoUrl)
+    # Title lookups never block the response: use the cache if warm,
+    # otherwise resolve it in the background
+    meta = metadata_service.get_cached_metadata(video_id)
 
     # Create Initial Note Record
-    note = db_service.create_note(db, db_user.id, video_id, video_title)
+    if meta:
+        note = await db_service.create_note(db, db_user_id, video_id, meta.title, meta.channel, meta.duration_seconds)
+    else:
+        note = await db_service.create_note(db, db_user_id, video_id)
+        spawn_background(resolve_note_metadata(note.id, video_id))
     
-    background_tasks.add_task(run_background_generate_task, note.id, str(db_user.id), video_id, request.videoUrl)
+    await job_queue.enqueue_job_if_idle_async(db, note.id, db_user_id, video_id, request.videoUrl)
+    remember_user_id(user, db_user_id)
 
     return GenerateNotesResponse(
         message="Note generation started",
         videoId=video_id
     )
 
+@app.post("/batches", response_model=BatchGenerateResponse)
+async def create_batch(
+    request: BatchGenerateRequest,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Starts note generation for a list of videos and/or a playlist.
+    Jobs are scheduled fairly against other users' work, so a batch costs
+    one admission token however many videos it has, but all of them have
+    to fit in the queue (admission.admit).
+    """
+    video_ids, skipped = batches.parse_video_urls(request.videoUrls)
+    playlist_id = None
+    if request.playlistUrl:
+        playlist_id = batches.extract_playlist_id(request.playlistUrl)
+        if not playlist_id:
+            raise HTTPException(status_code=400, detail="Could not extract playlist ID")
+        try:
+            playlist_ids = await metadata_service.get_playlist_video_ids(playlist_id, batches.MAX_BATCH_VIDEOS)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        video_ids = list(dict.fromkeys(video_ids + playlist_ids))
+
+    if not video_ids:
+        raise HTTPException(status_code=400, detail="No videos to generate")
+    if len(video_ids) > batches.MAX_BATCH_VIDEOS:
+        raise HTTPException(status_code=400, detail=f"At most {batches.MAX_BATCH_VIDEOS} videos per batch")
+    await admission.admit(db, user, len(video_ids))
+
+    batch, notes = await batches.create_batch(db, user.get("sub"), user.get("email"), video_ids, playlist_id, user.get("uid"))
+    remember_user_id(user, batch.user_id)
+    spawn_background(resolve_batch_metadata(notes))
+
+    return BatchGenerateResponse(batchId=batch.id, total=batch.total, videoIds=video_ids, skipped=skipped)
+
+@app.get("/batches/{batch_id}", response_model=BatchProgress)
+async def get_batch_progress(
+    batch_id: int,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    batch = await batches.get_batch(db, batch_id, user.get("sub"))
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return BatchProgress(**batches.summarize(batch.id, await batches.get_batch_statuses(db, batch.id)))
+
+@app.get("/batches/{batch_id}/events")
+async def batch_events(
+    batch_id: int,
+    request: Request,
+    user: dict = Depends(get_current_user),
+):
+    """
+    SSE stream of aggregated progress for a whole batch: one event with the
+    per-status counts whenever any of its notes changes status.
+    """
+    google_id = user.get("sub")
+
+    async def event_generator():
+        async with AsyncSessionLocal() as db:
+            batch = await batches.get_batch(db, batch_id, google_id)
+            if not batch:
+                yield f"data: {json.dumps({'status': 'error'})}\n\n"
+                return
+            # Subscribe before reading the statuses so no update can slip in between
+            subscription = events.get_broker().subscribe(events.user_topic(batch.user_id))
+            try:
+                statuses = await batches.get_batch_statuses(db, batch.id)
+            except Exception:
+                subscription.close()
+                raise
+
+        with subscription, metrics.sse_streams_open.track(stream="batch"):
+            summary = batches.summarize(batch_id, statuses)
+            yield f"data: {json.dumps(summary)}\n\n"
+            while not summary["done"]:
+                if await request.is_disconnected():
+                    break
+                message = await subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                note_id = message.get("noteId")
+                if message.get("type") != "status" or note_id not in statuses or statuses[note_id] == message["status"]:
+                    continue
+                statuses[note_id] = message["status"]
+                summary = batches.summarize(batch_id, statuses)
+                yield f"data: {json.dumps(summary)}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+def note_summary(note) -> NoteSummary:
+    return NoteSummary(
+        videoId=note.video_id,
+        status=note.status,
+        downloadable=downloads.has_ready_version(note),
+        title=note.video_title,
+        channel=note.channel_title,
+        durationSeconds=note.duration_seconds,
+        updatedAt=note.updated_at,
+    )
+
+@app.post("/notes/status", response_model=NoteStatusResponse)
+async def notes_status(
+    request: NoteStatusRequest,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Statuses for a batch of videos (e.g. everything on a YouTube page) in one query.
+    Videos without a note are left out.
+    """
+    if not request.videoIds:
+        return NoteStatusResponse(notes=[])
+    notes = await db_service.get_notes_by_video_ids(db, user.get("sub"), request.videoIds)
+    return NoteStatusResponse(notes=[note_summary(note) for note in notes])
+
+@app.get("/notes", response_model=NoteListResponse)
+async def list_notes(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    status: Optional[NoteStatus] = None,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    The user's notes, most recently updated first, keyset-paginated via nextCursor.
+    """
+    try:
+        notes, next_cursor = await db_service.list_notes(db, user.get("sub"), limit, cursor, status)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return NoteListResponse(notes=[note_summary(note) for note in notes], nextCursor=next_cursor)
+
+@app.get("/notes/search", response_model=SearchResponse)
+async def search_notes(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Ranked full-text search over the sections of the user's notes.
+    """
+    rows = await search_service.search_notes(db, user.get("sub"), q, limit)
+    return SearchResponse(results=[
+        SearchResult(
+            videoId=row["video_id"],
+            title=row["video_title"],
+            heading=row["heading"],
+            snippet=row["snippet"],
+            score=row["score"],
+        )
+        for row in rows
+    ])
+
+@app.get("/usage", response_model=UsageResponse)
+async def get_usage(
+    days: int = Query(30, ge=1, le=366),
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    The user's Gemini usage per UTC day and their daily quota. Trails live
+    usage by up to USAGE_FLUSH_SECONDS.
+    """
+    rows, limit = await usage_service.get_user_usage(db, user.get("sub"), days)
+    if limit is None:
+        limit = usage_service.USAGE_DAILY_TOKEN_QUOTA
+    usage_days = [
+        UsageDay(
+            day=row.day,
+            generations=row.generations,
+            inputTokens=row.input_tokens,
+            outputTokens=row.output_tokens,
+            thinkingTokens=row.thinking_tokens,
+            geminiMs=row.gemini_ms,
+            estimatedCostUsd=usage_service.estimate_cost_usd(row.input_tokens, row.output_tokens, row.thinking_tokens),
+        )
+        for row in rows
+    ]
+    today = datetime.datetime.utcnow().date()
+    return UsageResponse(
+        days=usage_days,
+        totalTokens=sum(d.inputTokens + d.outputTokens + d.thinkingTokens for d in usage_days),
+        estimatedCostUsd=round(sum(d.estimatedCostUsd for d in usage_days), 6),
+        dailyTokenLimit=limit or None,
+        usedToday=sum(d.inputTokens + d.outputTokens + d.thinkingTokens for d in usage_days if d.day == today),
+    )
+
+@app.get("/usage/report", response_model=UsageReportResponse)
+async def usage_report(
+    days: int = Query(1, ge=1, le=366),
+    limit: int = Query(50, ge=1, le=500),
+    admin: dict = Depends(require_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Heaviest users over the last `days` UTC days (admins only).
+    """
+    since = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)
+    rows = await usage_service.get_top_users(db, since, limit)
+    users = [
+        UserUsage(
+            googleId=google_id,
+            email=email,
+            generations=generations,
+            inputTokens=input_tokens,
+            outputTokens=output_tokens,
+            thinkingTokens=thinking_tokens,
+            geminiMs=gemini_ms,
+            estimatedCostUsd=usage_service.estimate_cost_usd(input_tokens, output_tokens, thinking_tokens),
+        )
+        for google_id, email, generations, input_tokens, output_tokens, thinking_tokens, gemini_ms in rows
+    ]
+    return UsageReportResponse(since=since, users=users, estimatedCostUsd=round(sum(u.estimatedCostUsd for u in users), 6))
+
+@app.put("/usage/quotas/{google_id}", response_model=QuotaResponse)
+async def set_usage_quota(
+    google_id: str,
+    request: QuotaRequest,
+    admin: dict = Depends(require_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Sets a user's daily token quota (admins only). API processes enforce it
+    from their next usage refresh, within USAGE_FLUSH_SECONDS.
+    """
+    if not await usage_service.set_quota(db, google_id, request.dailyTokenLimit):
+        raise HTTPException(status_code=404, detail="User not found")
+    return QuotaResponse(googleId=google_id, dailyTokenLimit=request.dailyTokenLimit)
+
+@app.get("/events")
+async def user_events_endpoint(
+    request: Request,
+    user: dict = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    One SSE stream with status updates for all of the user's notes.
+    Reconnect with Last-Event-ID to resume where the stream left off.
+    """
+    google_id = user.get("sub")
+    refused = user_events.open_connection(google_id)
+    if refused == "user":
+        raise HTTPException(status_code=429, detail="Too many open event streams", headers={"Retry-After": "30"})
+    if refused == "global":
+        raise HTTPException(status_code=503, detail="Event streams at capacity", headers={"Retry-After": "30"})
+    slot = user_events.ConnectionSlot(google_id)
+    try:
+        return user_events.EventStreamResponse(
+            user_events.stream(request, slot, last_event_id),
+            slot,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    except Exception:
+        slot.release()
+        raise
+
 @app.get("/notes/{video_id}/events")
 async def note_events(
     video_id: str,
@@ -146,75 +416,105 @@ async def note_events(
     user: dict = Depends(get_current_user),
 ):
     """
-    SSE endpoint to stream status updates.
+    SSE endpoint to stream status updates for one video.
+    While a note is generating, markdown deltas are sent as `delta` events.
+    Clients that only need statuses should use the multiplexed /events stream.
     """
     user_id = user.get("sub")
     
     async def event_generator():
-        # Create a new DB session for polling since this is a long running generator 
-        # and we don't want to hold the request session or share it improperly
-        while True:
-            if await request.is_disconnected():
-                break
-
-            # Poll DB
-            db = next(get_db())
+        # One DB read up front; after that updates are pushed through the broker
+        async with AsyncSessionLocal() as db:
+            db_user = await db_service.get_user_by_google_id(db, user_id)
+            if not db_user:
+                yield f"data: {json.dumps({'status': 'error'})}\n\n"
+                return
+            # Subscribe before reading the note so no update can slip in between
+            subscription = events.get_broker().subscribe(
+                events.user_topic(db_user.id),
+                events.generation_topic(video_id),
+            )
             try:
-                db_user = db_service.get_user_by_google_id(db, user_id)
-                if not db_user:
-                     yield f"data: {json.dumps({'status': 'error'})}\n\n"
-                     break
-                     
-                note = db_service.get_note(db, db_user.id, video_id)
-                status = note.status if note else "unknown"
-                
-                data = json.dumps({"status": status})
-                yield f"data: {data}\n\n"
+                note = await db_service.get_note(db, db_user.id, video_id)
+            except Exception:
+                subscription.close()
+                raise
+            status = note.status if note else "unknown"
+
+        with subscription, metrics.sse_streams_open.track(stream="note"):
+            yield f"data: {json.dumps({'status': status})}\n\n"
+            if status in [NoteStatus.READY, NoteStatus.FAILED]:
+                return
+
+            while True:
+                if await request.is_disconnected():
+                    break
+
+                message = await subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                if message.get("videoId") != video_id:
+                    continue
+                if message.get("type") == "delta":
+                    yield f"event: delta\ndata: {json.dumps({'text': message['text']})}\n\n"
+                    continue
+
+                status = message["status"]
+                yield f"data: {json.dumps({'status': status})}\n\n"
 
                 if status in [NoteStatus.READY, NoteStatus.FAILED]:
                     break
-            finally:
-                db.close()
-            
-            await asyncio.sleep(2) 
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @app.get("/notes/{video_id}/download")
 async def download_note(
     video_id: str,
+    request: Request,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     user_id = user.get("sub")
     
-    db_user = db_service.get_user_by_google_id(db, user_id)
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
+    note = await db_service.get_note_for_google_user(db, user_id, video_id)
 
-    note = db_service.get_note(db, db_user.id, video_id)
-    
-    if not note or note.status != NoteStatus.READY:
+    # While a regeneration runs, the last READY version is served
+    if not note or not downloads.has_ready_version(note):
         raise HTTPException(status_code=404, detail="Note not ready or not found")
     
     gcs_key = note.gcs_object_key
     if not gcs_key:
          # Fallback logic should ideally not happen if status is READY
-         gcs_key = f"notes/user_{db_user.id}/{video_id}.md"
+         gcs_key = f"notes/user_{note.user_id}/{video_id}.md"
 
+    filename = f"{note.video_title or 'Note'}.md".replace("/", "-")
     try:
-        content = get_note_content(gcs_key)
+        if downloads.should_redirect(note):
+            return await downloads.build_redirect_response(gcs_key, filename)
+        return await downloads.build_download_response(request, note, gcs_key, filename)
     except Exception as e:
-        logger.error(f"Error fetching from GCS: {e}")
+        logger.error(f"Error fetching note content: {e}")
         raise HTTPException(status_code=500, detail="Error fetching note content")
 
-    filename = f"{note.video_title or 'Note'}.md".replace("/", "-")
-    return Response(
-        content=content,
-        media_type="text/markdown",
-        headers={"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    )
-
-@app.on_event("shutdown")
-def shutdown():
-    connector.close()
+@app.get("/local-store/{key:path}")
+async def local_store_download(key: str, expires: int, disposition: str, signature: str, request: Request):
+    """
+    Serves LocalNoteStore signed URLs, standing in for GCS in redirect mode.
+    """
+    if not verify_local_signature(key, expires, disposition, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    store = get_store()
+    path = store.local_path(key)
+    if not path:
+        raise HTTPException(status_code=404, detail="Not found")
+    info = await run_in_threadpool(store.stat, key)
+    headers = {"Content-Disposition": disposition, "Cache-Control": "private, no-store"}
+    if info.encoding and info.encoding not in downloads.accepted_encodings(request):
+        # Like GCS decompressive transcoding for clients without that encoding
+        content = await run_in_threadpool(store.get_text, key)
+        return Response(content=content, media_type="text/markdown", headers=headers)
+    if info.encoding:
+        headers["Content-Encoding"] = info.encoding
+    return FileResponse(path, media_type="text/markdown", headers=headers)
@@ -0,0 +1,67 @@
+"""
+Explicit schema migration step, run before deploying a new version:
+
+    python -m backend.migrate
+
+Creates missing tables, adds columns and indexes that were added to the models
+since a table was created. Only additive changes are made; anything else
+(renames, type changes, drops) needs a hand-written step.
+"""
+import logging
+from typing import List
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+
+from backend import db_models  # registers the models on Base.metadata
+from backend.database import engine as default_engine, Base
+from backend.services.search import create_search_index
+
+logger = logging.getLogger(__name__)
+
+def _add_column_sql(engine: Engine, table, column) -> str:
+    preparer = engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=engine.dialect)
+    return f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+
+def migrate(engine: Engine = default_engine) -> List[str]:
+    """
+    Brings the database schema up to the models. Returns the changes applied.
+    """
+    changes = []
+    existing_tables = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(bind=engine)
+    changes.extend(f"create table {t.name}" for t in Base.metadata.sorted_tables if t.name not in existing_tables)
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    if not column.nullable and column.server_default is None:
+                        raise RuntimeError(f"Can't add NOT NULL column {table.name}.{column.name} without a server default")
+                    conn.exec_driver_sql(_add_column_sql(engine, table, column))
+                    changes.append(f"add column {table.name}.{column.name}")
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    # Unique indexes fail here if existing rows violate them; clean those up first
+                    conn.execute(CreateIndex(index))
+                    changes.append(f"create index {index.name}")
+    # Full-text index objects the models can't express (FTS5 table / tsvector column)
+    create_search_index(engine)
+    return changes
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    changes = migrate()
+    for change in changes:
+        logger.info(f"Applied: {change}")
+    logger.info(f"Schema is up to date ({len(changes)} changes applied)")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+import datetime
 import enum
 
 class NoteStatus(str, enum.Enum):
@@ -17,6 +18,102 @@ class GenerateNotesResponse(BaseModel):
     message: str
     videoId: str
 
+# Enough for every video on a YouTube page (watch page, sidebar, home grid)
+MAX_STATUS_BATCH = 200
+
+class NoteStatusRequest(BaseModel):
+    videoIds: List[str] = Field(max_length=MAX_STATUS_BATCH)
+
+class NoteSummary(BaseModel):
+    videoId: str
+    status: str
+    # A READY version can be downloaded, also while a regeneration is running
+    downloadable: bool = False
+    title: Optional[str] = None
+    channel: Optional[str] = None
+    durationSeconds: Optional[int] = None
+    updatedAt: Optional[datetime.datetime] = None
+
+class NoteStatusResponse(BaseModel):
+    # Only videos the user has a note for
+    notes: List[NoteSummary]
+
+class NoteListResponse(BaseModel):
+    notes: List[NoteSummary]
+    # Pass back as `cursor` for the next page; None on the last page
+    nextCursor: Optional[str] = None
+
+class BatchGenerateRequest(BaseModel):
+    # Video URLs or IDs, and/or a playlist URL or ID
+    videoUrls: List[str] = Field(default_factory=list, max_length=500)
+    playlistUrl: Optional[str] = None
+
+class BatchGenerateResponse(BaseModel):
+    batchId: int
+    total: int
+    videoIds: List[str]
+    # Inputs that weren't recognised as YouTube videos
+    skipped: List[str] = Field(default_factory=list)
+
+class BatchProgress(BaseModel):
+    batchId: int
+    total: int
+    counts: Dict[str, int]
+    done: bool
+
+class SearchResult(BaseModel):
+    videoId: str
+    title: Optional[str] = None
+    heading: Optional[str] = None
+    # Note text with matches wrapped in <mark></mark>; escape everything else before rendering
+    snippet: str
+    score: float
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+class UsageDay(BaseModel):
+    day: datetime.date
+    generations: int
+    inputTokens: int
+    outputTokens: int
+    thinkingTokens: int
+    geminiMs: int
+    estimatedCostUsd: float
+
+class UsageResponse(BaseModel):
+    # Newest first; days without generations are left out
+    days: List[UsageDay]
+    totalTokens: int
+    estimatedCostUsd: float
+    # None: no daily quota
+    dailyTokenLimit: Optional[int] = None
+    usedToday: int
+
+class UserUsage(BaseModel):
+    googleId: str
+    email: str
+    generations: int
+    inputTokens: int
+    outputTokens: int
+    thinkingTokens: int
+    geminiMs: int
+    estimatedCostUsd: float
+
+class UsageReportResponse(BaseModel):
+    since: datetime.date
+    # Heaviest users first
+    users: List[UserUsage]
+    estimatedCostUsd: float
+
+class QuotaRequest(BaseModel):
+    # Tokens per UTC day, 0 for unlimited; None resets to the default
+    dailyTokenLimit: Optional[int] = Field(default=None, ge=0)
+
+class QuotaResponse(BaseModel):
+    googleId: str
+    dailyTokenLimit: Optional[int] = None
+
 class User(BaseModel):
     google_id: str
     email: str
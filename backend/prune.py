@@ -0,0 +1,99 @@
+"""
+Garbage collection for note storage:
+
+    python -m backend.prune              # delete old versions and unreferenced blobs
+    python -m backend.prune --dry-run    # only report what would go
+
+Each note keeps its NOTE_VERSIONS_KEPT newest versions, and always its
+current one; older version rows are deleted. Then every stored note blob (current
+content-addressed ones and legacy per-user / per-video keys) that no note,
+version or generation cache entry references is deleted, once it is older
+than PRUNE_GRACE_SECONDS: a generation uploads its blob before committing
+the rows that point at it. Safe to run alongside the API and workers.
+"""
+import os
+import argparse
+import datetime
+import logging
+
+from sqlalchemy import select, delete, func, union
+
+from backend import db_models
+from backend.database import SessionLocal
+from backend.services.gcs import CONTENT_PREFIXES
+from backend.services.note_store import get_store
+
+logger = logging.getLogger(__name__)
+
+NOTE_VERSIONS_KEPT = int(os.getenv("NOTE_VERSIONS_KEPT", "3"))
+PRUNE_GRACE_SECONDS = int(os.getenv("PRUNE_GRACE_SECONDS", "86400"))
+
+def stale_versions_query(keep: int):
+    """
+    IDs of versions beyond the newest `keep` of their note that aren't current.
+    """
+    Version = db_models.NoteVersion
+    Note = db_models.Note
+    ranked = select(
+        Version.id,
+        func.row_number().over(partition_by=Version.note_id, order_by=Version.id.desc()).label("rank"),
+    ).subquery()
+    current = select(Note.current_version_id).where(Note.current_version_id.isnot(None))
+    return select(ranked.c.id).where(ranked.c.rank > keep, ranked.c.id.not_in(current))
+
+def referenced_keys_query(keep: int):
+    """
+    Blob keys still in use once the stale versions are gone.
+    """
+    Note = db_models.Note
+    Version = db_models.NoteVersion
+    return union(
+        select(Version.blob_key).where(Version.id.not_in(stale_versions_query(keep))),
+        select(Note.gcs_object_key).where(Note.gcs_object_key.isnot(None)),
+        select(db_models.GenerationCache.gcs_object_key),
+    )
+
+def prune(dry_run: bool = False, keep: int = NOTE_VERSIONS_KEPT, grace_seconds: int = PRUNE_GRACE_SECONDS) -> dict:
+    """
+    Returns counts of what was (or, with dry_run, would be) deleted.
+    """
+    stats = {"versions": 0, "blobs": 0, "bytes": 0}
+    db = SessionLocal()
+    try:
+        stale = db.scalars(stale_versions_query(keep)).all()
+        stats["versions"] = len(stale)
+        if stale and not dry_run:
+            db.execute(delete(db_models.NoteVersion).where(db_models.NoteVersion.id.in_(stale)))
+            db.commit()
+        referenced = set(db.scalars(referenced_keys_query(keep)).all())
+    finally:
+        db.close()
+
+    store = get_store()
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace_seconds)
+    for prefix in CONTENT_PREFIXES:
+        for key, info in store.list_blobs(prefix):
+            if key in referenced or info.updated_at is None or info.updated_at > cutoff:
+                continue
+            if not dry_run:
+                try:
+                    store.delete(key)
+                except Exception as e:
+                    logger.error(f"Failed to delete blob {key}: {e}")
+                    continue
+            stats["blobs"] += 1
+            stats["bytes"] += info.size
+    return stats
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Delete old note versions and unreferenced note blobs")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be deleted without deleting it")
+    parser.add_argument("--keep", type=int, default=NOTE_VERSIONS_KEPT, help="newest versions kept per note (the current one is always kept)")
+    args = parser.parse_args()
+    stats = prune(args.dry_run, args.keep)
+    verb = "Would delete" if args.dry_run else "Deleted"
+    logger.info(f"{verb} {stats['versions']} note versions and {stats['blobs']} blobs ({stats['bytes']} bytes)")
+
+if __name__ == "__main__":
+    main()
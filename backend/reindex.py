@@ -0,0 +1,65 @@
+"""
+Backfills the full-text search index:
+
+    python -m backend.reindex          # READY notes whose content isn't indexed yet
+    python -m backend.reindex --all    # every READY note
+
+Reads each note's content from the note store. Safe to re-run and to run
+alongside workers.
+"""
+import argparse
+import logging
+
+from sqlalchemy import select, or_
+
+from backend import db_models
+from backend.db_models import NoteStatus
+from backend.database import SessionLocal
+from backend.services import search
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+def pending_notes_query(reindex_all: bool, after_id: int):
+    Note = db_models.Note
+    query = select(Note).where(Note.status == NoteStatus.READY, Note.id > after_id)
+    if not reindex_all:
+        query = query.where(or_(
+            Note.indexed_content_hash.is_(None),
+            Note.indexed_content_hash != Note.content_hash,
+        ))
+    return query.order_by(Note.id).limit(BATCH_SIZE)
+
+def reindex(reindex_all: bool = False) -> int:
+    indexed, failed, last_id = 0, 0, 0
+    db = SessionLocal()
+    try:
+        while True:
+            notes = db.scalars(pending_notes_query(reindex_all, last_id)).all()
+            if not notes:
+                break
+            for note in notes:
+                last_id = note.id
+                try:
+                    search.index_stored_note(db, note)
+                    indexed += 1
+                except Exception as e:
+                    db.rollback()
+                    failed += 1
+                    logger.error(f"Failed to index note {note.id}: {e}")
+            logger.info(f"Indexed {indexed} notes so far ({failed} failed)")
+    finally:
+        db.close()
+    return indexed
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Backfill the note search index")
+    parser.add_argument("--all", action="store_true", help="reindex every READY note, not just unindexed ones")
+    args = parser.parse_args()
+    count = reindex(args.all)
+    logger.info(f"Done: indexed {count} notes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Process-wide resources owned by the API's lifespan.
+
+Clients (database engines and connectors, note store, Gemini executor, event
+broker, metadata and OAuth HTTP clients) are created lazily on first use, so importing
+the app stays cheap. Startup warms them concurrently so the first request
+doesn't pay for it, and shutdown closes whatever was created.
+"""
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from starlette.concurrency import run_in_threadpool
+
+from backend import auth
+from backend import database
+from backend.worker import WorkerPool, WORKER_MODE
+from backend.services import events
+from backend.services import metadata as metadata_service
+from backend.services import usage
+from backend.services.note_store import get_store, close_store
+from backend.services.gemini_executor import get_executor, close_executor
+
+logger = logging.getLogger(__name__)
+
+# Local dev convenience; deployments run `python -m backend.migrate` instead
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "false").lower() == "true"
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+async def _ping_database():
+    from sqlalchemy import text
+    async with database.async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+class Resources:
+    def __init__(self):
+        self.worker_pool = WorkerPool() if WORKER_MODE == "inprocess" else None
+
+    async def start(self):
+        if RUN_MIGRATIONS_ON_STARTUP:
+            from backend.migrate import migrate
+            await run_in_threadpool(migrate)
+        if WARMUP_ON_STARTUP:
+            await self.warm_up()
+        # Flushes in-process workers' usage and keeps quota totals fresh for admission
+        usage.get_aggregator().start()
+        if self.worker_pool:
+            self.worker_pool.start()
+
+    async def warm_up(self):
+        """
+        Opens a DB connection and builds the clients concurrently.
+        Failures are only logged: everything is retried lazily on first use.
+        """
+        started = time.monotonic()
+        tasks = {
+            "database": _ping_database(),
+            "note store": run_in_threadpool(get_store),
+            "event broker": run_in_threadpool(events.get_broker),
+        }
+        if self.worker_pool:
+            # Only in-process workers call Gemini from this process
+            tasks["gemini"] = run_in_threadpool(get_executor)
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for name, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warm-up of {name} failed: {result}")
+        metadata_service.get_client()
+        logger.info(f"Resources warmed up in {int((time.monotonic() - started) * 1000)}ms")
+
+    async def close(self):
+        if self.worker_pool:
+            await run_in_threadpool(self.worker_pool.stop)
+        await run_in_threadpool(usage.get_aggregator().stop)
+        await metadata_service.close()
+        await auth.close()
+        for close in (events.close_broker, close_executor, close_store):
+            try:
+                await run_in_threadpool(close)
+            except Exception as e:
+                logger.error(f"Error closing resource: {e}")
+        await database.close_engines()
+
+@asynccontextmanager
+async def lifespan(app):
+    resources = Resources()
+    app.state.resources = resources
+    await resources.start()
+    try:
+        yield
+    finally:
+        await resources.close()
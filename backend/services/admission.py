@@ -0,0 +1,231 @@
+"""
+Admission control for endpoints that start generations.
+
+These checks run before any work is created:
+  - queue depth: when the fleet already has MAX_QUEUE_DEPTH jobs queued or
+    running, new work is shed with 503 (the count is read from the jobs
+    table, so it holds across processes, and cached briefly per process)
+  - active jobs per user: at most MAX_ACTIVE_JOBS_PER_USER queued or running
+    at once, so one user can't fill the fleet's queue (429)
+  - daily token quota: a user who has used up their Gemini tokens for the
+    UTC day gets 429 (read from memory, see services/usage.py)
+  - per-user token bucket: GENERATE_RATE_PER_MINUTE sustained, GENERATE_BURST
+    at once, keyed by the user's Google `sub`; exceeding it returns 429
+
+A batch is admitted as a whole (admit() with its video count): all of its
+videos must fit under both limits, and it takes one rate limit token.
+
+All responses carry Retry-After. ADMISSION_BACKEND selects where buckets live:
+  - "memory": per process (local dev, single process)
+  - "database": one row per user, updated with a single upsert, so the
+    limit is shared by every API process
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import select, func, case, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import db_models
+from backend.auth import get_current_user
+from backend.database import get_async_db, AsyncSessionLocal
+from backend.services import db as db_sync
+from backend.services import metrics
+from backend.services import usage
+from backend.services.queue import ACTIVE_JOB_STATUSES
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")
+GENERATE_RATE_PER_MINUTE = float(os.getenv("GENERATE_RATE_PER_MINUTE", "6"))
+GENERATE_BURST = float(os.getenv("GENERATE_BURST", "10"))
+# Queued + running jobs across the fleet above which new work is refused; 0 disables
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "500"))
+QUEUE_DEPTH_CACHE_SECONDS = float(os.getenv("QUEUE_DEPTH_CACHE_SECONDS", "2"))
+QUEUE_FULL_RETRY_AFTER_SECONDS = int(os.getenv("QUEUE_FULL_RETRY_AFTER_SECONDS", "30"))
+# Queued + running jobs one user may have; 0 disables
+MAX_ACTIVE_JOBS_PER_USER = int(os.getenv("MAX_ACTIVE_JOBS_PER_USER", "200"))
+# Buckets kept by the memory backend; the least recently used are dropped (and refilled)
+MAX_TRACKED_USERS = int(os.getenv("ADMISSION_MAX_TRACKED_USERS", "100000"))
+
+class InMemoryRateLimiter:
+    """
+    Token buckets in this process. Each API process enforces the limit on
+    its own, so with N processes a user can get up to N times the rate.
+    """
+
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.burst = burst
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    async def acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        Takes cost tokens from key's bucket. Returns 0 if they were taken,
+        otherwise the seconds until they will be available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_TRACKED_USERS:
+                self._buckets.popitem(last=False)
+        return wait
+
+class DatabaseRateLimiter:
+    """
+    Token buckets in the rate_limit_buckets table. Refill, check and take
+    happen in one INSERT ... ON CONFLICT DO UPDATE, so concurrent requests
+    from any process can't both take the last token.
+    """
+
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.burst = burst
+
+    def acquire_statement(self, db, key: str, cost: float, now: float):
+        Bucket = db_models.RateLimitBucket
+        stmt = db_sync._insert(db, Bucket).values(key=key, tokens=self.burst - cost, updated_at=now, granted=True)
+        # SET expressions see the row as it was; clock skew between processes never removes tokens
+        elapsed = case((literal(now) > Bucket.updated_at, literal(now) - Bucket.updated_at), else_=0.0)
+        refilled = Bucket.tokens + elapsed * self.rate
+        level = case((refilled > self.burst, literal(self.burst)), else_=refilled)
+        return stmt.on_conflict_do_update(
+            index_elements=[Bucket.key],
+            set_={
+                "tokens": case((level >= cost, level - cost), else_=level),
+                "granted": level >= cost,
+                "updated_at": case((literal(now) > Bucket.updated_at, literal(now)), else_=Bucket.updated_at),
+            },
+        ).returning(Bucket.tokens, Bucket.granted)
+
+    async def acquire(self, key: str, cost: float = 1.0) -> float:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(self.acquire_statement(db, key, cost, time.time()))
+            tokens, granted = result.one()
+            await db.commit()
+        return 0.0 if granted else (cost - tokens) / self.rate
+
+RATE_LIMITERS = {
+    "memory": InMemoryRateLimiter,
+    "database": DatabaseRateLimiter,
+}
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RATE_LIMITERS[ADMISSION_BACKEND](GENERATE_RATE_PER_MINUTE / 60, GENERATE_BURST)
+    return _limiter
+
+def set_rate_limiter(limiter):
+    """
+    Replaces the process-wide limiter (tests, benchmarks).
+    """
+    global _limiter
+    _limiter = limiter
+
+# (depth, read at) shared by all requests of this process
+_queue_depth = (0, float("-inf"))
+_queue_depth_lock = asyncio.Lock()
+
+async def get_queue_depth(db: AsyncSession) -> int:
+    """
+    Jobs queued or leased across the fleet, re-read at most every
+    QUEUE_DEPTH_CACHE_SECONDS so saturation doesn't add a count per request.
+    """
+    global _queue_depth
+    if time.monotonic() - _queue_depth[1] < QUEUE_DEPTH_CACHE_SECONDS:
+        return _queue_depth[0]
+    async with _queue_depth_lock:
+        if time.monotonic() - _queue_depth[1] >= QUEUE_DEPTH_CACHE_SECONDS:
+            Job = db_models.Job
+            depth = await db.scalar(select(func.count(Job.id)).where(Job.status.in_(ACTIVE_JOB_STATUSES)))
+            _queue_depth = (depth, time.monotonic())
+    return _queue_depth[0]
+
+def _reserve_queue_depth(count: int):
+    """
+    Counts admitted jobs into the cached depth, so requests before the next
+    re-read see them.
+    """
+    global _queue_depth
+    _queue_depth = (_queue_depth[0] + count, _queue_depth[1])
+
+def _reject(reason: str, status_code: int, retry_after: float, detail: str):
+    metrics.admission_decisions.inc(outcome=reason)
+    logger.warning(f"Admission rejected ({reason}): {detail}")
+    raise HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+async def _check_capacity(db: AsyncSession, google_id: str, count: int):
+    """
+    Rejects unless `count` new jobs fit in the fleet's queue and under the
+    user's active job limit.
+    """
+    if MAX_QUEUE_DEPTH:
+        depth = await get_queue_depth(db)
+        if depth + count > MAX_QUEUE_DEPTH:
+            _reject("queue_full", 503, QUEUE_FULL_RETRY_AFTER_SECONDS, "Note generation is at capacity, try again shortly")
+    if MAX_ACTIVE_JOBS_PER_USER:
+        Job = db_models.Job
+        active = await db.scalar(
+            select(func.count(Job.id))
+            .join(db_models.User, Job.user_id == db_models.User.id)
+            .where(db_models.User.google_id == google_id, Job.status.in_(ACTIVE_JOB_STATUSES))
+        )
+        if active + count > MAX_ACTIVE_JOBS_PER_USER:
+            _reject(
+                "user_jobs_limit", 429, QUEUE_FULL_RETRY_AFTER_SECONDS,
+                f"At most {MAX_ACTIVE_JOBS_PER_USER} notes can be queued at once ({active} already are)",
+            )
+
+async def admit(db: AsyncSession, user: dict, count: int = 1):
+    """
+    Admits a request that starts `count` generations, or raises HTTPException.
+    Capacity and quota are checked first, so rejected requests don't use up
+    the user's tokens.
+    """
+    await _check_capacity(db, user.get("sub"), count)
+    quota_reset = usage.check_quota(user.get("uid"))
+    if quota_reset is not None:
+        _reject("quota_exceeded", 429, quota_reset, "Daily note generation quota used up")
+    try:
+        wait = await get_rate_limiter().acquire(user.get("sub"))
+    except Exception as e:
+        # Limiter storage trouble shouldn't take generation down with it
+        logger.error(f"Rate limiter unavailable, admitting request: {e}")
+        wait = 0.0
+    if wait > 0:
+        _reject("rate_limited", 429, wait, "Too many note generation requests")
+    metrics.admission_decisions.inc(outcome="admitted")
+    _reserve_queue_depth(count)
+
+async def admit_generation(
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Dependency for endpoints that start a single generation.
+    """
+    await admit(db, user)
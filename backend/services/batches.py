@@ -0,0 +1,125 @@
+"""
+Batch note generation for a list of videos or a playlist, and aggregated
+progress over all of its notes.
+
+A batch is created in one transaction: the notes are upserted in a single
+multi-row statement and their jobs enqueued with one INSERT ... SELECT.
+Fair ordering between users is the job queue's concern (see queue.lease_job).
+"""
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import db_models
+from backend.db_models import NoteStatus
+from backend.services import events
+from backend.services import queue as job_queue
+from backend.services import db as db_sync
+from backend.services import db_async
+from backend.services.metadata import get_cached_metadata
+
+MAX_BATCH_VIDEOS = int(os.getenv("MAX_BATCH_VIDEOS", "200"))
+
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+PLAYLIST_ID_RE = re.compile(r"^[A-Za-z0-9_-]{13,64}$")
+
+def extract_video_id(value: str) -> Optional[str]:
+    """
+    Video ID from a watch, youtu.be, shorts or embed URL, or a bare ID.
+    """
+    value = value.strip()
+    if VIDEO_ID_RE.match(value):
+        return value
+    parsed = urlparse(value if "//" in value else f"https://{value}")
+    candidate = parse_qs(parsed.query).get("v", [None])[0]
+    if candidate is None:
+        parts = [p for p in parsed.path.split("/") if p]
+        if parsed.netloc.endswith("youtu.be") and parts:
+            candidate = parts[0]
+        elif len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+            candidate = parts[1]
+    return candidate if candidate and VIDEO_ID_RE.match(candidate) else None
+
+def extract_playlist_id(value: str) -> Optional[str]:
+    value = value.strip()
+    if PLAYLIST_ID_RE.match(value):
+        return value
+    parsed = urlparse(value if "//" in value else f"https://{value}")
+    candidate = parse_qs(parsed.query).get("list", [None])[0]
+    return candidate if candidate and PLAYLIST_ID_RE.match(candidate) else None
+
+def parse_video_urls(urls: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Returns (unique video IDs in order, inputs that aren't YouTube videos).
+    """
+    video_ids, skipped = [], []
+    for url in urls:
+        video_id = extract_video_id(url)
+        if video_id:
+            video_ids.append(video_id)
+        else:
+            skipped.append(url)
+    return list(dict.fromkeys(video_ids)), skipped
+
+async def create_batch(db: AsyncSession, google_id: str, email: str, video_ids: List[str], playlist_id: str = None, user_id: int = None):
+    """
+    Creates (or resets to PENDING) a note per video and enqueues the ones
+    without an active job, all in one transaction. The user is upserted
+    unless their internal user_id is already known.
+    Returns (batch, notes).
+    """
+    if user_id is None:
+        user_id = (await db_async.get_or_create_user(db, google_id, email, commit=False)).id
+    videos = [(video_id, get_cached_metadata(video_id)) for video_id in video_ids]
+    result = await db.scalars(
+        db_sync.create_notes_statement(db, user_id, videos),
+        execution_options={"populate_existing": True},
+    )
+    notes = list(result.all())
+
+    batch = db_models.Batch(user_id=user_id, playlist_id=playlist_id, total=len(notes))
+    db.add(batch)
+    await db.flush()
+    await db.execute(insert(db_models.BatchNote), [{"batch_id": batch.id, "note_id": note.id} for note in notes])
+    await db.execute(job_queue.enqueue_notes_if_idle_statement([note.id for note in notes]))
+    await events.publish_note_statuses_on_commit(db, notes)
+    await db.commit()
+    return batch, notes
+
+async def get_batch(db: AsyncSession, batch_id: int, google_id: str):
+    """
+    The batch if it belongs to the user, else None.
+    """
+    Batch = db_models.Batch
+    User = db_models.User
+    result = await db.scalars(
+        select(Batch).join(User, Batch.user_id == User.id).where(Batch.id == batch_id, User.google_id == google_id)
+    )
+    return result.first()
+
+async def get_batch_statuses(db: AsyncSession, batch_id: int) -> Dict[int, str]:
+    """
+    note_id -> status for every note in the batch.
+    """
+    Note = db_models.Note
+    BatchNote = db_models.BatchNote
+    result = await db.execute(
+        select(Note.id, Note.status).join(BatchNote, BatchNote.note_id == Note.id).where(BatchNote.batch_id == batch_id)
+    )
+    return {note_id: status for note_id, status in result.all()}
+
+def summarize(batch_id: int, statuses: Dict[int, str]) -> dict:
+    counts = {status.value: 0 for status in NoteStatus}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    finished = counts[NoteStatus.READY.value] + counts[NoteStatus.FAILED.value]
+    return {
+        "batchId": batch_id,
+        "total": len(statuses),
+        "counts": counts,
+        "done": finished == len(statuses),
+    }
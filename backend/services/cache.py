@@ -0,0 +1,234 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Optional
+from sqlalchemy.orm import Session
+
+from backend.database import SessionLocal
+
+from backend.services import db as db_service
+from backend.services import events
+from backend.services import segments
+from backend.services import transcripts
+from backend.services import metrics
+from backend.db_models import GenerationPath
+from backend.services.gemini import generate_notes, generate_notes_stream, GEMINI_MODEL, PROMPT_HASH
+from backend.services.gemini_executor import remaining_time, DeadlineExceeded
+from backend.services.gcs import upload_content_blob, upload_checkpoint, get_checkpoint, delete_checkpoint, delete_segments
+
+logger = logging.getLogger(__name__)
+
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "true").lower() == "true"
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_INTERVAL_SECONDS", "10"))
+# Lifetime of a generation claim, renewed every third of it while the holder runs;
+# how long a crashed holder keeps other workers waiting
+GENERATION_CLAIM_SECONDS = float(os.getenv("GENERATION_CLAIM_SECONDS", "60"))
+# How often a worker waiting on another process's generation checks the cache
+GENERATION_CLAIM_POLL_SECONDS = float(os.getenv("GENERATION_CLAIM_POLL_SECONDS", "2"))
+
+class GenerationResult(NamedTuple):
+    gcs_key: str
+    path: str
+    content_hash: Optional[str] = None
+    content_size: Optional[int] = None
+    content_encoding: Optional[str] = None
+
+    @classmethod
+    def from_cache(cls, entry, path: str) -> "GenerationResult":
+        return cls(entry.gcs_object_key, path, entry.content_hash, entry.content_size, entry.content_encoding)
+
+# cache_key -> Future resolving to the GenerationResult.
+# Requests in this process for a key that is already being generated wait on
+# the same future; across processes the generation claim does the same.
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+def make_cache_key(video_id: str) -> str:
+    raw = f"{video_id}:{PROMPT_HASH}:{GEMINI_MODEL}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def generate_streaming(cache_key: str, video_id: str, video_url: str, transcript: Optional[str] = None) -> str:
+    """
+    Streams the generation, pushing deltas to SSE subscribers and
+    checkpointing partial output to storage every CHECKPOINT_INTERVAL_SECONDS.
+    A retry after a crash resumes from the last checkpoint.
+    """
+    try:
+        resume_from = get_checkpoint(cache_key)
+    except Exception as e:
+        logger.error(f"Could not read checkpoint for video {video_id}: {e}")
+        resume_from = None
+    parts = []
+    if resume_from:
+        logger.info(f"Resuming generation for video {video_id} from a {len(resume_from)} char checkpoint")
+        parts.append(resume_from)
+        events.publish_delta(video_id, resume_from)
+
+    last_checkpoint = time.monotonic()
+    for delta in generate_notes_stream(video_url, resume_from, transcript=transcript):
+        parts.append(delta)
+        events.publish_delta(video_id, delta)
+        if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_SECONDS:
+            try:
+                upload_checkpoint(cache_key, "".join(parts))
+            except Exception as e:
+                logger.error(f"Checkpoint upload failed for video {video_id}: {e}")
+            last_checkpoint = time.monotonic()
+
+    return "".join(parts)
+
+def _generate(db: Session, cache_key: str, video_id: str, video_url: str, duration_seconds: Optional[int]) -> GenerationResult:
+    """
+    Runs the generation pipeline: transcript first, then segmented or
+    whole-video input. Uploads the result and records it in the cache.
+    """
+    with metrics.stage("transcript"):
+        transcript = transcripts.get_usable_transcript(video_id, duration_seconds)
+    with metrics.stage("gemini"):
+        if transcript:
+            path = GenerationPath.TRANSCRIPT
+            if GEMINI_STREAMING:
+                content = generate_streaming(cache_key, video_id, video_url, transcript=transcript.text)
+            else:
+                content = generate_notes(video_url, transcript=transcript.text)
+        elif segments.should_segment(duration_seconds):
+            path = GenerationPath.SEGMENTED
+            content = segments.generate_segmented(cache_key, video_id, video_url, duration_seconds)
+        else:
+            path = GenerationPath.VIDEO
+            if GEMINI_STREAMING:
+                content = generate_streaming(cache_key, video_id, video_url)
+            else:
+                content = generate_notes(video_url)
+
+    with metrics.stage("upload"):
+        blob = upload_content_blob(content)
+    with metrics.stage("db_cache"):
+        entry = db_service.save_cached_generation(
+            db, cache_key, video_id, GEMINI_MODEL, PROMPT_HASH, blob.key,
+            content_hash=blob.content_hash,
+            content_size=blob.size,
+            content_encoding=blob.encoding,
+        )
+
+    try:
+        if path == GenerationPath.SEGMENTED:
+            delete_segments(cache_key)
+        elif GEMINI_STREAMING:
+            delete_checkpoint(cache_key)
+    except Exception as e:
+        logger.error(f"Failed to clean up partial output for video {video_id}: {e}")
+
+    return GenerationResult.from_cache(entry, path)
+
+@contextmanager
+def _held_claim(cache_key: str, owner: str):
+    """
+    Keeps the generation claim alive while the block runs, then releases it.
+    Uses its own sessions: the caller's may be mid-transaction or broken.
+    """
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(GENERATION_CLAIM_SECONDS / 3):
+            db = SessionLocal()
+            try:
+                if not db_service.renew_generation_claim(db, cache_key, owner, GENERATION_CLAIM_SECONDS):
+                    logger.warning(f"Lost the generation claim on {cache_key}; another worker may generate it too")
+            except Exception as e:
+                logger.error(f"Failed to renew the generation claim on {cache_key}: {e}")
+            finally:
+                db.close()
+
+    thread = threading.Thread(target=renew, name="generation-claim", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        db = SessionLocal()
+        try:
+            db_service.release_generation_claim(db, cache_key, owner)
+        except Exception as e:
+            # It expires on its own
+            logger.error(f"Failed to release the generation claim on {cache_key}: {e}")
+        finally:
+            db.close()
+
+def _generate_claimed(db: Session, cache_key: str, video_id: str, video_url: str, duration_seconds: Optional[int]) -> GenerationResult:
+    """
+    Generates the key under its fleet-wide claim. While another process
+    holds the claim, polls the cache and returns that generation's result
+    (path SHARED); if it fails, or its worker dies, the claim is released or
+    expires and this caller takes over.
+    """
+    owner = uuid.uuid4().hex
+    path = GenerationPath.CACHE
+    while True:
+        # A previous leader, here or elsewhere, may have finished by now
+        cached = db_service.get_cached_generation(db, cache_key)
+        if cached:
+            return GenerationResult.from_cache(cached, path)
+        if db_service.claim_generation(db, cache_key, owner, GENERATION_CLAIM_SECONDS):
+            break
+        if path != GenerationPath.SHARED:
+            logger.info(f"Video {video_id} is being generated by another worker, waiting for it")
+            path = GenerationPath.SHARED
+        remaining = remaining_time()
+        if remaining is not None and remaining <= GENERATION_CLAIM_POLL_SECONDS:
+            raise DeadlineExceeded(f"Timed out waiting for another worker to generate video {video_id}")
+        with metrics.stage("shared_wait"):
+            time.sleep(GENERATION_CLAIM_POLL_SECONDS)
+
+    with _held_claim(cache_key, owner):
+        # The previous holder may have stored its result between the lookup and the claim
+        cached = db_service.get_cached_generation(db, cache_key)
+        if cached:
+            return GenerationResult.from_cache(cached, path)
+        return _generate(db, cache_key, video_id, video_url, duration_seconds)
+
+def get_or_generate(db: Session, video_id: str, video_url: str, duration_seconds: Optional[int] = None) -> GenerationResult:
+    """
+    Returns the object key of the generated note for this video and how it was produced,
+    generating and uploading it only if no user has generated it before.
+    Concurrent callers for the same key share a single generation, within
+    a process through a shared future and across processes through the
+    generation claim.
+    """
+    cache_key = make_cache_key(video_id)
+
+    with metrics.stage("db_cache"):
+        cached = db_service.get_cached_generation(db, cache_key)
+    if cached:
+        logger.info(f"Generation cache hit for video {video_id}")
+        return GenerationResult.from_cache(cached, GenerationPath.CACHE)
+
+    with _inflight_lock:
+        future = _inflight.get(cache_key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[cache_key] = future
+
+    if not is_leader:
+        logger.info(f"Joining in-flight generation for video {video_id}")
+        with metrics.stage("shared_wait"):
+            result = future.result()
+        return result._replace(path=GenerationPath.SHARED)
+
+    try:
+        result = _generate_claimed(db, cache_key, video_id, video_url, duration_seconds)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(cache_key, None)
@@ -0,0 +1,81 @@
+"""
+Google OAuth refresh tokens, stored Fernet-encrypted in the user_credentials
+table so a login handled by one API process is usable from all of them.
+
+REFRESH_TOKEN_KEYS is a comma-separated list of secrets (defaults to
+SECRET_KEY); the first encrypts, all of them decrypt, so keys can be rotated
+by prepending a new one and re-saving tokens as users log in.
+"""
+import os
+import base64
+import hashlib
+import logging
+import datetime
+from typing import Optional
+
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import db_models
+from backend.services import db as db_sync
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_KEYS = [
+    key.strip()
+    for key in (os.getenv("REFRESH_TOKEN_KEYS") or os.getenv("SECRET_KEY") or os.urandom(32).hex()).split(",")
+    if key.strip()
+]
+
+def _fernet_key(secret: str) -> bytes:
+    # Any string works as a key: Fernet needs 32 url-safe base64 bytes
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode("utf-8")).digest())
+
+_fernet = MultiFernet([Fernet(_fernet_key(key)) for key in REFRESH_TOKEN_KEYS])
+
+def encrypt(value: str) -> str:
+    return _fernet.encrypt(value.encode("utf-8")).decode("ascii")
+
+def decrypt(value: str) -> Optional[str]:
+    try:
+        return _fernet.decrypt(value.encode("ascii")).decode("utf-8")
+    except InvalidToken:
+        return None
+
+def store_refresh_token_statement(db, user_id: int, refresh_token: str, scopes: str = None):
+    Credential = db_models.UserCredential
+    stmt = db_sync._insert(db, Credential).values(
+        user_id=user_id,
+        refresh_token_encrypted=encrypt(refresh_token),
+        scopes=scopes,
+        updated_at=datetime.datetime.utcnow(),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[Credential.user_id],
+        set_={
+            "refresh_token_encrypted": stmt.excluded.refresh_token_encrypted,
+            "scopes": stmt.excluded.scopes,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+async def store_refresh_token(db: AsyncSession, user_id: int, refresh_token: str, scopes: str = None):
+    """
+    Saves (or replaces) the user's refresh token. Committed by the caller.
+    """
+    await db.execute(store_refresh_token_statement(db, user_id, refresh_token, scopes))
+
+async def get_refresh_token(db: AsyncSession, user_id: int) -> Optional[str]:
+    """
+    The user's refresh token, or None if there is none or it can't be
+    decrypted with the configured keys (the user has to log in again).
+    """
+    Credential = db_models.UserCredential
+    encrypted = await db.scalar(select(Credential.refresh_token_encrypted).where(Credential.user_id == user_id))
+    if encrypted is None:
+        return None
+    refresh_token = decrypt(encrypted)
+    if refresh_token is None:
+        logger.warning(f"Refresh token of user {user_id} can't be decrypted with REFRESH_TOKEN_KEYS")
+    return refresh_token
@@ -1,7 +1,208 @@
+from sqlalchemy import select, update, delete, tuple_, func
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from backend import db_models
 from backend.db_models import NoteStatus
+from backend.services import events
+import base64
 import datetime
 
+# Statuses a note may move into each status from. PENDING (a regenerate)
+# can be entered from anything. A stale or duplicate job can never pull a READY note
+# back to GENERATING or FAILED.
+NOTE_TRANSITIONS = {
+    NoteStatus.GENERATING: [NoteStatus.PENDING, NoteStatus.GENERATING, NoteStatus.FAILED],
+    NoteStatus.READY: [NoteStatus.PENDING, NoteStatus.GENERATING, NoteStatus.FAILED],
+    NoteStatus.FAILED: [NoteStatus.PENDING, NoteStatus.GENERATING],
+}
+
+def _insert(db, model):
+    """
+    INSERT with the dialect's on_conflict_do_update (Postgres in production, SQLite locally).
+    Works with both Session and AsyncSession.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite_insert(model)
+    return pg_insert(model)
+
+# Statement builders shared with the async versions in db_async.py
+
+def upsert_user_statement(db, google_id: str, email: str):
+    """
+    INSERT ... ON CONFLICT (google_id) DO UPDATE ... RETURNING.
+    The no-op update makes RETURNING yield the existing row too.
+    """
+    User = db_models.User
+    stmt = _insert(db, User).values(google_id=google_id, email=email, created_at=datetime.datetime.utcnow())
+    return stmt.on_conflict_do_update(
+        index_elements=[User.google_id],
+        set_={"email": stmt.excluded.email},
+    ).returning(User)
+
+def note_query(user_id: int, video_id: str):
+    Note = db_models.Note
+    return select(Note).where(Note.user_id == user_id, Note.video_id == video_id)
+
+def note_for_google_user_query(google_id: str, video_id: str):
+    """
+    The user's note looked up straight from the auth subject, in one query.
+    """
+    Note = db_models.Note
+    User = db_models.User
+    return select(Note).join(User, Note.user_id == User.id).where(
+        User.google_id == google_id,
+        Note.video_id == video_id,
+    )
+
+def _user_notes(google_id: str):
+    Note = db_models.Note
+    User = db_models.User
+    return select(Note).join(User, Note.user_id == User.id).where(User.google_id == google_id)
+
+def notes_by_video_ids_query(google_id: str, video_ids):
+    """
+    Every note of the user for the given videos, in one IN query on the (user_id, video_id) index.
+    """
+    return _user_notes(google_id).where(db_models.Note.video_id.in_(set(video_ids)))
+
+def encode_cursor(note) -> str:
+    raw = f"{note.updated_at.isoformat()}|{note.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """
+    Returns (updated_at, id). Raises ValueError for a malformed cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        updated_at, note_id = raw.split("|")
+        return datetime.datetime.fromisoformat(updated_at), int(note_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def list_notes_query(google_id: str, limit: int, cursor: str = None, status: str = None):
+    """
+    One page of the user's notes, newest first. Keyset pagination on
+    (updated_at, id) walks the ix_notes_user_id_updated_at_id index, so
+    deep pages cost the same as the first one. Fetches limit + 1 rows
+    to tell whether there is a next page.
+    """
+    Note = db_models.Note
+    query = _user_notes(google_id)
+    if cursor:
+        query = query.where(tuple_(Note.updated_at, Note.id) < tuple_(*decode_cursor(cursor)))
+    if status:
+        query = query.where(Note.status == status)
+    return query.order_by(Note.updated_at.desc(), Note.id.desc()).limit(limit + 1)
+
+def split_page(notes, limit: int):
+    """
+    Returns (page, next_cursor) from the limit + 1 rows list_notes_query fetched.
+    """
+    if len(notes) > limit:
+        return notes[:limit], encode_cursor(notes[limit - 1])
+    return notes, None
+
+def create_note_statement(db, user_id: int, video_id: str, video_title: str = None, channel_title: str = None, duration_seconds: int = None):
+    """
+    Creates the note, or resets an existing one to PENDING, in one upsert.
+    The current version's content columns are left alone, so it stays
+    downloadable until the regeneration replaces it (see save_note_version).
+    """
+    Note = db_models.Note
+    now = datetime.datetime.utcnow()
+    stmt = _insert(db, Note).values(
+        user_id=user_id,
+        video_id=video_id,
+        video_title=video_title,
+        channel_title=channel_title,
+        duration_seconds=duration_seconds,
+        status=NoteStatus.PENDING,
+        created_at=now,
+        updated_at=now,
+    )
+    values = {"status": NoteStatus.PENDING, "updated_at": now}
+    # Metadata may still be resolving; keep what we already know
+    if video_title:
+        values.update(
+            video_title=stmt.excluded.video_title,
+            channel_title=stmt.excluded.channel_title,
+            duration_seconds=stmt.excluded.duration_seconds,
+        )
+    return stmt.on_conflict_do_update(
+        index_elements=[Note.user_id, Note.video_id],
+        set_=values,
+    ).returning(Note)
+
+def create_notes_statement(db, user_id: int, videos):
+    """
+    Bulk create_note_statement: one multi-row upsert for a batch.
+    videos is a list of (video_id, VideoMetadata or None). Known metadata
+    replaces the stored one, missing metadata keeps it.
+    """
+    Note = db_models.Note
+    now = datetime.datetime.utcnow()
+    stmt = _insert(db, Note).values([
+        dict(
+            user_id=user_id,
+            video_id=video_id,
+            video_title=meta.title if meta else None,
+            channel_title=meta.channel if meta else None,
+            duration_seconds=meta.duration_seconds if meta else None,
+            status=NoteStatus.PENDING,
+            created_at=now,
+            updated_at=now,
+        )
+        for video_id, meta in videos
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[Note.user_id, Note.video_id],
+        set_={
+            "status": NoteStatus.PENDING,
+            "updated_at": now,
+            "video_title": func.coalesce(stmt.excluded.video_title, Note.video_title),
+            "channel_title": func.coalesce(stmt.excluded.channel_title, Note.channel_title),
+            "duration_seconds": func.coalesce(stmt.excluded.duration_seconds, Note.duration_seconds),
+        },
+    ).returning(Note)
+
+def note_status_statement(note_id: int, status: str, gcs_key: str = None, **fields):
+    """
+    Conditional UPDATE ... RETURNING that only matches if NOTE_TRANSITIONS allows the move.
+    None values in fields are skipped.
+    """
+    Note = db_models.Note
+    values = {name: value for name, value in fields.items() if value is not None}
+    values["status"] = status
+    values["updated_at"] = datetime.datetime.utcnow()
+    if gcs_key:
+        values["gcs_object_key"] = gcs_key
+    stmt = update(Note).where(Note.id == note_id)
+    if status in NOTE_TRANSITIONS:
+        stmt = stmt.where(Note.status.in_(NOTE_TRANSITIONS[status]))
+    return stmt.values(**values).returning(Note)
+
+def note_metadata_statement(note_id: int, video_title: str, channel_title: str = None, duration_seconds: int = None):
+    Note = db_models.Note
+    return update(Note).where(Note.id == note_id).values(
+        video_title=video_title,
+        channel_title=channel_title,
+        duration_seconds=duration_seconds,
+    )
+
+def _fetch_returning(db: Session, stmt):
+    """
+    Runs an INSERT/UPDATE ... RETURNING <entity> and returns the row (or None).
+    The object is detached so the following commit doesn't expire it
+    and cost another SELECT on first attribute access.
+    """
+    obj = db.scalars(stmt, execution_options={"populate_existing": True}).first()
+    if obj is not None:
+        db.expunge(obj)
+    return obj
+
 def get_user_by_google_id(db: Session, google_id: str):
     return db.query(db_models.User).filter(db_models.User.google_id == google_id).first()
 
@@ -12,48 +213,144 @@ def create_user(db: Session, google_id: str, email: str, name: str = None):
     db.refresh(db_user)
     return db_user
 
-def get_or_create_user(db: Session, google_id: str, email: str):
-    user = get_user_by_google_id(db, google_id)
-    if not user:
-        user = create_user(db, google_id=google_id, email=email)
+def get_or_create_user(db: Session, google_id: str, email: str, commit: bool = True):
+    user = _fetch_returning(db, upsert_user_statement(db, google_id, email))
+    if commit:
+        db.commit()
     return user
 
 def get_note(db: Session, user_id: int, video_id: str):
-    return db.query(db_models.Note).filter(
-        db_models.Note.user_id == user_id,
-        db_models.Note.video_id == video_id
-    ).first()
+    return db.scalars(note_query(user_id, video_id)).first()
 
-def create_note(db: Session, user_id: int, video_id: str, video_title: str):
-    # Check if exists, if so return it (will be updated) or delete and recreate?
-    # Logic: "Regenerating notes overwrites the previous version"
-    # We can update the existing record to PENDING.
-    
-    note = get_note(db, user_id, video_id)
-    if note:
-        note.status = NoteStatus.PENDING
-        note.video_title = video_title
-        note.updated_at = datetime.datetime.utcnow()
-    else:
-        note = db_models.Note(
-            user_id=user_id,
-            video_id=video_id,
-            video_title=video_title,
-            status=NoteStatus.PENDING
-        )
-        db.add(note)
-    
+def get_note_for_google_user(db: Session, google_id: str, video_id: str):
+    return db.scalars(note_for_google_user_query(google_id, video_id)).first()
+
+def get_notes_by_video_ids(db: Session, google_id: str, video_ids):
+    return db.scalars(notes_by_video_ids_query(google_id, video_ids)).all()
+
+def list_notes(db: Session, google_id: str, limit: int, cursor: str = None, status: str = None):
+    notes = db.scalars(list_notes_query(google_id, limit, cursor, status)).all()
+    return split_page(list(notes), limit)
+
+def create_note(db: Session, user_id: int, video_id: str, video_title: str = None, channel_title: str = None, duration_seconds: int = None):
+    note = _fetch_returning(db, create_note_statement(db, user_id, video_id, video_title, channel_title, duration_seconds))
     db.commit()
-    db.refresh(note)
+    events.publish_note_status(note)
     return note
 
-def update_note_status(db: Session, note_id: int, status: str, gcs_key: str = None):
-    note = db.query(db_models.Note).filter(db_models.Note.id == note_id).first()
+def update_note_status(db: Session, note_id: int, status: str, gcs_key: str = None, **fields):
+    """
+    Sets the status (and object key) in one conditional UPDATE.
+    Extra keyword arguments are stored on the note too, e.g. generation_path
+    or content_hash.
+    Returns None if the note doesn't exist or the transition isn't allowed.
+    """
+    note = _fetch_returning(db, note_status_statement(note_id, status, gcs_key, **fields))
+    db.commit()
     if note:
-        note.status = status
-        if gcs_key:
-            note.gcs_object_key = gcs_key
-        note.updated_at = datetime.datetime.utcnow()
-        db.commit()
-        db.refresh(note)
+        events.publish_note_status(note)
+    return note
+
+def save_note_version(db: Session, note_id: int, blob_key: str, content_hash: str, content_size: int = None,
+                      content_encoding: str = None, generation_path: str = None, generation_ms: int = None,
+                      version_fields: dict = None, **fields):
+    """
+    Records a new READY version of the note and makes it current in one
+    transaction: the version row, then a conditional UPDATE that moves the
+    note's content columns and status together, so readers switch from the
+    previous version to this one atomically.
+    version_fields are stored on the version only (e.g. token usage); extra
+    keyword arguments on the note, as with update_note_status.
+    Returns None (nothing saved) if the note doesn't exist or can't become READY.
+    """
+    version = db_models.NoteVersion(
+        note_id=note_id,
+        blob_key=blob_key,
+        content_hash=content_hash,
+        content_size=content_size,
+        content_encoding=content_encoding,
+        generation_path=generation_path,
+        generation_ms=generation_ms,
+        created_at=datetime.datetime.utcnow(),
+        **(version_fields or {}),
+    )
+    db.add(version)
+    db.flush()
+    note = _fetch_returning(db, note_status_statement(
+        note_id, NoteStatus.READY, blob_key,
+        current_version_id=version.id,
+        content_hash=content_hash,
+        content_size=content_size,
+        content_encoding=content_encoding,
+        generation_path=generation_path,
+        generation_ms=generation_ms,
+        **fields,
+    ))
+    if note is None:
+        db.rollback()
+        return None
+    db.commit()
+    events.publish_note_status(note)
     return note
+
+def get_cached_generation(db: Session, cache_key: str):
+    return db.query(db_models.GenerationCache).filter(
+        db_models.GenerationCache.cache_key == cache_key
+    ).first()
+
+def save_cached_generation(db: Session, cache_key: str, video_id: str, model: str, prompt_hash: str, gcs_key: str,
+                           content_hash: str = None, content_size: int = None, content_encoding: str = None):
+    entry = db_models.GenerationCache(
+        cache_key=cache_key,
+        video_id=video_id,
+        model=model,
+        prompt_hash=prompt_hash,
+        gcs_object_key=gcs_key,
+        content_hash=content_hash,
+        content_size=content_size,
+        content_encoding=content_encoding,
+    )
+    db.add(entry)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another process stored the same key first; keep theirs
+        db.rollback()
+        entry = get_cached_generation(db, cache_key)
+    return entry
+
+def claim_generation(db: Session, cache_key: str, owner: str, ttl_seconds: float) -> bool:
+    """
+    Takes the generation claim on cache_key for `owner`, unless someone else
+    holds one that hasn't expired, in a single upsert. Returns whether `owner` got it.
+    """
+    Claim = db_models.GenerationClaim
+    now = datetime.datetime.utcnow()
+    stmt = _insert(db, Claim).values(cache_key=cache_key, owner=owner, expires_at=now + datetime.timedelta(seconds=ttl_seconds))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Claim.cache_key],
+        set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+        where=Claim.expires_at < now,
+    ).returning(Claim.owner)
+    holder = db.scalar(stmt)
+    db.commit()
+    return holder == owner
+
+def renew_generation_claim(db: Session, cache_key: str, owner: str, ttl_seconds: float) -> bool:
+    Claim = db_models.GenerationClaim
+    result = db.execute(
+        update(Claim)
+        .where(Claim.cache_key == cache_key, Claim.owner == owner)
+        .values(expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl_seconds))
+    )
+    db.commit()
+    return result.rowcount > 0
+
+def release_generation_claim(db: Session, cache_key: str, owner: str):
+    Claim = db_models.GenerationClaim
+    db.execute(delete(Claim).where(Claim.cache_key == cache_key, Claim.owner == owner))
+    db.commit()
+
+def update_note_metadata(db: Session, note_id: int, video_title: str, channel_title: str = None, duration_seconds: int = None):
+    db.execute(note_metadata_statement(note_id, video_title, channel_title, duration_seconds))
+    db.commit()
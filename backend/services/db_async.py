@@ -0,0 +1,61 @@
+"""
+AsyncSession versions of the services/db.py functions for the API's request path.
+They run the same statements, so behaviour (upserts, legal status transitions) matches.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import db_models
+from backend.services import events
+from backend.services import db as db_sync
+
+async def _fetch_returning(db: AsyncSession, stmt):
+    result = await db.scalars(stmt, execution_options={"populate_existing": True})
+    return result.first()
+
+async def get_user_by_google_id(db: AsyncSession, google_id: str):
+    User = db_models.User
+    result = await db.scalars(select(User).where(User.google_id == google_id))
+    return result.first()
+
+async def get_or_create_user(db: AsyncSession, google_id: str, email: str, commit: bool = True):
+    user = await _fetch_returning(db, db_sync.upsert_user_statement(db, google_id, email))
+    if commit:
+        await db.commit()
+    return user
+
+async def get_note(db: AsyncSession, user_id: int, video_id: str):
+    result = await db.scalars(db_sync.note_query(user_id, video_id))
+    return result.first()
+
+async def get_note_for_google_user(db: AsyncSession, google_id: str, video_id: str):
+    result = await db.scalars(db_sync.note_for_google_user_query(google_id, video_id))
+    return result.first()
+
+async def get_notes_by_video_ids(db: AsyncSession, google_id: str, video_ids):
+    result = await db.scalars(db_sync.notes_by_video_ids_query(google_id, video_ids))
+    return result.all()
+
+async def list_notes(db: AsyncSession, google_id: str, limit: int, cursor: str = None, status: str = None):
+    """
+    Returns (notes, next_cursor).
+    """
+    result = await db.scalars(db_sync.list_notes_query(google_id, limit, cursor, status))
+    return db_sync.split_page(list(result.all()), limit)
+
+async def create_note(db: AsyncSession, user_id: int, video_id: str, video_title: str = None, channel_title: str = None, duration_seconds: int = None):
+    note = await _fetch_returning(db, db_sync.create_note_statement(db, user_id, video_id, video_title, channel_title, duration_seconds))
+    await events.publish_note_statuses_on_commit(db, [note])
+    await db.commit()
+    return note
+
+async def update_note_status(db: AsyncSession, note_id: int, status: str, gcs_key: str = None, **fields):
+    note = await _fetch_returning(db, db_sync.note_status_statement(note_id, status, gcs_key, **fields))
+    if note:
+        await events.publish_note_statuses_on_commit(db, [note])
+    await db.commit()
+    return note
+
+async def update_note_metadata(db: AsyncSession, note_id: int, video_title: str, channel_title: str = None, duration_seconds: int = None):
+    await db.execute(db_sync.note_metadata_statement(note_id, video_title, channel_title, duration_seconds))
+    await db.commit()
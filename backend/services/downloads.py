@@ -0,0 +1,290 @@
+"""
+HTTP delivery of note content: conditional requests (ETag / Last-Modified),
+byte ranges, chunked streaming and an in-process LRU of hot notes.
+A note being regenerated keeps serving its last READY version.
+
+NOTE_DOWNLOAD_MODE chooses how the bytes reach the client:
+  - "proxy": the API streams them itself (default)
+  - "redirect": the API redirects to a short-lived signed storage URL
+  - "auto": redirect only for notes of at least NOTE_REDIRECT_MIN_BYTES
+"""
+import os
+import zlib
+import datetime
+import threading
+import email.utils
+from urllib.parse import quote
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse, FileResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+
+from backend.db_models import NoteStatus
+from backend.services.note_store import get_store, decode, StoredBlob, CHUNK_SIZE
+
+# Total bytes of stored (compressed) note content kept in memory per process
+NOTE_CACHE_MAX_BYTES = int(os.getenv("NOTE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger blobs are streamed from storage instead of cached
+NOTE_CACHE_MAX_ITEM_BYTES = int(os.getenv("NOTE_CACHE_MAX_ITEM_BYTES", str(2 * 1024 * 1024)))
+
+NOTE_DOWNLOAD_MODE = os.getenv("NOTE_DOWNLOAD_MODE", "proxy")
+NOTE_REDIRECT_MIN_BYTES = int(os.getenv("NOTE_REDIRECT_MIN_BYTES", str(256 * 1024)))
+NOTE_SIGNED_URL_TTL_SECONDS = int(os.getenv("NOTE_SIGNED_URL_TTL_SECONDS", "300"))
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+class HotNoteCache:
+    """
+    Size-bounded LRU of stored blobs, keyed by object key and content hash
+    so a regenerated note can never be served from a stale entry.
+    """
+
+    def __init__(self, max_bytes: int = NOTE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: "OrderedDict[Tuple[str, Optional[str]], StoredBlob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, content_hash: Optional[str]) -> Optional[StoredBlob]:
+        with self._lock:
+            blob = self._data.get((key, content_hash))
+            if blob is not None:
+                self._data.move_to_end((key, content_hash))
+            return blob
+
+    def put(self, key: str, content_hash: Optional[str], blob: StoredBlob):
+        if len(blob.data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop((key, content_hash), None)
+            if old is not None:
+                self.size -= len(old.data)
+            self._data[(key, content_hash)] = blob
+            self.size += len(blob.data)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted.data)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            for cache_key in [k for k in self._data if k[0] == key]:
+                self.size -= len(self._data.pop(cache_key).data)
+
+hot_notes = HotNoteCache()
+
+def accepted_encodings(request: Request) -> set:
+    encodings = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            encodings.add(name.lower())
+    return encodings
+
+def make_etag(note, encoding: Optional[str]) -> str:
+    """
+    Strong ETag from the content hash; each encoding is its own representation.
+    Notes stored before hashes existed get a weak ETag from updated_at.
+    """
+    if note.content_hash:
+        suffix = f"-{encoding}" if encoding else ""
+        return f'"{note.content_hash[:32]}{suffix}"'
+    stamp = note.updated_at.timestamp() if note.updated_at else 0
+    return f'W/"{note.id}-{int(stamp)}"'
+
+def http_date(value: datetime.datetime) -> str:
+    return email.utils.format_datetime(value.replace(tzinfo=datetime.timezone.utc), usegmt=True)
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(tzinfo=datetime.timezone.utc, microsecond=0) <= since
+    return False
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single `bytes=` range into inclusive (start, end).
+    Returns None for a missing or unsupported header (serve the full body).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[6:].strip().partition("-")
+    try:
+        if start_text == "":
+            length = int(end_text)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+def content_disposition(filename: str) -> str:
+    """
+    attachment header with an ASCII fallback and the UTF-8 name (RFC 6266),
+    so non-Latin video titles survive.
+    """
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace("?", "_").replace('"', "'")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+def has_ready_version(note) -> bool:
+    """
+    Whether the note has content to serve: it is READY, or it is being
+    regenerated (or the regeneration failed) and still points at its last
+    READY version.
+    """
+    return note.status == NoteStatus.READY or bool(note.gcs_object_key)
+
+def should_redirect(note) -> bool:
+    if NOTE_DOWNLOAD_MODE == "redirect":
+        return True
+    if NOTE_DOWNLOAD_MODE == "auto":
+        # content_size is the uncompressed size; unknown sizes stay on the proxy path
+        return (note.content_size or 0) >= NOTE_REDIRECT_MIN_BYTES
+    return False
+
+async def build_redirect_response(key: str, filename: str) -> Response:
+    """
+    307 to a signed URL so the bytes go straight from storage to the client.
+    """
+    url = await run_in_threadpool(
+        get_store().signed_url, key, NOTE_SIGNED_URL_TTL_SECONDS, content_disposition(filename)
+    )
+    # The URL is a bearer credential for the note: keep it out of shared caches
+    return RedirectResponse(url, status_code=307, headers={"Cache-Control": "private, no-store"})
+
+def _range_applies(request: Request, etag: str) -> bool:
+    if_range = request.headers.get("if-range")
+    # If-Range needs a strong match; otherwise send the whole (changed) body
+    return if_range is None or (not etag.startswith("W/") and if_range.strip() == etag)
+
+def _body_response(request: Request, body: bytes, etag: str, headers: dict) -> Response:
+    try:
+        byte_range = parse_range(request.headers.get("range"), len(body)) if _range_applies(request, etag) else None
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{len(body)}"})
+    if byte_range is None:
+        return Response(content=body, media_type="text/markdown", headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+    return Response(content=body[start:end + 1], status_code=206, media_type="text/markdown", headers=headers)
+
+def _decompress_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(wbits=31)
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+    elif encoding == "zstd":
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+    else:
+        yield from chunks
+
+async def _load_blob(key: str, content_hash: Optional[str], content_size: Optional[int]):
+    """
+    Returns (blob, None) from the hot cache or storage, or (None, info) if the
+    blob is too large to hold in memory and should be streamed instead.
+    """
+    blob = hot_notes.get(key, content_hash)
+    if blob is not None:
+        return blob, None
+    store = get_store()
+    # The uncompressed size recorded on the note bounds the stored size,
+    # so small notes skip the metadata round trip
+    if content_size is None or content_size > NOTE_CACHE_MAX_ITEM_BYTES:
+        info = await run_in_threadpool(store.stat, key)
+        if info.size > NOTE_CACHE_MAX_ITEM_BYTES:
+            return None, info
+    blob = await run_in_threadpool(store.get_raw, key)
+    hot_notes.put(key, content_hash, blob)
+    return blob, None
+
+async def build_download_response(request: Request, note, key: str, filename: str) -> Response:
+    store = get_store()
+    accepts = accepted_encodings(request)
+    encoded = bool(note.content_encoding) and note.content_encoding in accepts
+    etag = make_etag(note, note.content_encoding if encoded else None)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+        "Accept-Ranges": "bytes",
+    }
+    if note.updated_at:
+        headers["Last-Modified"] = http_date(note.updated_at)
+
+    if is_not_modified(request, etag, note.updated_at):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = content_disposition(filename)
+
+    blob, info = await _load_blob(key, note.content_hash, note.content_size)
+    if blob is not None:
+        # Notes stored before encodings were recorded: decide from the blob itself
+        if note.content_encoding is None and blob.encoding:
+            encoded = blob.encoding in accepts
+        if encoded and blob.encoding:
+            headers["Content-Encoding"] = blob.encoding
+            local_path = store.local_path(key)
+            if local_path:
+                # Lets the server use sendfile; FileResponse handles Range itself
+                return FileResponse(local_path, media_type="text/markdown", headers=headers)
+            return _body_response(request, blob.data, etag, headers)
+        return _body_response(request, decode(blob).encode("utf-8"), etag, headers)
+
+    # Too large for the hot cache: stream from storage in chunks
+    if encoded and info.encoding:
+        headers["Content-Encoding"] = info.encoding
+        try:
+            byte_range = parse_range(request.headers.get("range"), info.size) if _range_applies(request, etag) else None
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{info.size}"})
+        status_code = 200
+        start, end = 0, info.size - 1
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        chunks = store.iter_raw(key, start, end, CHUNK_SIZE)
+        return StreamingResponse(iterate_in_threadpool(chunks), status_code=status_code, media_type="text/markdown", headers=headers)
+
+    # Decompressing on the fly: the identity length isn't known up front, so no ranges
+    headers.pop("Accept-Ranges")
+    chunks = _decompress_stream(store.iter_raw(key, 0, info.size - 1, CHUNK_SIZE), info.encoding)
+    return StreamingResponse(iterate_in_threadpool(chunks), media_type="text/markdown", headers=headers)
@@ -0,0 +1,357 @@
+"""
+Broadcast channel for note status changes and streaming generation output.
+
+Writers (API handlers and worker threads) publish, SSE streams subscribe.
+API handlers publish status changes with publish_note_statuses_on_commit(),
+which never blocks the event loop and only delivers what gets committed.
+EVENT_BROKER selects the implementation:
+  - "memory": asyncio fan-out inside this process (local dev, tests, single process)
+  - "postgres": LISTEN/NOTIFY, so every API process sees updates made by any worker
+"""
+import os
+import json
+import asyncio
+import logging
+import select
+import threading
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+EVENT_BROKER = os.getenv("EVENT_BROKER", "memory")
+PG_NOTIFY_CHANNEL = os.getenv("PG_NOTIFY_CHANNEL", "note_events")
+SUBSCRIPTION_QUEUE_SIZE = 256
+# Keeps each published delta well under the 8000 byte NOTIFY payload limit
+MAX_DELTA_CHARS = 1500
+# Recent status messages kept per user for Last-Event-ID resume, and how many users to keep them for
+EVENT_REPLAY_SIZE = int(os.getenv("EVENT_REPLAY_SIZE", "100"))
+EVENT_REPLAY_USERS = int(os.getenv("EVENT_REPLAY_USERS", "10000"))
+
+USER_TOPIC_PREFIX = "notes:user:"
+# Session.info key for messages waiting on the session's commit (in-memory broker)
+_PENDING_KEY = "pending_events"
+
+def user_topic(user_id: int) -> str:
+    return f"{USER_TOPIC_PREFIX}{user_id}"
+
+def generation_topic(video_id: str) -> str:
+    """
+    Markdown deltas of a streaming generation. Keyed by video, since one
+    generation is shared by every user waiting on that video.
+    """
+    return f"generation:{video_id}"
+
+class ReplayBuffer:
+    """
+    The last EVENT_REPLAY_SIZE messages of each user topic, numbered in the
+    order this process delivered them. Event IDs are "<epoch>.<seq>", where
+    the epoch is random per process: an ID from another process (or from
+    before a restart) can't be resumed from, and the stream falls back to
+    a snapshot instead.
+    """
+
+    def __init__(self, size: int = EVENT_REPLAY_SIZE, max_topics: int = EVENT_REPLAY_USERS):
+        self.size = size
+        self.max_topics = max_topics
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        # topic -> (recent messages, seq of the newest message dropped from them)
+        self._topics: "OrderedDict[str, list]" = OrderedDict()
+        # Newest seq of any topic dropped entirely
+        self._evicted_seq = 0
+        self._lock = threading.Lock()
+
+    def record(self, topic: str, message: dict) -> dict:
+        """
+        Returns the message with its "seq" set, after storing it.
+        """
+        with self._lock:
+            self._seq += 1
+            message = dict(message, seq=self._seq)
+            entry = self._topics.pop(topic, None) or [deque(), 0]
+            buffer = entry[0]
+            if len(buffer) >= self.size:
+                entry[1] = buffer.popleft()["seq"]
+            buffer.append(message)
+            self._topics[topic] = entry
+            if len(self._topics) > self.max_topics:
+                _, (evicted, _) = self._topics.popitem(last=False)
+                self._evicted_seq = max(self._evicted_seq, evicted[-1]["seq"])
+        return message
+
+    def last_seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}.{seq}"
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """
+        The sequence number of an ID issued by this buffer, else None.
+        """
+        epoch, _, seq = (event_id or "").partition(".")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def since(self, topic: str, seq: int) -> Optional[List[dict]]:
+        """
+        Messages of the topic after seq, or None if some of them may have
+        been dropped already.
+        """
+        with self._lock:
+            if seq > self._seq:
+                return None
+            entry = self._topics.get(topic)
+            if entry is None:
+                return None if seq < self._evicted_seq else []
+            buffer, dropped_seq = entry
+            if dropped_seq > seq:
+                return None
+            return [m for m in buffer if m["seq"] > seq]
+
+class Subscription:
+    """
+    Receives messages published to any of its topics.
+    Must be created from inside the event loop that will consume it.
+    """
+
+    def __init__(self, broker: "InMemoryBroker", topics, queue_size: int = SUBSCRIPTION_QUEUE_SIZE):
+        self.broker = broker
+        self.topics = tuple(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, message: dict):
+        # Runs on the subscriber's loop. A consumer that falls this far behind
+        # loses its oldest messages rather than growing without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Waits for the next message. Returns None if the timeout expires first.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class InMemoryBroker:
+    """
+    Fans messages out to subscribers in this process.
+    publish() is thread-safe, so worker threads can call it directly.
+    """
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.replay = ReplayBuffer()
+
+    def subscribe(self, *topics: str, queue_size: int = SUBSCRIPTION_QUEUE_SIZE) -> Subscription:
+        subscription = Subscription(self, topics, queue_size)
+        with self._lock:
+            for topic in topics:
+                self._subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscriptions.get(topic)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[topic]
+
+    def publish(self, topic: str, message: dict):
+        self._fan_out(topic, message)
+
+    async def publish_on_commit(self, db, messages: List[Tuple[str, dict]]):
+        """
+        Publishes (topic, message) pairs once the AsyncSession's transaction
+        commits, and drops them if it rolls back. Call before the commit.
+        """
+        pending = db.info.get(_PENDING_KEY)
+        if pending is None:
+            from sqlalchemy import event
+            pending = db.info[_PENDING_KEY] = []
+            event.listen(db.sync_session, "after_commit", self._publish_pending)
+            event.listen(db.sync_session, "after_rollback", lambda session: session.info[_PENDING_KEY].clear())
+        pending.extend(messages)
+
+    def _publish_pending(self, session):
+        pending = session.info[_PENDING_KEY]
+        messages, pending[:] = list(pending), []
+        for topic, message in messages:
+            self.publish(topic, message)
+
+    def _fan_out(self, topic: str, message: dict):
+        if topic.startswith(USER_TOPIC_PREFIX):
+            message = self.replay.record(topic, message)
+        with self._lock:
+            subscribers = list(self._subscriptions.get(topic, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # Subscriber's loop already closed
+                self._unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+    def close(self):
+        pass
+
+class PostgresBroker(InMemoryBroker):
+    """
+    Publishes through NOTIFY and runs one LISTEN connection per process,
+    which feeds the local fan-out. DB load is independent of how many
+    streams are open.
+    """
+
+    IDLE_CHECK_SECONDS = 5
+
+    def __init__(self, engine=None):
+        super().__init__()
+        if engine is None:
+            from backend.database import engine
+        self.engine = engine
+        self._stop = threading.Event()
+        self._listener = threading.Thread(target=self._listen_loop, name="pg-listener", daemon=True)
+        self._listener.start()
+
+    def publish(self, topic: str, message: dict):
+        payload = json.dumps({"topic": topic, "message": message})
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": PG_NOTIFY_CHANNEL, "payload": payload})
+
+    async def publish_on_commit(self, db, messages: List[Tuple[str, dict]]):
+        """
+        NOTIFYs on the request's own session, in one round trip: Postgres
+        delivers the messages when, and only if, that transaction commits.
+        """
+        if not messages:
+            return
+        from sqlalchemy import text
+        payloads = [json.dumps({"topic": topic, "message": message}) for topic, message in messages]
+        await db.execute(
+            text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+            {"channel": PG_NOTIFY_CHANNEL, "payloads": payloads},
+        )
+
+    def _listen_loop(self):
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = self.engine.raw_connection()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f'LISTEN "{PG_NOTIFY_CHANNEL}"')
+                sock = getattr(conn, "_usock", None)
+                while not self._stop.is_set():
+                    if sock is not None:
+                        select.select([sock], [], [], self.IDLE_CHECK_SECONDS)
+                    else:
+                        self._stop.wait(0.2)
+                    # Any round trip makes the driver read pending notifications
+                    cursor.execute("SELECT 1")
+                    while conn.notifications:
+                        _, _, payload = conn.notifications.popleft()
+                        data = json.loads(payload)
+                        self._fan_out(data["topic"], data["message"])
+            except Exception as e:
+                logger.error(f"Postgres listener error, reconnecting: {e}")
+                self._stop.wait(1)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    def close(self):
+        self._stop.set()
+
+BROKERS = {
+    "memory": InMemoryBroker,
+    "postgres": PostgresBroker,
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = BROKERS[EVENT_BROKER]()
+    return _broker
+
+def set_broker(broker):
+    """
+    Replaces the process-wide broker (tests, benchmarks, custom brokers).
+    """
+    global _broker
+    _broker = broker
+
+def close_broker():
+    global _broker
+    if _broker is not None:
+        _broker.close()
+        _broker = None
+
+def _status_message(note) -> dict:
+    return {
+        "type": "status",
+        "noteId": note.id,
+        "videoId": note.video_id,
+        "status": note.status,
+    }
+
+def publish_note_status(note):
+    """
+    For worker threads, after the status change is committed.
+    """
+    try:
+        get_broker().publish(user_topic(note.user_id), _status_message(note))
+    except Exception as e:
+        # Status is already committed; subscribers will pick it up on their next read
+        logger.error(f"Failed to publish status for note {note.id}: {e}")
+
+async def publish_note_statuses_on_commit(db, notes):
+    """
+    For the API's AsyncSession, before the commit that changes the statuses.
+    """
+    await get_broker().publish_on_commit(db, [(user_topic(note.user_id), _status_message(note)) for note in notes])
+
+def publish_delta(video_id: str, text: str):
+    broker = get_broker()
+    for i in range(0, len(text), MAX_DELTA_CHARS):
+        try:
+            broker.publish(generation_topic(video_id), {
+                "type": "delta",
+                "videoId": video_id,
+                "text": text[i:i + MAX_DELTA_CHARS],
+            })
+        except Exception as e:
+            logger.error(f"Failed to publish delta for video {video_id}: {e}")
+            return
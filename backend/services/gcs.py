@@ -1,45 +1,75 @@
-from google.cloud import storage
-import os
-from dotenv import load_dotenv
-import json
+"""
+Object keys and read/write helpers for note content.
+The bytes live in whichever NoteStore is configured (see note_store.py).
 
-load_dotenv()
+Finished notes are content-addressed (blobs/<sha256[:2]>/<sha256>.md), immutable and
+shared by every note version with the same content. Older trees stored
+notes under notes/user_<id>/ and notes/shared/; those keys are still read,
+never written.
+"""
+import hashlib
+from typing import NamedTuple, Optional
 
-GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "yt-note-maker-notes")
+from backend.services.note_store import get_store
 
-# Initialize client. 
-# Implicitly expects GOOGLE_APPLICATION_CREDENTIALS set or running in valid env.
-try:
-    storage_client = storage.Client()
-except Exception as e:
-    print(f"Warning: Could not init GCS client: {e}")
-    storage_client = None
+# Prefixes holding finished note content, current and legacy (see backend/prune.py)
+CONTENT_PREFIXES = ("blobs/", "notes/shared/", "notes/user_")
 
-def get_bucket():
-    if not storage_client:
-        raise Exception("GCS Client not initialized")
-    return storage_client.bucket(GCS_BUCKET_NAME)
+class ContentBlob(NamedTuple):
+    key: str
+    content_hash: str
+    size: int
+    encoding: Optional[str]
 
-def get_content_blob_name(user_id: str, video_id: str) -> str:
-    return f"notes/user_{user_id}/{video_id}.md"
+def get_blob_name(content_hash: str) -> str:
+    return f"blobs/{content_hash[:2]}/{content_hash}.md"
 
-def upload_note(user_id: str, video_id: str, content: str) -> str:
+def get_checkpoint_blob_name(cache_key: str) -> str:
+    return f"notes/partial/{cache_key}.md"
+
+def get_segment_blob_name(cache_key: str, start_seconds: int, end_seconds: int) -> str:
+    return f"notes/segments/{cache_key}/{start_seconds}-{end_seconds}.md"
+
+def upload_content_blob(content: str) -> ContentBlob:
     """
-    Uploads note content to GCS.
-    Returns the object key.
-    Target path: notes/user_<user_id>/<video_id>.md
+    Stores finished note content under its sha256.
+    Target path: blobs/<hash[:2]>/<hash>.md
+    Identical content maps to the same key, so it is stored once however many
+    notes and versions use it. The write is repeated even if the blob exists:
+    same bytes, but it refreshes the object's age, so prune's grace period
+    covers a blob that is being referenced again.
     """
-    bucket = get_bucket()
-    blob_name = get_content_blob_name(user_id, video_id)
-    blob = bucket.blob(blob_name)
-    
-    blob.upload_from_string(content, content_type="text/markdown")
-    return blob_name
+    data = content.encode("utf-8")
+    content_hash = hashlib.sha256(data).hexdigest()
+    store = get_store()
+    key = store.put(get_blob_name(content_hash), content)
+    return ContentBlob(key, content_hash, len(data), store.encoding)
 
 def get_note_content(blob_name: str) -> str:
     """
-    Downloads note content from GCS as string.
+    Downloads note content as string.
+    """
+    return get_store().get_text(blob_name)
+
+def upload_checkpoint(cache_key: str, content: str) -> str:
+    """
+    Saves partial output of an in-progress generation so a retry can resume it.
     """
-    bucket = get_bucket()
-    blob = bucket.blob(blob_name)
-    return blob.download_as_text()
+    return get_store().put(get_checkpoint_blob_name(cache_key), content)
+
+def get_checkpoint(cache_key: str) -> Optional[str]:
+    return get_store().get_text_or_none(get_checkpoint_blob_name(cache_key))
+
+def delete_checkpoint(cache_key: str):
+    get_store().delete(get_checkpoint_blob_name(cache_key))
+
+def upload_segment(cache_key: str, start_seconds: int, end_seconds: int, content: str) -> str:
+    return get_store().put(get_segment_blob_name(cache_key, start_seconds, end_seconds), content)
+
+def get_segment(cache_key: str, start_seconds: int, end_seconds: int) -> Optional[str]:
+    return get_store().get_text_or_none(get_segment_blob_name(cache_key, start_seconds, end_seconds))
+
+def delete_segments(cache_key: str):
+    store = get_store()
+    for key in store.list_keys(f"notes/segments/{cache_key}/"):
+        store.delete(key)
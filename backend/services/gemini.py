@@ -1,9 +1,12 @@
-import os
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
+import time
+import hashlib
+from dataclasses import dataclass
+from typing import Iterator, Optional, TYPE_CHECKING
+from backend.services.gemini_executor import get_executor
+from backend.services import usage
 
-load_dotenv()
+if TYPE_CHECKING:
+    from google.genai import types
 
 SYSTEM_PROMPT = """make complete in detail note of this tutorial in english.
 covering each and everything covered by the teacher.
@@ -13,28 +16,85 @@ Don't forget to include the intuition behind the algos.
 Act like a good student who makes notes for everyone to understand not like a transcript.
 Make sure no point is missed from the tutorial."""
 
-def generate_notes(video_url: str) -> str:
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment")
+GEMINI_MODEL = "gemini-3-flash-preview"
 
-    client = genai.Client(api_key=api_key)
+# Fingerprint of the prompt, so cached notes are invalidated when it changes
+PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
 
-    contents = [
+@dataclass(frozen=True)
+class Segment:
+    """
+    A time window of the video, generated independently of the others.
+    """
+    index: int
+    total: int
+    start_seconds: int
+    end_seconds: int
+
+TRANSCRIPT_PROMPT = """Below is the transcript of the tutorial. Make the notes from it.
+
+"""
+
+RESUME_PROMPT = """The notes below were cut off part way through.
+Continue them from exactly where they stop, keeping the same structure and style.
+Do not repeat anything that is already written.
+
+"""
+
+SEGMENT_PROMPT = """This is part {index} of {total} of the lecture, covering {start} to {end}.
+Write notes only for this part. Don't add an introduction or a summary of the whole lecture;
+the parts will be joined together in order."""
+
+def format_timestamp(seconds: int) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+def build_contents(
+    video_url: str,
+    resume_from: Optional[str] = None,
+    segment: Optional[Segment] = None,
+    transcript: Optional[str] = None,
+):
+    """
+    Builds the request from the video itself, or from its transcript when given.
+    """
+    from google.genai import types
+    if transcript:
+        source_part = types.Part.from_text(text=TRANSCRIPT_PROMPT + transcript)
+    else:
+        source_part = types.Part(
+            file_data=types.FileData(
+                file_uri=video_url,
+                mime_type="video/*",
+            )
+        )
+        if segment:
+            source_part.video_metadata = types.VideoMetadata(
+                start_offset=f"{segment.start_seconds}s",
+                end_offset=f"{segment.end_seconds}s",
+            )
+    parts = [source_part]
+    if segment:
+        parts.append(types.Part.from_text(text=SEGMENT_PROMPT.format(
+            index=segment.index + 1,
+            total=segment.total,
+            start=format_timestamp(segment.start_seconds),
+            end=format_timestamp(segment.end_seconds),
+        )))
+    if resume_from:
+        parts.append(types.Part.from_text(text=RESUME_PROMPT + resume_from))
+
+    return [
         types.Content(
             role="user",
-            parts=[
-                types.Part(
-                    file_data=types.FileData(
-                        file_uri=video_url,
-                        mime_type="video/*",
-                    )
-                ),
-            ],
+            parts=parts,
         ),
     ]
 
-    generate_content_config = types.GenerateContentConfig(
+def build_config() -> "types.GenerateContentConfig":
+    from google.genai import types
+    return types.GenerateContentConfig(
         thinking_config=types.ThinkingConfig(
             thinking_level="HIGH",
         ),
@@ -43,10 +103,38 @@ def generate_notes(video_url: str) -> str:
         ],
     )
 
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=contents,
-        config=generate_content_config,
+def generate_notes(video_url: str, segment: Optional[Segment] = None, transcript: Optional[str] = None) -> str:
+    """
+    Generates notes for the whole video, only for the given time window,
+    or from the transcript instead of the video.
+    """
+    # The executor records the usage of every request it makes
+    response = get_executor().generate(
+        GEMINI_MODEL,
+        build_contents(video_url, segment=segment, transcript=transcript),
+        build_config(),
     )
-    
     return response.text
+
+def generate_notes_stream(video_url: str, resume_from: Optional[str] = None, transcript: Optional[str] = None) -> Iterator[str]:
+    """
+    Yields markdown deltas as Gemini produces them.
+    If resume_from is given, the model continues those partial notes
+    and only the continuation is yielded.
+    """
+    stream = get_executor().generate_stream(
+        GEMINI_MODEL,
+        build_contents(video_url, resume_from, transcript=transcript),
+        build_config(),
+    )
+    # Each chunk's usage_metadata is the running total, so the last one seen counts
+    started = time.monotonic()
+    last_usage = None
+    try:
+        for chunk in stream:
+            if chunk.usage_metadata is not None:
+                last_usage = chunk.usage_metadata
+            if chunk.text:
+                yield chunk.text
+    finally:
+        usage.record(last_usage, time.monotonic() - started)
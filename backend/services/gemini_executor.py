@@ -0,0 +1,402 @@
+"""
+Long-lived executor for Gemini requests.
+
+One client per process (connection reuse), a global concurrency limit,
+jittered exponential backoff that honours the provider's retry-after hints,
+per-job deadlines and optional hedged requests for stragglers.
+
+A hedged call can cost up to twice the tokens: the losing request can't be
+interrupted, so it runs on (outside the concurrency limit) and its usage is
+recorded like any other call's.
+
+GEMINI_BACKEND=fake swaps the real API for FakeGeminiBackend, which has
+configurable latency and error rates for offline load testing.
+"""
+import os
+import re
+import time
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional, TYPE_CHECKING
+
+# google.genai takes about half a second to import, so it is deferred
+# until a backend is built (or an error needs classifying)
+if TYPE_CHECKING:
+    from google.genai import types
+
+from backend.services import usage
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "google")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "2"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "60"))
+# Upper bound for a single request; the job deadline can make it shorter
+GEMINI_REQUEST_TIMEOUT_SECONDS = float(os.getenv("GEMINI_REQUEST_TIMEOUT_SECONDS", "600"))
+# Start a second, identical request if the first hasn't finished after this long (0 = off).
+# Both requests are billed, so a hedged call can cost up to twice the tokens
+GEMINI_HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", "0"))
+
+GEMINI_FAKE_LATENCY_SECONDS = float(os.getenv("GEMINI_FAKE_LATENCY_SECONDS", "1"))
+GEMINI_FAKE_ERROR_RATE = float(os.getenv("GEMINI_FAKE_ERROR_RATE", "0"))
+GEMINI_FAKE_RATE_LIMIT_RATE = float(os.getenv("GEMINI_FAKE_RATE_LIMIT_RATE", "0"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class DeadlineExceeded(Exception):
+    pass
+
+@dataclass
+class GenerationResponse:
+    text: str
+    usage_metadata: Any = None
+
+# ---------------------------------------------------------------- deadlines
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("gemini_deadline", default=None)
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """
+    Every Gemini request made inside this block must finish within `seconds`
+    of entering it, including retries and waiting for a concurrency slot.
+    """
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+# ---------------------------------------------------------------- backends
+
+class GoogleGeminiBackend:
+    def __init__(self):
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment")
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    @staticmethod
+    def _with_timeout(config: "types.GenerateContentConfig", timeout: float) -> "types.GenerateContentConfig":
+        from google.genai import types
+        return config.model_copy(update={"http_options": types.HttpOptions(timeout=int(timeout * 1000))})
+
+    def generate(self, model: str, contents, config, timeout: float) -> GenerationResponse:
+        response = self.client.models.generate_content(
+            model=model,
+            contents=contents,
+            config=self._with_timeout(config, timeout),
+        )
+        return GenerationResponse(text=response.text, usage_metadata=response.usage_metadata)
+
+    def generate_stream(self, model: str, contents, config, timeout: float) -> Iterator[Any]:
+        return self.client.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=self._with_timeout(config, timeout),
+        )
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+@dataclass
+class _FakeChunk:
+    text: str
+    usage_metadata: Any = None
+
+class FakeGeminiBackend:
+    """
+    Offline stand-in with configurable latency, server error rate and
+    rate-limit rate. Produces deterministic markdown.
+    """
+
+    def __init__(self, latency: float = GEMINI_FAKE_LATENCY_SECONDS, error_rate: float = GEMINI_FAKE_ERROR_RATE,
+                 rate_limit_rate: float = GEMINI_FAKE_RATE_LIMIT_RATE, chunks: int = 8):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.chunks = chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        from google.genai import errors
+        with self._lock:
+            self.calls += 1
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            raise errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "fake rate limit",
+                                                     "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}]}})
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "fake outage"}})
+
+    def _text(self, contents) -> str:
+        return "# Notes\n\n" + "\n".join(f"## Section {i + 1}\n\nFake content {i + 1}.\n" for i in range(self.chunks))
+
+    def _usage(self, text: str):
+        from google.genai import types
+        return types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=1000,
+            candidates_token_count=len(text) // 4,
+            thoughts_token_count=200,
+        )
+
+    def generate(self, model: str, contents, config, timeout: float) -> GenerationResponse:
+        self._maybe_fail()
+        time.sleep(min(random.expovariate(1 / self.latency) if self.latency else 0, timeout))
+        text = self._text(contents)
+        return GenerationResponse(text=text, usage_metadata=self._usage(text))
+
+    def generate_stream(self, model: str, contents, config, timeout: float) -> Iterator[Any]:
+        self._maybe_fail()
+        text = self._text(contents)
+        pieces = text.split("## ")
+        for i, piece in enumerate(pieces):
+            time.sleep(self.latency / len(pieces))
+            last = i == len(pieces) - 1
+            yield _FakeChunk(text=("## " if i else "") + piece, usage_metadata=self._usage(text) if last else None)
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    "google": GoogleGeminiBackend,
+    "fake": FakeGeminiBackend,
+}
+
+# ---------------------------------------------------------------- executor
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Reads the server's retry hint: a Retry-After header, or the
+    google.rpc.RetryInfo retryDelay in the error details.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            if delay:
+                match = re.fullmatch(r"([\d.]+)s", delay)
+                if match:
+                    return float(match.group(1))
+    return None
+
+def _is_retryable(error: Exception) -> bool:
+    from google.genai import errors
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    # Timeouts and dropped connections from the HTTP layer
+    name = type(error).__name__
+    return "Timeout" in name or "Connect" in name or isinstance(error, (TimeoutError, ConnectionError))
+
+class _SlotHold:
+    """
+    The concurrency slot of one request in a hedge race. When the race is
+    won, the loser's slot is handed back right away (abandon()) rather than
+    when its request finally returns.
+    """
+
+    def __init__(self, slots: threading.BoundedSemaphore):
+        self._slots = slots
+        self._lock = threading.Lock()
+        self._held = False
+        self.abandoned = False
+
+    def take(self) -> bool:
+        """
+        Called with the slot acquired; gives it straight back and returns
+        False if the request was abandoned while waiting for it.
+        """
+        with self._lock:
+            if not self.abandoned:
+                self._held = True
+                return True
+        self._slots.release()
+        return False
+
+    def release(self):
+        with self._lock:
+            held, self._held = self._held, False
+        if held:
+            self._slots.release()
+
+    def abandon(self):
+        with self._lock:
+            self.abandoned = True
+        self.release()
+
+class GeminiExecutor:
+    def __init__(self, backend=None, max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 max_attempts: int = GEMINI_MAX_ATTEMPTS, hedge_after: float = GEMINI_HEDGE_AFTER_SECONDS):
+        self.backend = backend if backend is not None else BACKENDS[GEMINI_BACKEND]()
+        self.max_attempts = max_attempts
+        self.hedge_after = hedge_after
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="gemini-hedge")
+
+    def _request_timeout(self) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return GEMINI_REQUEST_TIMEOUT_SECONDS
+        if remaining <= 0:
+            raise DeadlineExceeded("Job deadline exceeded")
+        return min(remaining, GEMINI_REQUEST_TIMEOUT_SECONDS)
+
+    def _acquire_slot(self, blocking: bool = True) -> bool:
+        if not blocking:
+            return self._slots.acquire(blocking=False)
+        remaining = remaining_time()
+        if remaining is None:
+            return self._slots.acquire()
+        if not self._slots.acquire(timeout=max(remaining, 0)):
+            raise DeadlineExceeded("Timed out waiting for a Gemini slot")
+        return True
+
+    def _backoff(self, attempt: int, error: Exception):
+        hint = _retry_after_seconds(error)
+        ceiling = min(GEMINI_RETRY_MAX_SECONDS, GEMINI_RETRY_BASE_SECONDS * (2 ** attempt))
+        delay = random.uniform(0, ceiling)
+        if hint is not None:
+            # Never retry earlier than the server asked; jitter on top spreads the herd
+            delay = hint + random.uniform(0, GEMINI_RETRY_BASE_SECONDS)
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceeded(f"No time left to retry after: {error}") from error
+        logger.warning(f"Gemini request failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def _call_once(self, model, contents, config, hold: Optional[_SlotHold] = None) -> GenerationResponse:
+        hold = hold or _SlotHold(self._slots)
+        self._acquire_slot()
+        if not hold.take():
+            raise CancelledError("Hedged request no longer needed")
+        started = time.monotonic()
+        try:
+            response = self.backend.generate(model, contents, config, self._request_timeout())
+        finally:
+            hold.release()
+        # Recorded here rather than by the caller, so a hedge race's loser is
+        # counted too (its copied context shares the generation's collector)
+        usage.record(response.usage_metadata, time.monotonic() - started)
+        return response
+
+    def _call_hedged(self, model, contents, config) -> GenerationResponse:
+        ctx = contextvars.copy_context()
+        primary_hold = _SlotHold(self._slots)
+        primary = self._hedge_pool.submit(ctx.run, self._call_once, model, contents, config, primary_hold)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+        # Only hedge when there is spare capacity, so hedges never starve real work
+        if not self._acquire_slot(blocking=False):
+            return primary.result()
+        self._slots.release()
+        logger.info("Gemini request is slow, sending a hedged request")
+        hedge_hold = _SlotHold(self._slots)
+        hedge = self._hedge_pool.submit(contextvars.copy_context().run, self._call_once, model, contents, config, hedge_hold)
+        holds = {primary: primary_hold, hedge: hedge_hold}
+        pending = set(holds)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                    holds[loser].abandon()
+                return response
+        raise error
+
+    def generate(self, model: str, contents, config) -> GenerationResponse:
+        for attempt in range(self.max_attempts):
+            try:
+                if self.hedge_after > 0:
+                    return self._call_hedged(model, contents, config)
+                return self._call_once(model, contents, config)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if attempt + 1 >= self.max_attempts or not _is_retryable(e):
+                    raise
+                self._backoff(attempt, e)
+
+    def generate_stream(self, model: str, contents, config) -> Iterator[Any]:
+        """
+        Yields response chunks. Failures are retried only until the first
+        chunk arrives; after that a retry would duplicate output, so the
+        error propagates (the job checkpoint takes over).
+        """
+        for attempt in range(self.max_attempts):
+            started = False
+            self._acquire_slot()
+            try:
+                for chunk in self.backend.generate_stream(model, contents, config, self._request_timeout()):
+                    started = True
+                    yield chunk
+                    if remaining_time() is not None and remaining_time() <= 0:
+                        raise DeadlineExceeded("Job deadline exceeded mid-stream")
+                return
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if started or attempt + 1 >= self.max_attempts or not _is_retryable(e):
+                    raise
+                error = e
+            finally:
+                self._slots.release()
+            self._backoff(attempt, error)
+
+    def close(self):
+        self._hedge_pool.shutdown(wait=False)
+        self.backend.close()
+
+_executor: Optional[GeminiExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> GeminiExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = GeminiExecutor()
+    return _executor
+
+def set_executor(executor: Optional[GeminiExecutor]):
+    global _executor
+    _executor = executor
+
+def close_executor():
+    global _executor
+    if _executor is not None:
+        _executor.close()
+        _executor = None
@@ -0,0 +1,244 @@
+"""
+Logging setup for the API and workers.
+
+Records are put on a queue by the thread (or event loop) that logs them and
+written out by one listener thread, so a slow stdout/stderr never stalls a
+request. When the queue is full new records are dropped, not waited on.
+Output is one JSON object per line (LOG_FORMAT=json) or plain text.
+
+Every record carries the correlation fields of the work it belongs to:
+  - request_id: per HTTP request, from X-Request-ID or generated; stored on
+    the jobs the request enqueues, so worker logs for them carry it too
+  - job_id / note_id: inside a worker running a job
+
+High-volume loggers can be sampled with LOG_SAMPLE_RATES, e.g.
+"backend.access=0.1" keeps one in ten access lines. Warnings and errors are
+always kept. Volume, drops and time spent logging are exported as metrics.
+"""
+import os
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import datetime
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from backend.services import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 'json' (one object per line) or 'text'
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# logger=rate pairs, comma-separated; a logger uses the rate of its nearest configured ancestor
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+access_logger = logging.getLogger("backend.access")
+
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Correlation fields of the current request or job
+_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        name, sep, rate = item.partition("=")
+        if sep and name.strip():
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+@contextmanager
+def bind(**fields):
+    """
+    Adds correlation fields (None values are skipped) to every record
+    logged inside the block, including from tasks and copied contexts it starts.
+    """
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def get_request_id() -> Optional[str]:
+    return _context.get().get("request_id")
+
+class ContextFilter(logging.Filter):
+    """
+    Samples and stamps records. Filters run on the thread that logs the
+    record, before it is queued, so the context is still the request's or
+    job's; the listener thread only formats and writes.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            prefix = name
+            while prefix and prefix not in self.rates:
+                prefix = prefix.rpartition(".")[0]
+            rate = self._resolved[name] = self.rates.get(prefix, 1.0)
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rates and record.levelno < logging.WARNING:
+            rate = self._rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                metrics.log_records_dropped.inc(reason="sampled")
+                return False
+        record.context = _context.get()
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    def handle(self, record: logging.LogRecord):
+        started = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            metrics.log_emit_seconds.inc(time.perf_counter() - started)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now (args may change or not be
+        # thread-safe later) but keep them apart for the JSON formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_records_dropped.inc(reason="queue_full")
+            return
+        metrics.log_records.inc(level=record.levelname)
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "context"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s%(context_text)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = getattr(record, "context", {})
+        record.context_text = " [" + " ".join(f"{k}={v}" for k, v in context.items()) + "]" if context else ""
+        return super().format(record)
+
+_listener: Optional[QueueListener] = None
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """
+    Sends the root logger (and uvicorn's error log) through the queue.
+    uvicorn's access log is turned off: RequestContextMiddleware writes one
+    with the request ID and duration. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in ("uvicorn", "uvicorn.error"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """
+    Writes out the queued records and stops the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware binding a request_id to everything logged while a
+    request is handled (the caller's X-Request-ID if it looks sane), echoing
+    it in the response, and writing one access line when the response ends.
+    5xx lines are logged as warnings, so sampling never hides them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        with bind(request_id=request_id):
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            finally:
+                duration_ms = int((time.perf_counter() - started) * 1000)
+                access_logger.log(
+                    logging.WARNING if status >= 500 else logging.INFO,
+                    f"{scope['method']} {scope['path']} {status} {duration_ms}ms",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status,
+                        "duration_ms": duration_ms,
+                        "origin": headers.get(b"origin", b"").decode("latin-1") or None,
+                    },
+                )
@@ -0,0 +1,241 @@
+"""
+Async video metadata lookup (title, channel, duration).
+
+Uses the YouTube Data API when YOUTUBE_API_KEY is set (one call returns all
+three fields), otherwise the keyless oEmbed endpoint (no duration).
+Results are kept in a TTL + LRU cache and concurrent lookups for the same
+video share one request.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+YOUTUBE_OEMBED_URL = os.getenv("YOUTUBE_OEMBED_URL", "https://www.youtube.com/oembed")
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "2048"))
+METADATA_CACHE_TTL_SECONDS = int(os.getenv("METADATA_CACHE_TTL_SECONDS", "21600"))
+METADATA_TIMEOUT_SECONDS = float(os.getenv("METADATA_TIMEOUT_SECONDS", "5"))
+# Parallel per-video lookups when resolving many videos without the Data API
+METADATA_BATCH_CONCURRENCY = int(os.getenv("METADATA_BATCH_CONCURRENCY", "8"))
+DATA_API_PAGE_SIZE = 50
+
+DEFAULT_TITLE = "YouTube Note"
+
+@dataclass
+class VideoMetadata:
+    video_id: str
+    title: str
+    channel: Optional[str] = None
+    duration_seconds: Optional[int] = None
+
+class TTLCache:
+    """
+    Size-bounded LRU whose entries also expire after a fixed TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+_cache = TTLCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL_SECONDS)
+_inflight: Dict[str, asyncio.Future] = {}
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=METADATA_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _client
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def parse_iso8601_duration(value: str) -> Optional[int]:
+    match = re.fullmatch(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?", value or "")
+    if not match:
+        return None
+    days, hours, minutes, seconds = (int(g) if g else 0 for g in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def _from_data_api_item(item: dict) -> VideoMetadata:
+    snippet = item.get("snippet", {})
+    content_details = item.get("contentDetails", {})
+    return VideoMetadata(
+        video_id=item["id"],
+        title=snippet.get("title") or DEFAULT_TITLE,
+        channel=snippet.get("channelTitle"),
+        duration_seconds=parse_iso8601_duration(content_details.get("duration")),
+    )
+
+async def _fetch_many_from_data_api(video_ids: List[str]) -> List[VideoMetadata]:
+    """
+    Up to DATA_API_PAGE_SIZE videos in one call.
+    """
+    resp = await get_client().get(
+        "https://www.googleapis.com/youtube/v3/videos",
+        params={"part": "snippet,contentDetails", "id": ",".join(video_ids), "key": YOUTUBE_API_KEY},
+    )
+    if resp.status_code != 200:
+        return []
+    return [_from_data_api_item(item) for item in resp.json().get("items") or []]
+
+async def _fetch_from_data_api(video_id: str) -> Optional[VideoMetadata]:
+    found = await _fetch_many_from_data_api([video_id])
+    return found[0] if found else None
+
+async def _fetch_from_oembed(video_id: str) -> Optional[VideoMetadata]:
+    resp = await get_client().get(
+        YOUTUBE_OEMBED_URL,
+        params={"url": f"https://www.youtube.com/watch?v={video_id}", "format": "json"},
+    )
+    if resp.status_code != 200:
+        return None
+    data = resp.json()
+    return VideoMetadata(
+        video_id=video_id,
+        title=data.get("title", "Untitled Video"),
+        channel=data.get("author_name"),
+    )
+
+async def _fetch(video_id: str) -> Optional[VideoMetadata]:
+    try:
+        if YOUTUBE_API_KEY:
+            return await _fetch_from_data_api(video_id)
+        return await _fetch_from_oembed(video_id)
+    except Exception as e:
+        logger.error(f"Error fetching video metadata: {e}")
+        return None
+
+def get_cached_metadata(video_id: str) -> Optional[VideoMetadata]:
+    return _cache.get(video_id)
+
+async def get_video_metadata(video_id: str) -> Optional[VideoMetadata]:
+    """
+    Returns metadata for the video, or None if it could not be fetched.
+    Failures are not cached, so the next request tries again.
+    """
+    cached = _cache.get(video_id)
+    if cached:
+        return cached
+
+    future = _inflight.get(video_id)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[video_id] = future
+    try:
+        metadata = await _fetch(video_id)
+        if metadata:
+            _cache.set(video_id, metadata)
+        future.set_result(metadata)
+        return metadata
+    except BaseException:
+        # _fetch swallows errors, so this is cancellation; waiters see it too
+        future.cancel()
+        raise
+    finally:
+        _inflight.pop(video_id, None)
+
+async def get_videos_metadata(video_ids: Iterable[str]) -> Dict[str, VideoMetadata]:
+    """
+    Metadata for many videos: cache hits first, then one Data API call per
+    50 videos, or bounded parallel oEmbed lookups without an API key.
+    Videos that could not be resolved are missing from the result.
+    """
+    results = {}
+    missing = []
+    for video_id in dict.fromkeys(video_ids):
+        cached = _cache.get(video_id)
+        if cached:
+            results[video_id] = cached
+        else:
+            missing.append(video_id)
+
+    if YOUTUBE_API_KEY:
+        for i in range(0, len(missing), DATA_API_PAGE_SIZE):
+            try:
+                found = await _fetch_many_from_data_api(missing[i:i + DATA_API_PAGE_SIZE])
+            except Exception as e:
+                logger.error(f"Error fetching video metadata: {e}")
+                continue
+            for metadata in found:
+                _cache.set(metadata.video_id, metadata)
+                results[metadata.video_id] = metadata
+        return results
+
+    semaphore = asyncio.Semaphore(METADATA_BATCH_CONCURRENCY)
+
+    async def lookup(video_id: str):
+        async with semaphore:
+            return await get_video_metadata(video_id)
+
+    for metadata in await asyncio.gather(*(lookup(video_id) for video_id in missing)):
+        if metadata:
+            results[metadata.video_id] = metadata
+    return results
+
+async def get_playlist_video_ids(playlist_id: str, limit: int) -> List[str]:
+    """
+    Video IDs of a playlist in order, at most limit.
+    Raises ValueError if the playlist can't be read.
+    """
+    if not YOUTUBE_API_KEY:
+        raise ValueError("Playlists require YOUTUBE_API_KEY")
+    video_ids = []
+    page_token = None
+    while len(video_ids) < limit:
+        params = {
+            "part": "snippet,contentDetails",
+            "playlistId": playlist_id,
+            "maxResults": DATA_API_PAGE_SIZE,
+            "key": YOUTUBE_API_KEY,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        resp = await get_client().get("https://www.googleapis.com/youtube/v3/playlistItems", params=params)
+        if resp.status_code != 200:
+            raise ValueError(f"Could not read playlist {playlist_id}")
+        data = resp.json()
+        for item in data.get("items") or []:
+            video_id = item.get("contentDetails", {}).get("videoId")
+            if video_id:
+                video_ids.append(video_id)
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
+    return video_ids[:limit]
+
@@ -0,0 +1,259 @@
+"""
+Process-wide metrics in the Prometheus text format, served by the API at
+/metrics and, for external workers, on WORKER_METRICS_PORT.
+
+Recording is a dict lookup and a few additions under a lock, cheap enough
+for the request path. Each process exposes its own values; Prometheus sums
+them across instances.
+
+Pipeline stages are timed with `stage()`, which also collects the timings
+of the generation being run on this thread so they can be stored on the
+note (Note.stage_timings) and queried per video, e.g. in Postgres:
+
+    SELECT width_bucket(duration_seconds, 0, 7200, 8) AS bucket,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY (stage_timings->>'gemini_ms')::int) AS p50,
+           percentile_cont(0.99) WITHIN GROUP (ORDER BY (stage_timings->>'gemini_ms')::int) AS p99
+    FROM notes WHERE stage_timings IS NOT NULL GROUP BY bucket ORDER BY bucket;
+"""
+import os
+import math
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Serves /metrics from `python -m backend.worker` on this port (0 disables)
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+# Seconds; generation stages run from milliseconds (cache hits) to many minutes (long videos)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        # Enum members (NoteStatus, GenerationPath) are labelled by their value
+        return tuple(str(getattr(labels.get(name, ""), "value", labels.get(name, ""))) for name in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._render_samples(items))
+        return "\n".join(lines)
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """
+        Counts the block as in progress while it runs.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then count and sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    def _render_samples(self, items):
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_count{labels} {count}"
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+
+REGISTRY = []
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------------------------------------------------------------- pipeline
+
+stage_seconds = Histogram("note_stage_seconds", "Time spent in each note generation stage.", ["stage"])
+generations = Counter("note_generations_total", "Finished note generations by how they were produced and outcome.", ["path", "outcome"])
+generations_in_flight = Gauge("note_generations_in_flight", "Note generations currently running in this process.")
+sse_streams_open = Gauge("sse_streams_open", "Open server-sent event streams.", ["stream"])
+admission_decisions = Counter("admission_decisions_total", "Generation requests by admission outcome.", ["outcome"])
+gemini_tokens = Counter("gemini_tokens_total", "Tokens reported by Gemini responses, by kind (input, output, thinking).", ["kind"])
+
+# stage -> milliseconds for the generation running in this context
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("stage_timings", default=None)
+
+@contextmanager
+def collect_stage_timings():
+    """
+    Collects the stage() timings recorded inside the block into the yielded dict.
+    """
+    timings: Dict[str, int] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a pipeline stage into note_stage_seconds and, if a generation is
+    collecting them, its stage timings (repeated stages add up).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=name)
+        timings = _stage_timings.get()
+        if timings is not None:
+            key = f"{name}_ms"
+            timings[key] = timings.get(key, 0) + int(elapsed * 1000)
+
+# ---------------------------------------------------------------- DB pool
+
+pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool, including opening new ones.",
+    ["engine"], buckets=POOL_WAIT_BUCKETS,
+)
+pool_checked_out = Gauge("db_pool_connections_checked_out", "Pool connections currently in use.", ["engine"])
+pool_connections_opened = Counter("db_pool_connections_opened_total", "New database connections opened by the pool.", ["engine"])
+db_queries = Counter("db_queries_total", "SQL statements executed.", ["engine"])
+
+def instrument_pool(engine, name: str):
+    """
+    Tracks checkout wait, connections in use and new connections for the
+    engine's pool, and statements executed on the engine. In-use and opened counts come from pool events. The pool
+    has no event for the start of a checkout, so the wait is timed around
+    pool.connect(), which every engine connection goes through.
+    """
+    from sqlalchemy import event
+
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started, engine=name)
+
+    pool.connect = timed_connect
+    event.listen(pool, "checkout", lambda *args: pool_checked_out.inc(engine=name))
+    event.listen(pool, "checkin", lambda *args: pool_checked_out.dec(engine=name))
+    event.listen(pool, "connect", lambda *args: pool_connections_opened.inc(engine=name))
+    event.listen(engine, "before_cursor_execute", lambda *args: db_queries.inc(engine=name))
+
+# ---------------------------------------------------------------- logging
+
+log_records = Counter("log_records_total", "Log records queued for output.", ["level"])
+log_records_dropped = Counter("log_records_dropped_total", "Log records not written, by reason (sampled, queue_full).", ["reason"])
+log_emit_seconds = Counter("log_emit_seconds_total", "Time the logging threads spent handing records to the log queue.")
+
+# ---------------------------------------------------------------- worker endpoint
+
+def serve(port: int = WORKER_METRICS_PORT):
+    """
+    Serves /metrics from a background thread (for processes without the API).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
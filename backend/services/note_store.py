@@ -0,0 +1,394 @@
+"""
+Pluggable storage for note markdown.
+
+NOTE_STORE selects the engine:
+  - "gcs": Google Cloud Storage bucket GCS_BUCKET_NAME
+  - "local": files under NOTE_STORE_DIR, for local dev and load testing
+
+Blobs are stored compressed (NOTE_COMPRESSION: gzip, zstd or none) and the
+encoding is recorded in the object metadata, so downloads can hand the
+stored bytes straight to clients that accept that encoding.
+"""
+import os
+import hmac
+import time
+import gzip
+import hashlib
+import datetime
+import json
+import mmap
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+NOTE_STORE = os.getenv("NOTE_STORE", "gcs")
+NOTE_STORE_DIR = os.getenv("NOTE_STORE_DIR", "note_store")
+NOTE_COMPRESSION = os.getenv("NOTE_COMPRESSION", "gzip")
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "yt-note-maker-notes")
+# Where LocalNoteStore's signed URLs point (the API serves them at /local-store/...)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000")
+NOTE_URL_SIGNING_KEY = os.getenv("NOTE_URL_SIGNING_KEY") or os.getenv("SECRET_KEY") or os.urandom(32).hex()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class NoteNotFound(Exception):
+    pass
+
+@dataclass
+class StoredBlob:
+    """
+    Bytes exactly as stored, plus the Content-Encoding they are stored with.
+    """
+    data: bytes
+    encoding: Optional[str]
+    content_type: str = "text/markdown"
+
+def _resolve_encoding(requested: str) -> Optional[str]:
+    if requested == "zstd" and zstandard is None:
+        logger.warning("zstandard not installed, falling back to gzip note compression")
+        return "gzip"
+    if requested in ("gzip", "zstd"):
+        return requested
+    return None
+
+def encode(content: str, encoding: Optional[str]) -> bytes:
+    data = content.encode("utf-8")
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return data
+
+def decode(blob: StoredBlob) -> str:
+    data = blob.data
+    if blob.encoding == "gzip":
+        data = gzip.decompress(data)
+    elif blob.encoding == "zstd":
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return data.decode("utf-8")
+
+@dataclass
+class BlobInfo:
+    size: int
+    encoding: Optional[str]
+    content_type: str = "text/markdown"
+    updated_at: Optional[datetime.datetime] = None  # UTC, naive
+
+CHUNK_SIZE = 256 * 1024
+
+class NoteStore:
+    def __init__(self, compression: str = NOTE_COMPRESSION):
+        self.encoding = _resolve_encoding(compression)
+
+    def put(self, key: str, content: str, content_type: str = "text/markdown") -> str:
+        """
+        Stores content under key, compressed with the configured encoding.
+        Returns the key.
+        """
+        self.put_raw(key, StoredBlob(encode(content, self.encoding), self.encoding, content_type))
+        return key
+
+    def get_text(self, key: str) -> str:
+        return decode(self.get_raw(key))
+
+    def get_text_or_none(self, key: str) -> Optional[str]:
+        try:
+            return self.get_text(key)
+        except NoteNotFound:
+            return None
+
+    def put_raw(self, key: str, blob: StoredBlob):
+        raise NotImplementedError
+
+    def get_raw(self, key: str) -> StoredBlob:
+        """
+        Returns the stored bytes without decompressing them.
+        Raises NoteNotFound if the key doesn't exist.
+        """
+        raise NotImplementedError
+
+    def stat(self, key: str) -> BlobInfo:
+        """
+        Stored size and encoding, without reading the content.
+        Raises NoteNotFound if the key doesn't exist.
+        """
+        raise NotImplementedError
+
+    def iter_raw(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Yields the stored bytes [start, end] (inclusive) in chunks.
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def list_keys(self, prefix: str) -> List[str]:
+        raise NotImplementedError
+
+    def list_blobs(self, prefix: str) -> Iterator[Tuple[str, BlobInfo]]:
+        """
+        (key, info) for every blob under prefix, with its last write time.
+        """
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """
+        Filesystem path of the stored bytes, if the engine has one (enables sendfile).
+        """
+        return None
+
+    def signed_url(self, key: str, expires_in: int, content_disposition: str, content_type: str = "text/markdown") -> str:
+        """
+        Short-lived URL that lets a client download the blob directly from storage.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class GCSNoteStore(NoteStore):
+    def __init__(self, bucket_name: str = GCS_BUCKET_NAME, compression: str = NOTE_COMPRESSION):
+        super().__init__(compression)
+        from google.cloud import storage
+        # Implicitly expects GOOGLE_APPLICATION_CREDENTIALS set or running in valid env.
+        self.client = storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+
+    def put_raw(self, key: str, blob: StoredBlob):
+        gcs_blob = self.bucket.blob(key)
+        # Recorded as Content-Encoding; gzip objects are also transcoded by GCS
+        # for clients that don't accept gzip
+        gcs_blob.content_encoding = blob.encoding
+        gcs_blob.upload_from_string(blob.data, content_type=blob.content_type)
+
+    def get_raw(self, key: str) -> StoredBlob:
+        from google.api_core.exceptions import NotFound
+        gcs_blob = self.bucket.blob(key)
+        try:
+            # raw_download keeps the stored bytes; the response headers fill in
+            # content_encoding, so no separate metadata request is needed
+            data = gcs_blob.download_as_bytes(raw_download=True)
+        except NotFound:
+            raise NoteNotFound(key)
+        return StoredBlob(data, gcs_blob.content_encoding or None, gcs_blob.content_type or "text/markdown")
+
+    def stat(self, key: str) -> BlobInfo:
+        gcs_blob = self.bucket.get_blob(key)
+        if gcs_blob is None:
+            raise NoteNotFound(key)
+        return BlobInfo(gcs_blob.size, gcs_blob.content_encoding or None, gcs_blob.content_type or "text/markdown")
+
+    def iter_raw(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        if end is None:
+            end = self.stat(key).size - 1
+        gcs_blob = self.bucket.blob(key)
+        position = start
+        while position <= end:
+            chunk_end = min(position + chunk_size - 1, end)
+            yield gcs_blob.download_as_bytes(start=position, end=chunk_end, raw_download=True)
+            position = chunk_end + 1
+
+    def delete(self, key: str):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(key).delete()
+        except NotFound:
+            pass
+
+    def list_keys(self, prefix: str) -> List[str]:
+        return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+
+    def list_blobs(self, prefix: str) -> Iterator[Tuple[str, BlobInfo]]:
+        for gcs_blob in self.client.list_blobs(self.bucket, prefix=prefix):
+            updated = gcs_blob.updated.astimezone(datetime.timezone.utc).replace(tzinfo=None) if gcs_blob.updated else None
+            yield gcs_blob.name, BlobInfo(gcs_blob.size, gcs_blob.content_encoding or None, gcs_blob.content_type or "text/markdown", updated)
+
+    def signed_url(self, key: str, expires_in: int, content_disposition: str, content_type: str = "text/markdown") -> str:
+        kwargs = {}
+        credentials = self.client._credentials
+        if not hasattr(credentials, "sign_bytes"):
+            # Compute Engine / Cloud Run credentials can't sign locally;
+            # sign through the IAM API with the service account's token instead
+            import google.auth.transport.requests
+            credentials.refresh(google.auth.transport.requests.Request())
+            kwargs = {"service_account_email": credentials.service_account_email, "access_token": credentials.token}
+        return self.bucket.blob(key).generate_signed_url(
+            version="v4",
+            expiration=datetime.timedelta(seconds=expires_in),
+            method="GET",
+            response_disposition=content_disposition,
+            response_type=content_type,
+            **kwargs,
+        )
+
+    def close(self):
+        self.client.close()
+
+class LocalNoteStore(NoteStore):
+    """
+    Stores blobs as files under root, with a small JSON sidecar holding the
+    encoding and content type. Reads go through mmap and downloads can be
+    served straight from local_path().
+    """
+
+    META_SUFFIX = ".meta.json"
+
+    def __init__(self, root: str = NOTE_STORE_DIR, compression: str = NOTE_COMPRESSION):
+        super().__init__(compression)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid note key: {key}")
+        return path
+
+    def put_raw(self, key: str, blob: StoredBlob):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename, so readers never see a partial blob
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob.data)
+        with open(tmp + self.META_SUFFIX, "w") as f:
+            json.dump({"encoding": blob.encoding, "content_type": blob.content_type}, f)
+        os.replace(tmp + self.META_SUFFIX, path + self.META_SUFFIX)
+        os.replace(tmp, path)
+
+    def _read_meta(self, path: str) -> dict:
+        try:
+            with open(path + self.META_SUFFIX) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get_raw(self, key: str) -> StoredBlob:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        data = mm[:]
+                else:
+                    data = b""
+        except FileNotFoundError:
+            raise NoteNotFound(key)
+        meta = self._read_meta(path)
+        return StoredBlob(data, meta.get("encoding"), meta.get("content_type", "text/markdown"))
+
+    def stat(self, key: str) -> BlobInfo:
+        path = self._path(key)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            raise NoteNotFound(key)
+        meta = self._read_meta(path)
+        return BlobInfo(size, meta.get("encoding"), meta.get("content_type", "text/markdown"))
+
+    def iter_raw(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise NoteNotFound(key)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            end = size - 1 if end is None else min(end, size - 1)
+            if size == 0 or start > end:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for position in range(start, end + 1, chunk_size):
+                    yield mm[position:min(position + chunk_size, end + 1)]
+
+    def delete(self, key: str):
+        path = self._path(key)
+        for p in (path, path + self.META_SUFFIX):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def list_keys(self, prefix: str) -> List[str]:
+        keys = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(self.META_SUFFIX) or name.endswith(".tmp"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def list_blobs(self, prefix: str) -> Iterator[Tuple[str, BlobInfo]]:
+        for key in self.list_keys(prefix):
+            path = self._path(key)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            meta = self._read_meta(path)
+            updated = datetime.datetime.utcfromtimestamp(st.st_mtime)
+            yield key, BlobInfo(st.st_size, meta.get("encoding"), meta.get("content_type", "text/markdown"), updated)
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def signed_url(self, key: str, expires_in: int, content_disposition: str, content_type: str = "text/markdown") -> str:
+        # Stand-in for GCS signed URLs: an HMAC over key, expiry and disposition,
+        # verified by the API's /local-store route
+        expires = int(time.time()) + expires_in
+        query = urlencode({
+            "expires": expires,
+            "disposition": content_disposition,
+            "signature": _local_signature(key, expires, content_disposition),
+        })
+        return f"{PUBLIC_BASE_URL}/local-store/{quote(key)}?{query}"
+
+def _local_signature(key: str, expires: int, disposition: str) -> str:
+    message = f"{key}\n{expires}\n{disposition}".encode("utf-8")
+    return hmac.new(NOTE_URL_SIGNING_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+def verify_local_signature(key: str, expires: int, disposition: str, signature: str) -> bool:
+    """
+    Checks a URL produced by LocalNoteStore.signed_url.
+    """
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_local_signature(key, expires, disposition), signature)
+
+STORES = {
+    "gcs": GCSNoteStore,
+    "local": LocalNoteStore,
+}
+
+_store: Optional[NoteStore] = None
+_store_lock = threading.Lock()
+
+def get_store() -> NoteStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = STORES[NOTE_STORE]()
+    return _store
+
+def set_store(store: Optional[NoteStore]):
+    global _store
+    _store = store
+
+def close_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,276 @@
+import os
+import random
+import datetime
+import logging
+from typing import Optional, List
+from sqlalchemy import select, insert, update, literal, exists, func, String
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import db_models
+from backend.db_models import JobStatus, NoteStatus
+from backend.services import events
+from backend.services import logs
+from backend.services.db import NOTE_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "900"))
+# Notes younger than this are still being enqueued by the API, don't treat them as stale
+STALE_NOTE_GRACE_SECONDS = int(os.getenv("STALE_NOTE_GRACE_SECONDS", "60"))
+# Scheduler caps on leased (running) jobs; 0 disables a cap
+JOB_MAX_LEASED_PER_USER = int(os.getenv("JOB_MAX_LEASED_PER_USER", "2"))
+JOB_MAX_LEASED_GLOBAL = int(os.getenv("JOB_MAX_LEASED_GLOBAL", "0"))
+
+VIDEO_URL_PREFIX = "https://www.youtube.com/watch?v="
+
+ACTIVE_JOB_STATUSES = [JobStatus.QUEUED, JobStatus.LEASED]
+
+def _now():
+    return datetime.datetime.utcnow()
+
+def enqueue_job(db: Session, note_id: int, user_id: int, video_id: str, video_url: str, commit: bool = True):
+    job = db_models.Job(
+        note_id=note_id,
+        user_id=user_id,
+        video_id=video_id,
+        video_url=video_url,
+        status=JobStatus.QUEUED,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        available_at=_now(),
+        request_id=logs.get_request_id(),
+    )
+    db.add(job)
+    if commit:
+        db.commit()
+        db.refresh(job)
+    return job
+
+def enqueue_if_idle_statement(note_id: int, user_id: int, video_id: str, video_url: str):
+    """
+    INSERT ... SELECT ... WHERE NOT EXISTS: adds a job unless the note
+    already has one queued or leased, in a single statement.
+    """
+    Job = db_models.Job
+    active = select(Job.id).where(Job.note_id == note_id, Job.status.in_(ACTIVE_JOB_STATUSES))
+    row = select(
+        literal(note_id),
+        literal(user_id),
+        literal(video_id),
+        literal(video_url),
+        literal(JobStatus.QUEUED.value),
+        literal(JOB_MAX_ATTEMPTS),
+        literal(_now()),
+        literal(logs.get_request_id(), String),
+    ).where(~exists(active))
+    return insert(Job).from_select(
+        [Job.note_id, Job.user_id, Job.video_id, Job.video_url, Job.status, Job.max_attempts, Job.available_at, Job.request_id],
+        row,
+    )
+
+def enqueue_notes_if_idle_statement(note_ids: List[int]):
+    """
+    Like enqueue_if_idle_statement for many notes at once, reading the
+    user and video from each note.
+    """
+    Note = db_models.Note
+    Job = db_models.Job
+    active = select(Job.id).where(Job.note_id == Note.id, Job.status.in_(ACTIVE_JOB_STATUSES))
+    rows = select(
+        Note.id,
+        Note.user_id,
+        Note.video_id,
+        literal(VIDEO_URL_PREFIX) + Note.video_id,
+        literal(JobStatus.QUEUED.value),
+        literal(JOB_MAX_ATTEMPTS),
+        literal(_now()),
+        literal(logs.get_request_id(), String),
+    ).where(Note.id.in_(note_ids), ~exists(active))
+    return insert(Job).from_select(
+        [Job.note_id, Job.user_id, Job.video_id, Job.video_url, Job.status, Job.max_attempts, Job.available_at, Job.request_id],
+        rows,
+    )
+
+def enqueue_job_if_idle(db: Session, note_id: int, user_id: int, video_id: str, video_url: str) -> bool:
+    """
+    Returns True if a job was added.
+    """
+    result = db.execute(enqueue_if_idle_statement(note_id, user_id, video_id, video_url))
+    db.commit()
+    return result.rowcount > 0
+
+async def enqueue_job_if_idle_async(db: AsyncSession, note_id: int, user_id: int, video_id: str, video_url: str) -> bool:
+    result = await db.execute(enqueue_if_idle_statement(note_id, user_id, video_id, video_url))
+    await db.commit()
+    return result.rowcount > 0
+
+def has_active_job(db: Session, note_id: int) -> bool:
+    Job = db_models.Job
+    return db.query(Job.id).filter(
+        Job.note_id == note_id,
+        Job.status.in_(ACTIVE_JOB_STATUSES),
+    ).first() is not None
+
+def lease_job(db: Session, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[db_models.Job]:
+    """
+    Claims the next job for this worker, fairly across users: users with the
+    fewest jobs in flight go first (ties go to the longest-waiting job, so
+    users take turns), and no user holds more than JOB_MAX_LEASED_PER_USER.
+    One user's 200-video playlist therefore can't starve everyone else.
+    The claim is a conditional UPDATE, so two workers can never lease the same job.
+    """
+    Job = db_models.Job
+    now = _now()
+    if JOB_MAX_LEASED_GLOBAL:
+        leased_total = db.scalar(select(func.count(Job.id)).where(Job.status == JobStatus.LEASED))
+        if leased_total >= JOB_MAX_LEASED_GLOBAL:
+            return None
+
+    in_flight = select(Job.user_id, func.count(Job.id).label("leased")).where(
+        Job.status == JobStatus.LEASED,
+    ).group_by(Job.user_id).subquery()
+    leased = func.coalesce(in_flight.c.leased, 0)
+    candidates = select(Job.id, Job.user_id).outerjoin(in_flight, in_flight.c.user_id == Job.user_id).where(
+        Job.status == JobStatus.QUEUED,
+        Job.available_at <= now,
+    )
+    if JOB_MAX_LEASED_PER_USER:
+        candidates = candidates.where(leased < JOB_MAX_LEASED_PER_USER)
+    candidates = candidates.order_by(leased, Job.available_at, Job.id).limit(5)
+
+    for job_id, user_id in db.execute(candidates).all():
+        claim = update(Job).where(Job.id == job_id, Job.status == JobStatus.QUEUED)
+        if JOB_MAX_LEASED_PER_USER:
+            # Re-checked in the claim so concurrent workers can't overshoot the cap
+            Leased = aliased(Job)
+            user_leased = select(func.count(Leased.id)).where(
+                Leased.user_id == user_id,
+                Leased.status == JobStatus.LEASED,
+            ).scalar_subquery()
+            claim = claim.where(user_leased < JOB_MAX_LEASED_PER_USER)
+        claimed = db.execute(claim.values(
+            status=JobStatus.LEASED,
+            locked_by=worker_id,
+            lease_expires_at=now + datetime.timedelta(seconds=lease_seconds),
+            attempts=Job.attempts + 1,
+            updated_at=now,
+        )).rowcount
+        db.commit()
+        if claimed:
+            return db.query(Job).filter(Job.id == job_id).first()
+    return None
+
+def extend_lease(db: Session, job_ids: List[int], worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> int:
+    """
+    Heartbeat for jobs that are still running, so their lease does not expire.
+    """
+    if not job_ids:
+        return 0
+    Job = db_models.Job
+    now = _now()
+    count = db.query(Job).filter(
+        Job.id.in_(job_ids),
+        Job.status == JobStatus.LEASED,
+        Job.locked_by == worker_id,
+    ).update({
+        Job.lease_expires_at: now + datetime.timedelta(seconds=lease_seconds),
+        Job.updated_at: now,
+    }, synchronize_session=False)
+    db.commit()
+    return count
+
+def complete_job(db: Session, job_id: int, worker_id: str):
+    Job = db_models.Job
+    db.query(Job).filter(Job.id == job_id, Job.locked_by == worker_id).update({
+        Job.status: JobStatus.DONE,
+        Job.lease_expires_at: None,
+        Job.updated_at: _now(),
+    }, synchronize_session=False)
+    db.commit()
+
+def retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+    ceiling = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return random.uniform(0, ceiling)
+
+def fail_job(db: Session, job: db_models.Job, worker_id: str, error: str) -> bool:
+    """
+    Records a failed attempt. Returns True if the job was rescheduled,
+    False if it has used all of its attempts.
+    """
+    Job = db_models.Job
+    now = _now()
+    will_retry = job.attempts < job.max_attempts
+    values = {
+        Job.last_error: error[:2000],
+        Job.lease_expires_at: None,
+        Job.updated_at: now,
+    }
+    if will_retry:
+        values[Job.status] = JobStatus.QUEUED
+        values[Job.available_at] = now + datetime.timedelta(seconds=retry_delay(job.attempts))
+    else:
+        values[Job.status] = JobStatus.FAILED
+    db.query(Job).filter(Job.id == job.id, Job.locked_by == worker_id).update(values, synchronize_session=False)
+    db.commit()
+    return will_retry
+
+def reap_expired_leases(db: Session) -> int:
+    """
+    Requeues jobs whose worker stopped heartbeating (crash, deploy, OOM).
+    Jobs that are out of attempts are failed along with their note.
+    """
+    Job = db_models.Job
+    now = _now()
+    expired = db.query(Job).filter(
+        Job.status == JobStatus.LEASED,
+        Job.lease_expires_at < now,
+    ).all()
+    failed_notes = []
+    for job in expired:
+        if job.attempts >= job.max_attempts:
+            job.status = JobStatus.FAILED
+            job.last_error = "Lease expired"
+            note = db.query(db_models.Note).filter(db_models.Note.id == job.note_id).first()
+            if note and note.status in NOTE_TRANSITIONS[NoteStatus.FAILED]:
+                note.status = NoteStatus.FAILED
+                note.updated_at = now
+                failed_notes.append(note)
+        else:
+            job.status = JobStatus.QUEUED
+            job.available_at = now
+        job.lease_expires_at = None
+        job.updated_at = now
+    if expired:
+        db.commit()
+        for note in failed_notes:
+            events.publish_note_status(note)
+        logger.warning(f"Reaped {len(expired)} expired job leases")
+    return len(expired)
+
+def recover_stale_notes(db: Session) -> int:
+    """
+    Requeues notes left PENDING/GENERATING without an active job,
+    e.g. notes that were started by BackgroundTasks before a restart.
+    """
+    Note = db_models.Note
+    Job = db_models.Job
+    active = db.query(Job.note_id).filter(Job.status.in_(ACTIVE_JOB_STATUSES))
+    cutoff = _now() - datetime.timedelta(seconds=STALE_NOTE_GRACE_SECONDS)
+    stale = db.query(Note).filter(
+        Note.status.in_([NoteStatus.PENDING, NoteStatus.GENERATING]),
+        Note.updated_at < cutoff,
+        ~Note.id.in_(active),
+    ).all()
+    for note in stale:
+        video_url = f"{VIDEO_URL_PREFIX}{note.video_id}"
+        enqueue_job(db, note.id, note.user_id, note.video_id, video_url, commit=False)
+    if stale:
+        db.commit()
+        logger.warning(f"Requeued {len(stale)} stale notes")
+    return len(stale)
@@ -0,0 +1,187 @@
+"""
+Full-text search over generated notes.
+
+A note's markdown is split into heading-delimited sections stored as plain
+text in `note_sections`. The index on top of it depends on the database:
+  - SQLite: an external-content FTS5 table kept in sync by triggers, ranked with bm25()
+  - Postgres: a generated tsvector column with a GIN index, ranked with ts_rank_cd()
+
+Snippets mark matches with <mark>...</mark>; the rest of the snippet is note
+text, so clients must escape it before rendering the markers as HTML.
+"""
+import os
+import re
+import logging
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text, delete, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from backend import db_models
+
+logger = logging.getLogger(__name__)
+
+# Postgres text search configuration (stemming and stop words)
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "english")
+SNIPPET_WORDS = int(os.getenv("SEARCH_SNIPPET_WORDS", "16"))
+
+HEADING_RE = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+MARKUP_RE = re.compile(r"(\*\*|__|\*|`+|~~)")
+LIST_MARKER_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)]|>)\s+", re.MULTILINE)
+QUERY_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# ---------------------------------------------------------------- tokenizing
+
+def markdown_to_text(markdown: str) -> str:
+    """
+    Strips inline markdown syntax, keeping the words (link text, code, emphasis).
+    """
+    plain = LINK_RE.sub(r"\1", markdown)
+    plain = LIST_MARKER_RE.sub("", plain)
+    plain = MARKUP_RE.sub("", plain)
+    return re.sub(r"\n{3,}", "\n\n", plain).strip()
+
+def split_sections(markdown: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Splits markdown into (heading, plain text body) pairs, one per heading.
+    Text before the first heading gets a None heading. Empty sections are dropped.
+    """
+    sections = []
+    heading, lines = None, []
+    for line in markdown.splitlines():
+        match = HEADING_RE.match(line)
+        if match:
+            sections.append((heading, lines))
+            heading, lines = markdown_to_text(match.group(1)), []
+        else:
+            lines.append(line)
+    sections.append((heading, lines))
+    result = []
+    for heading, lines in sections:
+        body = markdown_to_text("\n".join(lines))
+        if body or heading:
+            result.append((heading, body))
+    return result
+
+# ---------------------------------------------------------------- schema
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS note_sections_fts USING fts5(
+        heading, body, content='note_sections', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS note_sections_ai AFTER INSERT ON note_sections BEGIN
+        INSERT INTO note_sections_fts(rowid, heading, body) VALUES (new.id, new.heading, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS note_sections_ad AFTER DELETE ON note_sections BEGIN
+        INSERT INTO note_sections_fts(note_sections_fts, rowid, heading, body) VALUES ('delete', old.id, old.heading, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS note_sections_au AFTER UPDATE ON note_sections BEGIN
+        INSERT INTO note_sections_fts(note_sections_fts, rowid, heading, body) VALUES ('delete', old.id, old.heading, old.body);
+        INSERT INTO note_sections_fts(rowid, heading, body) VALUES (new.id, new.heading, new.body);
+    END""",
+]
+
+def _postgres_ddl() -> List[str]:
+    return [
+        f"""ALTER TABLE note_sections ADD COLUMN IF NOT EXISTS tsv tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('{SEARCH_LANGUAGE}', coalesce(heading, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_LANGUAGE}', body), 'B')
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_note_sections_tsv ON note_sections USING GIN (tsv)",
+    ]
+
+def create_search_index(engine: Engine):
+    """
+    Creates the dialect-specific index over note_sections (idempotent).
+    Run by backend.migrate after the tables exist.
+    """
+    statements = SQLITE_DDL if engine.dialect.name == "sqlite" else _postgres_ddl()
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+
+# ---------------------------------------------------------------- indexing
+
+def index_note(db: Session, note_id: int, user_id: int, markdown: str, content_hash: Optional[str] = None):
+    """
+    Replaces the note's sections in the index with those of markdown.
+    """
+    NoteSection = db_models.NoteSection
+    db.execute(delete(NoteSection).where(NoteSection.note_id == note_id))
+    db.add_all([
+        NoteSection(note_id=note_id, user_id=user_id, section_index=i, heading=heading, body=body)
+        for i, (heading, body) in enumerate(split_sections(markdown))
+    ])
+    db.execute(update(db_models.Note).where(db_models.Note.id == note_id).values(indexed_content_hash=content_hash))
+    db.commit()
+
+def index_stored_note(db: Session, note):
+    """
+    Indexes a READY note from its stored content.
+    """
+    from backend.services.gcs import get_note_content
+    index_note(db, note.id, note.user_id, get_note_content(note.gcs_object_key), note.content_hash)
+
+# ---------------------------------------------------------------- querying
+
+def fts5_query(query: str) -> str:
+    """
+    Turns free text into a safe FTS5 query: every word must match, the last
+    one as a prefix (search-as-you-type). FTS5 operators in the input are
+    treated as plain words.
+    """
+    tokens = QUERY_TOKEN_RE.findall(query)
+    if not tokens:
+        return ""
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+SQLITE_SEARCH = text(f"""
+    SELECT n.video_id, n.video_title, s.heading,
+           snippet(note_sections_fts, -1, '<mark>', '</mark>', '…', {SNIPPET_WORDS}) AS snippet,
+           -bm25(note_sections_fts, 2.0, 1.0) AS score
+    FROM note_sections_fts
+    JOIN note_sections s ON s.id = note_sections_fts.rowid
+    JOIN notes n ON n.id = s.note_id
+    JOIN users u ON u.id = s.user_id
+    WHERE note_sections_fts MATCH :query AND u.google_id = :google_id
+    ORDER BY score DESC
+    LIMIT :limit
+""")
+
+def _postgres_search():
+    # ts_headline is slow, so it only runs on the page of hits
+    return text(f"""
+        SELECT hit.video_id, hit.video_title, hit.heading,
+               ts_headline('{SEARCH_LANGUAGE}', hit.body, hit.query,
+                           'StartSel=<mark>, StopSel=</mark>, MaxWords={SNIPPET_WORDS}, MinWords={max(SNIPPET_WORDS // 2, 1)}, MaxFragments=1') AS snippet,
+               hit.score
+        FROM (
+            SELECT n.video_id, n.video_title, s.heading, s.body, q.query, ts_rank_cd(s.tsv, q.query) AS score
+            FROM note_sections s
+            JOIN notes n ON n.id = s.note_id
+            JOIN users u ON u.id = s.user_id
+            CROSS JOIN websearch_to_tsquery('{SEARCH_LANGUAGE}', :query) AS q(query)
+            WHERE u.google_id = :google_id AND s.tsv @@ q.query
+            ORDER BY score DESC
+            LIMIT :limit
+        ) hit
+        ORDER BY hit.score DESC
+    """)
+
+async def search_notes(db, google_id: str, query: str, limit: int = 20) -> List[dict]:
+    """
+    Best-matching note sections of the user, highest score first.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        query = fts5_query(query)
+        statement = SQLITE_SEARCH
+    else:
+        statement = _postgres_search()
+    if not query.strip():
+        return []
+    result = await db.execute(statement, {"query": query, "google_id": google_id, "limit": limit})
+    return [dict(row) for row in result.mappings()]
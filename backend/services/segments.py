@@ -0,0 +1,135 @@
+"""
+Segmented generation for long videos.
+
+The video is split into time windows that are generated concurrently,
+each cached on its own so a retry only regenerates the windows that failed.
+The results are then stitched back together in order.
+"""
+import os
+import re
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from backend.services import events
+from backend.services.gemini import generate_notes, Segment
+from backend.services.gcs import upload_segment, get_segment
+
+logger = logging.getLogger(__name__)
+
+# Videos longer than this are generated in segments
+SEGMENT_THRESHOLD_SECONDS = int(os.getenv("SEGMENT_THRESHOLD_SECONDS", "3600"))
+SEGMENT_LENGTH_SECONDS = int(os.getenv("SEGMENT_LENGTH_SECONDS", "1200"))
+SEGMENT_FANOUT = int(os.getenv("SEGMENT_FANOUT", "4"))
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+
+def should_segment(duration_seconds) -> bool:
+    return bool(duration_seconds) and duration_seconds > SEGMENT_THRESHOLD_SECONDS
+
+def plan_segments(duration_seconds: int, segment_length: int = SEGMENT_LENGTH_SECONDS) -> List[Segment]:
+    """
+    Splits the video into equal windows of at most segment_length seconds.
+    """
+    count = max(1, -(-duration_seconds // segment_length))
+    size = -(-duration_seconds // count)
+    return [
+        Segment(
+            index=i,
+            total=count,
+            start_seconds=i * size,
+            end_seconds=min((i + 1) * size, duration_seconds),
+        )
+        for i in range(count)
+    ]
+
+def _normalize_heading(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+def _merge_part(text: str, open_headings: Dict[int, str]) -> str:
+    """
+    One segment's share of the merged notes. open_headings (level ->
+    normalized heading in effect at the end so far) is updated in place.
+    """
+    lines = []
+    leading = True
+    for line in text.strip().splitlines():
+        match = HEADING_RE.match(line)
+        if not match:
+            if line.strip():
+                leading = False
+            lines.append(line)
+            continue
+        level, key = len(match.group(1)), _normalize_heading(match.group(2))
+        if leading and open_headings.get(level) == key:
+            continue
+        leading = False
+        for lvl in [lvl for lvl in open_headings if lvl >= level]:
+            del open_headings[lvl]
+        open_headings[level] = key
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def merge_segments(texts: List[str]) -> str:
+    """
+    Joins segment notes in order. A segment usually opens by repeating the
+    headings it continues (the lecture title, the section the window starts
+    in); those leading headings are dropped when they match a heading still
+    open at the end of the previous segment, so the content continues that
+    section. Headings anywhere else are kept, repeats included.
+    """
+    open_headings: Dict[int, str] = {}
+    merged = [_merge_part(text, open_headings) for text in texts]
+    return "\n\n".join(part for part in merged if part) + "\n"
+
+def _generate_segment(cache_key: str, video_url: str, segment: Segment) -> str:
+    cached = get_segment(cache_key, segment.start_seconds, segment.end_seconds)
+    if cached is not None:
+        return cached
+    content = generate_notes(video_url, segment=segment)
+    upload_segment(cache_key, segment.start_seconds, segment.end_seconds, content)
+    return content
+
+def generate_segmented(cache_key: str, video_id: str, video_url: str, duration_seconds: int) -> str:
+    """
+    Generates all segments with up to SEGMENT_FANOUT in flight and returns the merged notes.
+    Completed segments are merged and streamed to SSE subscribers in order
+    as soon as every segment before them is done, so the deltas add up to
+    exactly the returned notes.
+    Raises if any segment failed, after the others have finished and been cached.
+    """
+    segments = plan_segments(duration_seconds)
+    logger.info(f"Generating video {video_id} in {len(segments)} segments")
+
+    results: Dict[int, str] = {}
+    errors = []
+    next_to_publish = 0
+    open_headings: Dict[int, str] = {}
+    published_any = False
+    with ThreadPoolExecutor(max_workers=SEGMENT_FANOUT, thread_name_prefix="segment") as pool:
+        # copy_context carries the job deadline into the pool threads
+        futures = {
+            pool.submit(contextvars.copy_context().run, _generate_segment, cache_key, video_url, seg): seg
+            for seg in segments
+        }
+        for future in as_completed(futures):
+            segment = futures[future]
+            try:
+                results[segment.index] = future.result()
+            except Exception as e:
+                logger.error(f"Segment {segment.index + 1}/{segment.total} of video {video_id} failed: {e}")
+                errors.append(e)
+                continue
+            while not errors and next_to_publish in results:
+                part = _merge_part(results[next_to_publish], open_headings)
+                if part:
+                    events.publish_delta(video_id, ("\n\n" if published_any else "") + part)
+                    published_any = True
+                next_to_publish += 1
+
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(segments)} segments failed: {errors[0]}")
+
+    events.publish_delta(video_id, "\n")
+    return merge_segments([results[seg.index] for seg in segments])
@@ -0,0 +1,123 @@
+"""
+Caption/transcript lookup for the text-first generation path.
+
+Generating from a transcript is much cheaper and faster than sending the
+video, so it is tried first; the pipeline falls back to video input when no
+transcript exists or it fails the quality check.
+
+TRANSCRIPT_PROVIDER selects the source:
+  - "youtube": captions via the optional youtube-transcript-api package
+  - "fixture": <TRANSCRIPT_FIXTURE_DIR>/<video_id>.txt, for local testing
+  - "none": always use video input
+"""
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_PROVIDER = os.getenv("TRANSCRIPT_PROVIDER", "youtube")
+TRANSCRIPT_FIXTURE_DIR = os.getenv("TRANSCRIPT_FIXTURE_DIR", "transcripts")
+TRANSCRIPT_LANGUAGES = [lang.strip() for lang in os.getenv("TRANSCRIPT_LANGUAGES", "en").split(",") if lang.strip()]
+TRANSCRIPT_MIN_WORDS = int(os.getenv("TRANSCRIPT_MIN_WORDS", "200"))
+# Spoken lectures run ~100-160 wpm; far below that usually means sparse or partial captions
+TRANSCRIPT_MIN_WORDS_PER_MINUTE = float(os.getenv("TRANSCRIPT_MIN_WORDS_PER_MINUTE", "40"))
+TRANSCRIPT_MAX_NOISE_RATIO = float(os.getenv("TRANSCRIPT_MAX_NOISE_RATIO", "0.2"))
+
+NOISE_RE = re.compile(r"\[[^\]]*\]")
+
+@dataclass
+class Transcript:
+    video_id: str
+    text: str
+    source: str
+
+class TranscriptProvider:
+    name = "none"
+
+    def fetch(self, video_id: str) -> Optional[Transcript]:
+        return None
+
+class YouTubeTranscriptProvider(TranscriptProvider):
+    name = "youtube"
+
+    def __init__(self, languages=None):
+        self.languages = languages or TRANSCRIPT_LANGUAGES
+        try:
+            from youtube_transcript_api import YouTubeTranscriptApi
+            self._api = YouTubeTranscriptApi
+        except ImportError:
+            logger.warning("youtube-transcript-api not installed, transcript fast path disabled")
+            self._api = None
+
+    def fetch(self, video_id: str) -> Optional[Transcript]:
+        if self._api is None:
+            return None
+        try:
+            if hasattr(self._api, "get_transcript"):
+                snippets = [s["text"] for s in self._api.get_transcript(video_id, languages=self.languages)]
+            else:
+                snippets = [s.text for s in self._api().fetch(video_id, languages=self.languages)]
+        except Exception as e:
+            # No captions, captions disabled, or blocked; all mean "use the video"
+            logger.info(f"No transcript for video {video_id}: {type(e).__name__}")
+            return None
+        return Transcript(video_id=video_id, text="\n".join(snippets), source=self.name)
+
+class FixtureTranscriptProvider(TranscriptProvider):
+    name = "fixture"
+
+    def __init__(self, directory: str = TRANSCRIPT_FIXTURE_DIR):
+        self.directory = directory
+
+    def fetch(self, video_id: str) -> Optional[Transcript]:
+        path = os.path.join(self.directory, f"{os.path.basename(video_id)}.txt")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return Transcript(video_id=video_id, text=f.read(), source=self.name)
+
+PROVIDERS = {
+    "youtube": YouTubeTranscriptProvider,
+    "fixture": FixtureTranscriptProvider,
+    "none": TranscriptProvider,
+}
+
+_provider = None
+
+def get_provider() -> TranscriptProvider:
+    global _provider
+    if _provider is None:
+        _provider = PROVIDERS[TRANSCRIPT_PROVIDER]()
+    return _provider
+
+def set_provider(provider: TranscriptProvider):
+    global _provider
+    _provider = provider
+
+def is_usable(transcript: Transcript, duration_seconds: Optional[int] = None) -> bool:
+    """
+    Heuristic check that the transcript covers the lecture well enough to
+    generate notes from it instead of the video.
+    """
+    words = transcript.text.split()
+    if len(words) < TRANSCRIPT_MIN_WORDS:
+        return False
+    noise = sum(len(m.split()) for m in NOISE_RE.findall(transcript.text))
+    if noise / len(words) > TRANSCRIPT_MAX_NOISE_RATIO:
+        return False
+    if duration_seconds:
+        if len(words) / (duration_seconds / 60) < TRANSCRIPT_MIN_WORDS_PER_MINUTE:
+            return False
+    return True
+
+def get_usable_transcript(video_id: str, duration_seconds: Optional[int] = None) -> Optional[Transcript]:
+    transcript = get_provider().fetch(video_id)
+    if transcript is None:
+        return None
+    if not is_usable(transcript, duration_seconds):
+        logger.info(f"Transcript for video {video_id} failed quality check, using video input")
+        return None
+    return transcript
@@ -0,0 +1,349 @@
+"""
+Gemini token usage accounting and daily quotas.
+
+Every Gemini response's usage_metadata is recorded here (record()). A
+generation collects the usage of all its calls (collect()), stores it on the
+note version, and adds it to this process's in-memory aggregate. A
+background thread writes the aggregate every USAGE_FLUSH_SECONDS as batched
+upserts into usage_daily (one row per user per UTC day), adding to what
+other processes wrote, so there is no commit per generation.
+
+The same thread then reloads today's fleet-wide totals and the per-user
+quota overrides, so quota checks (check_quota, part of admission control)
+read memory only. They trail the fleet by up to about two flush intervals,
+which is fine for a daily budget.
+"""
+import os
+import logging
+import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend import db_models
+from backend.database import SessionLocal
+from backend.services import db as db_sync
+from backend.services import metrics
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "10"))
+# Tokens (input + output + thinking) per user per UTC day; 0 = unlimited. user_quotas rows override it
+USAGE_DAILY_TOKEN_QUOTA = int(os.getenv("USAGE_DAILY_TOKEN_QUOTA", "0"))
+# USD per million tokens, for cost estimates in reports; thinking tokens are billed as output
+GEMINI_INPUT_USD_PER_MTOK = float(os.getenv("GEMINI_INPUT_USD_PER_MTOK", "0.50"))
+GEMINI_OUTPUT_USD_PER_MTOK = float(os.getenv("GEMINI_OUTPUT_USD_PER_MTOK", "3.00"))
+# Rows per upsert statement (keeps SQLite under its bound-parameter limit)
+FLUSH_BATCH_ROWS = 500
+
+@dataclass
+class Usage:
+    generations: int = 0
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    thinking_tokens: int = 0
+    gemini_ms: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens + self.thinking_tokens
+
+    def add(self, other: "Usage"):
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    def version_columns(self) -> dict:
+        """
+        The NoteVersion columns for one generation's usage.
+        """
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "thinking_tokens": self.thinking_tokens,
+            "gemini_ms": self.gemini_ms,
+        }
+
+def estimate_cost_usd(input_tokens: int, output_tokens: int, thinking_tokens: int) -> float:
+    return round((input_tokens * GEMINI_INPUT_USD_PER_MTOK + (output_tokens + thinking_tokens) * GEMINI_OUTPUT_USD_PER_MTOK) / 1e6, 6)
+
+COUNTER_COLUMNS = [field.name for field in fields(Usage) if field.name != "calls"]
+
+def from_metadata(usage_metadata, wall_seconds: float) -> Usage:
+    return Usage(
+        calls=1,
+        input_tokens=getattr(usage_metadata, "prompt_token_count", None) or 0,
+        output_tokens=getattr(usage_metadata, "candidates_token_count", None) or 0,
+        thinking_tokens=getattr(usage_metadata, "thoughts_token_count", None) or 0,
+        gemini_ms=int(wall_seconds * 1000),
+    )
+
+# ---------------------------------------------------------------- per generation
+
+# Usage of the generation running in this context; segment threads share it through copy_context
+_collected: contextvars.ContextVar[Optional[Usage]] = contextvars.ContextVar("gemini_usage", default=None)
+_collect_lock = threading.Lock()
+
+@contextmanager
+def collect():
+    """
+    Collects the usage of the Gemini calls made inside the block into the yielded Usage.
+    """
+    usage = Usage()
+    token = _collected.set(usage)
+    try:
+        yield usage
+    finally:
+        _collected.reset(token)
+
+def record(usage_metadata, wall_seconds: float):
+    """
+    Counts one Gemini response (usage_metadata may be None if the call broke off).
+    """
+    usage = from_metadata(usage_metadata, wall_seconds)
+    metrics.gemini_tokens.inc(usage.input_tokens, kind="input")
+    metrics.gemini_tokens.inc(usage.output_tokens, kind="output")
+    metrics.gemini_tokens.inc(usage.thinking_tokens, kind="thinking")
+    collected = _collected.get()
+    if collected is not None:
+        with _collect_lock:
+            collected.add(usage)
+
+# ---------------------------------------------------------------- aggregate
+
+def _today() -> datetime.date:
+    return datetime.datetime.utcnow().date()
+
+def flush_statement(db, rows: List[Tuple[int, datetime.date, Usage]]):
+    """
+    Multi-row INSERT ... ON CONFLICT (user_id, day) DO UPDATE adding the counts.
+    """
+    Daily = db_models.UsageDaily
+    now = datetime.datetime.utcnow()
+    stmt = db_sync._insert(db, Daily).values([
+        dict(user_id=user_id, day=day, updated_at=now, **{name: getattr(usage, name) for name in COUNTER_COLUMNS})
+        for user_id, day, usage in rows
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[Daily.user_id, Daily.day],
+        set_={
+            **{name: getattr(Daily, name) + getattr(stmt.excluded, name) for name in COUNTER_COLUMNS},
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+class UsageAggregator:
+    """
+    Usage not yet written, per (user, day), plus a copy of today's totals
+    and quota overrides for quota checks.
+    """
+
+    def __init__(self, flush_seconds: float = USAGE_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[Tuple[int, datetime.date], Usage] = {}
+        self._used: Dict[int, int] = {}  # user_id -> tokens today
+        self._used_day: Optional[datetime.date] = None
+        self._quotas: Dict[int, int] = {}  # user_id -> daily limit overrides (0: unlimited)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, user_id: int, usage: Usage):
+        """
+        Adds one generation's usage.
+        """
+        day = _today()
+        with self._lock:
+            pending = self._pending.setdefault((user_id, day), Usage())
+            pending.add(usage)
+            pending.generations += 1
+            if day == self._used_day:
+                self._used[user_id] = self._used.get(user_id, 0) + usage.total_tokens
+
+    def flush(self) -> int:
+        """
+        Writes the pending usage in batched upserts and one commit.
+        Returns the rows written; on failure the usage is kept for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [(user_id, day, usage) for (user_id, day), usage in pending.items()]
+        db = SessionLocal()
+        try:
+            for i in range(0, len(rows), FLUSH_BATCH_ROWS):
+                db.execute(flush_statement(db, rows[i:i + FLUSH_BATCH_ROWS]))
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for key, usage in pending.items():
+                    self._pending.setdefault(key, Usage()).add(usage)
+            raise
+        finally:
+            db.close()
+        return len(rows)
+
+    def refresh(self):
+        """
+        Reloads today's totals (every process's flushed usage plus this
+        process's pending usage) and the quota overrides.
+        """
+        Daily = db_models.UsageDaily
+        Quota = db_models.UserQuota
+        today = _today()
+        db = SessionLocal()
+        try:
+            totals = db.execute(
+                select(Daily.user_id, Daily.input_tokens + Daily.output_tokens + Daily.thinking_tokens).where(Daily.day == today)
+            ).all()
+            # A null limit means the default, same as having no row
+            quotas = db.execute(
+                select(Quota.user_id, Quota.daily_token_limit).where(Quota.daily_token_limit.isnot(None))
+            ).all()
+        finally:
+            db.close()
+        with self._lock:
+            used = dict(totals)
+            for (user_id, day), usage in self._pending.items():
+                if day == today:
+                    used[user_id] = used.get(user_id, 0) + usage.total_tokens
+            self._used, self._used_day, self._quotas = used, today, dict(quotas)
+
+    def quota_remaining(self, user_id: int) -> Optional[int]:
+        """
+        Tokens the user has left today (may be negative), or None without a quota.
+        """
+        with self._lock:
+            limit = self._quotas.get(user_id)
+            if limit is None:
+                limit = USAGE_DAILY_TOKEN_QUOTA
+            if not limit:
+                return None
+            used = self._used.get(user_id, 0) if self._used_day == _today() else 0
+        return limit - used
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the thread and writes what is still pending.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(self.flush_seconds + 5)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Final usage flush failed: {e}")
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Usage refresh failed: {e}")
+            if self._stop.wait(self.flush_seconds):
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Usage flush failed, retrying next interval: {e}")
+
+_aggregator: Optional[UsageAggregator] = None
+_aggregator_lock = threading.Lock()
+
+def get_aggregator() -> UsageAggregator:
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = UsageAggregator()
+    return _aggregator
+
+def check_quota(user_id: Optional[int]) -> Optional[float]:
+    """
+    None if the user may generate, otherwise seconds until their quota
+    resets (UTC midnight). Memory only; users whose internal id isn't known
+    yet are let through.
+    """
+    if user_id is None:
+        return None
+    remaining = get_aggregator().quota_remaining(user_id)
+    if remaining is None or remaining > 0:
+        return None
+    now = datetime.datetime.utcnow()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return (midnight - now).total_seconds()
+
+# ---------------------------------------------------------------- reports and quotas
+
+def _user_id_query(google_id: str):
+    return select(db_models.User.id).where(db_models.User.google_id == google_id)
+
+async def get_user_usage(db: AsyncSession, google_id: str, days: int):
+    """
+    The user's rollups for the last `days` UTC days (newest first) and their quota override.
+    """
+    Daily = db_models.UsageDaily
+    since = _today() - datetime.timedelta(days=days - 1)
+    rows = (await db.scalars(
+        select(Daily).where(Daily.user_id == _user_id_query(google_id).scalar_subquery(), Daily.day >= since).order_by(Daily.day.desc())
+    )).all()
+    limit = await db.scalar(
+        select(db_models.UserQuota.daily_token_limit).where(db_models.UserQuota.user_id == _user_id_query(google_id).scalar_subquery())
+    )
+    return rows, limit
+
+async def get_top_users(db: AsyncSession, since: datetime.date, limit: int):
+    """
+    Users by tokens used since the given day: (google_id, email, generations, input, output, thinking, gemini_ms).
+    """
+    Daily = db_models.UsageDaily
+    User = db_models.User
+    tokens = func.sum(Daily.input_tokens + Daily.output_tokens + Daily.thinking_tokens)
+    return (await db.execute(
+        select(
+            User.google_id,
+            User.email,
+            func.sum(Daily.generations),
+            func.sum(Daily.input_tokens),
+            func.sum(Daily.output_tokens),
+            func.sum(Daily.thinking_tokens),
+            func.sum(Daily.gemini_ms),
+        )
+        .join(User, Daily.user_id == User.id)
+        .where(Daily.day >= since)
+        .group_by(User.google_id, User.email)
+        .order_by(tokens.desc())
+        .limit(limit)
+    )).all()
+
+async def set_quota(db: AsyncSession, google_id: str, daily_token_limit: Optional[int]) -> bool:
+    """
+    Sets the user's daily token limit (None: back to USAGE_DAILY_TOKEN_QUOTA).
+    Returns False if there is no such user. Processes pick it up on their next refresh.
+    """
+    user_id = await db.scalar(_user_id_query(google_id))
+    if user_id is None:
+        return False
+    Quota = db_models.UserQuota
+    stmt = db_sync._insert(db, Quota).values(user_id=user_id, daily_token_limit=daily_token_limit, updated_at=datetime.datetime.utcnow())
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[Quota.user_id],
+        set_={"daily_token_limit": stmt.excluded.daily_token_limit, "updated_at": stmt.excluded.updated_at},
+    ))
+    await db.commit()
+    return True
@@ -0,0 +1,163 @@
+"""
+The per-user event stream behind GET /events: one SSE connection carries
+status updates for all of the user's notes, instead of one connection per
+video being generated.
+
+Every status event has an SSE `id:`. A client reconnecting with
+Last-Event-ID gets the events it missed from the broker's replay buffer;
+if they can't be replayed (another process, a restart, or too long ago) it
+gets a snapshot of its most recently updated notes instead, as on a fresh
+connection. Heartbeat comments keep idle streams alive through proxies.
+"""
+import os
+import json
+import logging
+from collections import Counter
+from typing import Optional
+
+from starlette.responses import StreamingResponse
+
+from backend.database import AsyncSessionLocal
+from backend.services import events
+from backend.services import db_async
+from backend.services import metrics
+
+logger = logging.getLogger(__name__)
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Open /events streams allowed per user and in total, per API process
+SSE_MAX_CONNECTIONS_PER_USER = int(os.getenv("SSE_MAX_CONNECTIONS_PER_USER", "4"))
+SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", "5000"))
+# Notes sent in the snapshot of a fresh or unresumable connection
+SNAPSHOT_NOTES = int(os.getenv("SSE_SNAPSHOT_NOTES", "50"))
+# Reconnect delay suggested to EventSource clients
+RECONNECT_MILLISECONDS = 3000
+# Status messages are small and rare; a backlog this long means the client is stuck
+STREAM_QUEUE_SIZE = 32
+
+# google_id -> open streams in this process
+_connections = Counter()
+
+def open_connection(google_id: str) -> Optional[str]:
+    """
+    Reserves a stream slot for the user. Returns why it was refused
+    ("user" or "global"), or None if the slot was taken.
+    Only called from the event loop, so no locking is needed.
+    """
+    if sum(_connections.values()) >= SSE_MAX_CONNECTIONS:
+        return "global"
+    if _connections[google_id] >= SSE_MAX_CONNECTIONS_PER_USER:
+        return "user"
+    _connections[google_id] += 1
+    return None
+
+def close_connection(google_id: str):
+    _connections[google_id] -= 1
+    if _connections[google_id] <= 0:
+        del _connections[google_id]
+
+class ConnectionSlot:
+    """
+    A slot taken with open_connection(). release() may be called more than
+    once: both the stream and its response release it, whichever ends first.
+    """
+
+    def __init__(self, google_id: str):
+        self.google_id = google_id
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            close_connection(self.google_id)
+
+class EventStreamResponse(StreamingResponse):
+    """
+    StreamingResponse that releases the stream's slot however the response
+    ends, including when the body never starts (client gone before the
+    first send, or sending fails): the generator's own finally doesn't run then.
+    """
+
+    def __init__(self, content, slot: ConnectionSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+def connection_count() -> int:
+    return sum(_connections.values())
+
+def format_event(data: dict, event_id: str = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def status_event(message: dict) -> dict:
+    return {
+        "type": "status",
+        "noteId": message["noteId"],
+        "videoId": message["videoId"],
+        "status": message["status"],
+    }
+
+async def stream(request, slot: ConnectionSlot, last_event_id: str = None):
+    """
+    Generates the user's SSE stream in the slot reserved by the caller,
+    which is released when the stream ends.
+    """
+    google_id = slot.google_id
+    try:
+        broker = events.get_broker()
+        replay = broker.replay
+        async with AsyncSessionLocal() as db:
+            db_user = await db_async.get_user_by_google_id(db, google_id)
+            if not db_user:
+                yield format_event({"type": "error", "detail": "Unknown user"})
+                return
+            topic = events.user_topic(db_user.id)
+            # Subscribe before reading anything so no update can slip in between
+            subscription = broker.subscribe(topic, queue_size=STREAM_QUEUE_SIZE)
+            try:
+                resume_seq = replay.parse_event_id(last_event_id)
+                missed = replay.since(topic, resume_seq) if resume_seq is not None else None
+                if missed is None:
+                    # Everything up to here is reflected in the snapshot read below
+                    last_seq = replay.last_seq()
+                    notes, _ = await db_async.list_notes(db, google_id, SNAPSHOT_NOTES)
+            except Exception:
+                subscription.close()
+                raise
+
+        with subscription, metrics.sse_streams_open.track(stream="user"):
+            yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+            if missed is None:
+                yield format_event({
+                    "type": "snapshot",
+                    "notes": [
+                        {"noteId": note.id, "videoId": note.video_id, "status": note.status}
+                        for note in notes
+                    ],
+                }, replay.event_id(last_seq))
+            else:
+                last_seq = resume_seq
+                for message in missed:
+                    last_seq = message["seq"]
+                    yield format_event(status_event(message), replay.event_id(last_seq))
+
+            while True:
+                if await request.is_disconnected():
+                    break
+                message = await subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                # Already sent through the replay or covered by the snapshot
+                if message.get("type") != "status" or message["seq"] <= last_seq:
+                    continue
+                last_seq = message["seq"]
+                yield format_event(status_event(message), replay.event_id(last_seq))
+    finally:
+        slot.release()
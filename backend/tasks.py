@@ -0,0 +1,92 @@
+import os
+import time
+import logging
+from sqlalchemy.orm import Session
+
+from backend.db_models import NoteStatus
+from backend.services import db as db_service
+from backend.services import cache as generation_cache
+from backend.services import search
+from backend.services import metrics
+from backend.services import usage
+from backend.services.gemini_executor import deadline_scope
+from backend.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Time budget for one generation attempt, across all Gemini calls it makes
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "1800"))
+
+def background_generate_note(db: Session, note_id: int, user_id: str, video_id: str, video_url: str):
+    """
+    Generates the note (or reuses a generation shared with other users)
+    and marks it READY. The Gemini usage is charged to the user, also
+    when the generation fails.
+    Raises on failure so the job queue can decide whether to retry.
+    """
+    with metrics.generations_in_flight.track(), metrics.collect_stage_timings() as timings, usage.collect() as gen_usage:
+        try:
+            path = _generate_note(db, note_id, user_id, video_id, video_url, timings, gen_usage)
+        except Exception:
+            metrics.generations.inc(path="unknown", outcome="failed")
+            raise
+        finally:
+            if gen_usage.calls:
+                usage.get_aggregator().add(int(user_id), gen_usage)
+        if path:
+            metrics.generations.inc(path=path, outcome="ready")
+
+def _generate_note(db: Session, note_id: int, user_id: str, video_id: str, video_url: str, timings: dict, gen_usage: usage.Usage):
+    """
+    Returns the GenerationPath used, or None if the job had nothing to do.
+    """
+    # Update status to generating
+    with metrics.stage("db_status"):
+        note = db_service.update_note_status(db, note_id, NoteStatus.GENERATING)
+    if note is None:
+        # Deleted, or already READY (a duplicate job): nothing to do
+        logger.info(f"Skipping generation for note {note_id}: missing or already ready")
+        return None
+    duration_seconds = note.duration_seconds
+
+    # 1. Generate Content
+    started = time.monotonic()
+    with deadline_scope(JOB_DEADLINE_SECONDS):
+        result = generation_cache.get_or_generate(db, video_id, video_url, duration_seconds)
+    elapsed_ms = int((time.monotonic() - started) * 1000)
+
+    # 2. Save it as the note's new version and mark it READY, with the timings of every stage so far
+    with metrics.stage("db_status"):
+        note = db_service.save_note_version(
+            db, note_id, result.gcs_key, result.content_hash,
+            content_size=result.content_size,
+            content_encoding=result.content_encoding,
+            generation_path=result.path,
+            generation_ms=elapsed_ms,
+            version_fields=gen_usage.version_columns(),
+            stage_timings=dict(timings, generation_ms=elapsed_ms),
+        )
+
+    # 3. Index for search. Best effort: the note is already READY, and
+    # `python -m backend.reindex` picks up anything that failed here
+    if note is not None:
+        try:
+            with metrics.stage("index"):
+                search.index_stored_note(db, note)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to index note {note_id} for search: {e}")
+
+    logger.info(
+        f"Note generated successfully for user {user_id} video {video_id} via {result.path} in {elapsed_ms}ms "
+        f"({gen_usage.total_tokens} tokens)"
+    )
+    return result.path
+
+# Wrapper for background task to manage session
+def run_background_generate_task(note_id: int, user_id: str, video_id: str, video_url: str):
+    db = SessionLocal()
+    try:
+        background_generate_note(db, note_id, user_id, video_id, video_url)
+    finally:
+        db.close()
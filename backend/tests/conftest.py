@@ -0,0 +1,71 @@
+"""
+Tests run against a throwaway SQLite database and the local note store,
+with the fake Gemini backend, so they need no cloud credentials:
+
+    python -m pytest -q backend/tests
+
+The environment is set here, before any backend module reads it at import.
+"""
+import os
+import asyncio
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="note-maker-tests-")
+os.environ.update({
+    "ENVIRONMENT": "development",
+    "DATABASE_URL_LOCAL": f"sqlite:///{_tmp}/test.db",
+    "SECRET_KEY": "test-secret",
+    "GEMINI_BACKEND": "fake",
+    "GEMINI_FAKE_LATENCY_SECONDS": "0",
+    "NOTE_STORE": "local",
+    "NOTE_STORE_DIR": f"{_tmp}/store",
+    "TRANSCRIPT_PROVIDER": "none",
+    "WORKER_MODE": "external",
+    "WARMUP_ON_STARTUP": "false",
+    "EVENT_BROKER": "memory",
+    "YOUTUBE_OEMBED_URL": "http://127.0.0.1:9/oembed",
+})
+
+import pytest
+
+from backend import database
+from backend.database import Base, SessionLocal
+from backend.migrate import migrate
+from backend.services import db as db_service
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    migrate()
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    yield
+    with database.engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def make_user(db):
+    def make(google_id: str = "google-1", email: str = None):
+        return db_service.get_or_create_user(db, google_id, email or f"{google_id}@example.com")
+    return make
+
+def run_async(coro):
+    """
+    Runs a coroutine on a fresh loop; the async engine's connections belong
+    to that loop, so they are disposed before it closes.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await database.async_engine.dispose()
+    return asyncio.run(main())
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from backend.database import AsyncSessionLocal
+from backend.services import admission
+from backend.services import queue as job_queue
+from backend.services import db as db_service
+from backend.tests.conftest import run_async
+
+async def acquire_many(limiter, key, count):
+    return [await limiter.acquire(key) for _ in range(count)]
+
+async def admit_as(google_id, count):
+    async with AsyncSessionLocal() as session:
+        await admission.admit(session, {"sub": google_id}, count)
+
+async def admit_one(google_id, uid=None):
+    async with AsyncSessionLocal() as session:
+        await admission.admit_generation({"sub": google_id, "uid": uid}, session)
+
+def test_memory_bucket_allows_a_burst_then_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    limiter = admission.InMemoryRateLimiter(rate_per_second=0.5, burst=3)
+
+    assert run_async(acquire_many(limiter, "user", 3)) == [0.0, 0.0, 0.0]
+    # Empty: the next token is 1 / rate seconds away
+    assert run_async(limiter.acquire("user")) == 2.0
+    # Other users have their own bucket
+    assert run_async(limiter.acquire("other")) == 0.0
+
+    now[0] += 2.0
+    assert run_async(limiter.acquire("user")) == 0.0
+    assert run_async(limiter.acquire("user")) > 0
+
+def test_memory_bucket_never_exceeds_its_burst(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    limiter = admission.InMemoryRateLimiter(rate_per_second=1, burst=2)
+    run_async(limiter.acquire("user"))
+
+    now[0] += 3600
+    waits = run_async(acquire_many(limiter, "user", 3))
+
+    assert waits[:2] == [0.0, 0.0] and waits[2] > 0
+
+def test_database_bucket_grants_and_refuses_in_one_statement(db):
+    limiter = admission.DatabaseRateLimiter(rate_per_second=1, burst=2)
+    now = time.time()
+
+    def acquire(at):
+        tokens, granted = db.execute(limiter.acquire_statement(db, "user", 1.0, at)).one()
+        db.commit()
+        return granted
+
+    assert [acquire(now), acquire(now), acquire(now)] == [True, True, False]
+    assert acquire(now + 1) is True
+
+def test_batch_must_fit_under_the_users_active_jobs(db, make_user, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE_DEPTH", 0)
+    monkeypatch.setattr(admission, "MAX_ACTIVE_JOBS_PER_USER", 3)
+    user = make_user("batcher")
+    for i in range(2):
+        note = db_service.create_note(db, user.id, f"video{i:06d}")
+        job_queue.enqueue_job(db, note.id, user.id, note.video_id, "url")
+
+    run_async(admit_as("batcher", 1))
+    with pytest.raises(HTTPException) as refused:
+        run_async(admit_as("batcher", 2))
+    assert refused.value.status_code == 429
+    # Someone else's jobs don't count against this user
+    make_user("other")
+    run_async(admit_as("other", 3))
+
+def test_single_generation_counts_against_queue_and_user_limits(db, make_user, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE_DEPTH", 100)
+    monkeypatch.setattr(admission, "MAX_ACTIVE_JOBS_PER_USER", 2)
+    monkeypatch.setattr(admission, "_queue_depth", (0, float("-inf")))
+    monkeypatch.setattr(admission, "_limiter", admission.InMemoryRateLimiter(rate_per_second=1, burst=100))
+    user = make_user("single")
+    for i in range(2):
+        note = db_service.create_note(db, user.id, f"video{i:06d}")
+        job_queue.enqueue_job(db, note.id, user.id, note.video_id, "url")
+
+    with pytest.raises(HTTPException) as refused:
+        run_async(admit_one("single", user.id))
+    assert refused.value.status_code == 429
+
+    make_user("other")
+    run_async(admit_one("other"))
+    # Admitted work is counted before the next re-read of the jobs table
+    assert admission._queue_depth[0] == 3
+
+def test_batch_refused_for_capacity_keeps_the_rate_token(make_user, monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE_DEPTH", 0)
+    monkeypatch.setattr(admission, "MAX_ACTIVE_JOBS_PER_USER", 3)
+    monkeypatch.setattr(admission, "_limiter", admission.InMemoryRateLimiter(rate_per_second=0.001, burst=1))
+    make_user("bursty")
+
+    with pytest.raises(HTTPException) as refused:
+        run_async(admit_as("bursty", 4))
+    assert refused.value.status_code == 429 and "queued at once" in refused.value.detail
+    # The user's only token is still there for a batch that fits
+    run_async(admit_as("bursty", 3))
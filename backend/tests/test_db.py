@@ -0,0 +1,33 @@
+import pytest
+
+from backend.db_models import NoteStatus
+from backend.services import db as db_service
+
+@pytest.fixture
+def note(db, make_user):
+    return db_service.create_note(db, make_user().id, "abcdefghijk")
+
+def set_status(db, note, status):
+    return db_service.update_note_status(db, note.id, status)
+
+def test_note_moves_through_a_generation(db, note):
+    assert note.status == NoteStatus.PENDING
+    assert set_status(db, note, NoteStatus.GENERATING).status == NoteStatus.GENERATING
+    assert set_status(db, note, NoteStatus.READY).status == NoteStatus.READY
+
+@pytest.mark.parametrize("status", [NoteStatus.GENERATING, NoteStatus.FAILED])
+def test_stale_job_cannot_pull_a_ready_note_back(db, note, status):
+    set_status(db, note, NoteStatus.READY)
+
+    assert set_status(db, note, status) is None
+    assert db_service.get_note(db, note.user_id, note.video_id).status == NoteStatus.READY
+
+def test_regenerate_resets_a_ready_note(db, note):
+    set_status(db, note, NoteStatus.READY)
+
+    assert set_status(db, note, NoteStatus.PENDING).status == NoteStatus.PENDING
+
+def test_failed_note_can_be_retried(db, note):
+    set_status(db, note, NoteStatus.FAILED)
+
+    assert set_status(db, note, NoteStatus.GENERATING).status == NoteStatus.GENERATING
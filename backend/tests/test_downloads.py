@@ -0,0 +1,77 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.auth import create_jwt_token
+from backend.main import app
+from backend.services import db as db_service
+from backend.services import downloads
+from backend.services.gcs import upload_content_blob
+
+CONTENT = "# Lecture\n\nSome notes about the lecture.\n"
+VIDEO_ID = "abcdefghijk"
+
+@pytest.fixture
+def client(db, make_user):
+    user = make_user("reader")
+    note = db_service.create_note(db, user.id, VIDEO_ID, "Lecture")
+    blob = upload_content_blob(CONTENT)
+    db_service.save_note_version(
+        db, note.id, blob.key, blob.content_hash,
+        content_size=blob.size, content_encoding=blob.encoding,
+    )
+    downloads.hot_notes.invalidate(blob.key)
+    with TestClient(app) as client:
+        client.cookies.set("fastapi_token", create_jwt_token({"sub": "reader", "email": "reader@example.com"}))
+        client.headers["Accept-Encoding"] = "identity"
+        yield client
+
+def download(client, **headers):
+    return client.get(f"/notes/{VIDEO_ID}/download", headers=headers)
+
+def test_full_download_carries_a_strong_etag(client):
+    response = download(client)
+
+    assert response.status_code == 200
+    assert response.text == CONTENT
+    assert response.headers["etag"].startswith('"')
+    assert response.headers["accept-ranges"] == "bytes"
+
+def test_matching_etag_is_not_modified(client):
+    etag = download(client).headers["etag"]
+
+    assert download(client, **{"If-None-Match": etag}).status_code == 304
+    assert download(client, **{"If-None-Match": '"something-else"'}).status_code == 200
+
+def test_byte_ranges(client):
+    size = len(CONTENT.encode())
+
+    first = download(client, Range="bytes=0-6")
+    assert first.status_code == 206
+    assert first.content == b"# Lectu"
+    assert first.headers["content-range"] == f"bytes 0-6/{size}"
+
+    suffix = download(client, Range="bytes=-7")
+    assert suffix.status_code == 206
+    assert suffix.content == CONTENT.encode()[-7:]
+
+def test_unsatisfiable_range(client):
+    size = len(CONTENT.encode())
+
+    response = download(client, Range=f"bytes={size + 10}-")
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{size}"
+
+def test_if_range_with_a_stale_etag_sends_the_whole_note(client):
+    response = download(client, Range="bytes=0-6", **{"If-Range": '"stale"'})
+
+    assert response.status_code == 200
+    assert response.text == CONTENT
+
+def test_parse_range():
+    assert downloads.parse_range(None, 100) is None
+    assert downloads.parse_range("bytes=0-9,20-29", 100) is None
+    assert downloads.parse_range("bytes=90-", 100) == (90, 99)
+    assert downloads.parse_range("bytes=95-200", 100) == (95, 99)
+    with pytest.raises(downloads.RangeNotSatisfiable):
+        downloads.parse_range("bytes=-0", 100)
@@ -0,0 +1,95 @@
+import json
+
+from backend.db_models import NoteStatus
+from backend.services import events
+from backend.services import user_events
+from backend.services import db as db_service
+from backend.services import db_async
+from backend.database import AsyncSessionLocal
+from backend.tests.conftest import run_async
+
+def test_replay_returns_messages_after_an_event_id():
+    replay = events.ReplayBuffer(size=10)
+    first = replay.record("user:1", {"n": 1})
+    replay.record("user:2", {"n": "other topic"})
+    replay.record("user:1", {"n": 2})
+    replay.record("user:1", {"n": 3})
+
+    seq = replay.parse_event_id(replay.event_id(first["seq"]))
+
+    assert [m["n"] for m in replay.since("user:1", seq)] == [2, 3]
+    assert replay.since("user:1", replay.last_seq()) == []
+
+def test_replay_refuses_ids_it_cannot_honour():
+    replay = events.ReplayBuffer(size=2)
+    first = replay.record("user:1", {"n": 1})
+    for n in range(2, 5):
+        replay.record("user:1", {"n": n})
+
+    # Messages after `first` were dropped from the buffer
+    assert replay.since("user:1", first["seq"]) is None
+    # Another process's (or a previous run's) IDs, and malformed ones
+    assert replay.parse_event_id(events.ReplayBuffer().event_id(1)) is None
+    assert replay.parse_event_id("garbage") is None
+    # A sequence number from the future
+    assert replay.since("user:1", replay.last_seq() + 1) is None
+
+def test_replay_evicts_the_least_recent_topic():
+    replay = events.ReplayBuffer(size=10, max_topics=1)
+    old = replay.record("user:1", {"n": 1})
+    replay.record("user:2", {"n": 2})
+
+    assert replay.since("user:1", old["seq"] - 1) is None
+
+class DisconnectedRequest:
+    async def is_disconnected(self):
+        return True
+
+def read_stream(google_id, last_event_id):
+    async def read():
+        assert user_events.open_connection(google_id) is None
+        slot = user_events.ConnectionSlot(google_id)
+        return [chunk async for chunk in user_events.stream(DisconnectedRequest(), slot, last_event_id)]
+    chunks = run_async(read())
+    return [json.loads(line[len("data: "):]) for chunk in chunks for line in chunk.splitlines() if line.startswith("data: ")]
+
+def test_stream_resumes_after_last_event_id(db, make_user):
+    user = make_user("resumer")
+    note = db_service.create_note(db, user.id, "abcdefghijk")
+    replay = events.get_broker().replay
+    last_seen = replay.event_id(replay.last_seq())
+    db_service.update_note_status(db, note.id, NoteStatus.GENERATING)
+    db_service.update_note_status(db, note.id, NoteStatus.READY)
+
+    sent = read_stream("resumer", last_seen)
+
+    assert [(e["type"], e["status"]) for e in sent] == [("status", "generating"), ("status", "ready")]
+    assert user_events.connection_count() == 0
+
+def test_stream_sends_a_snapshot_when_it_cannot_resume(db, make_user):
+    user = make_user("snapshotter")
+    db_service.create_note(db, user.id, "abcdefghijk")
+
+    sent = read_stream("snapshotter", "unknown.1")
+
+    assert [e["type"] for e in sent] == ["snapshot"]
+    assert [n["videoId"] for n in sent[0]["notes"]] == ["abcdefghijk"]
+
+def test_request_path_publishes_status_only_when_committed(make_user):
+    user = make_user("committer")
+    replay = events.get_broker().replay
+    seen = replay.last_seq()
+
+    async def change_statuses():
+        async with AsyncSessionLocal() as session:
+            note = await db_async.create_note(session, user.id, "abcdefghijk")
+            note_id = note.id
+            # Published, then rolled back: never delivered
+            note.status = NoteStatus.FAILED
+            await events.publish_note_statuses_on_commit(session, [note])
+            await session.rollback()
+            await db_async.update_note_status(session, note_id, NoteStatus.GENERATING)
+    run_async(change_statuses())
+
+    sent = replay.since(events.user_topic(user.id), seen)
+    assert [m["status"] for m in sent] == ["pending", "generating"]
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.services import usage
+from backend.services.gemini_executor import GeminiExecutor, FakeGeminiBackend
+
+def test_calls_without_a_deadline_wait_for_a_slot():
+    backend = FakeGeminiBackend(latency=0.05)
+    executor = GeminiExecutor(backend=backend, max_concurrency=2, max_attempts=1)
+    try:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(pool.map(lambda _: executor.generate("model", "contents", None), range(6)))
+    finally:
+        executor.close()
+
+    assert len(responses) == 6 and all(response.text for response in responses)
+    assert backend.calls == 6
+
+class SlowFirstBackend(FakeGeminiBackend):
+    """The first request hangs until released; later ones answer at once."""
+
+    def __init__(self):
+        super().__init__(latency=0)
+        self.release_first = threading.Event()
+        self.first_done = threading.Event()
+
+    def generate(self, model, contents, config, timeout):
+        with self._lock:
+            first = self.calls == 0
+        response = super().generate(model, contents, config, timeout)
+        if first:
+            self.release_first.wait(5)
+            self.first_done.set()
+        return response
+
+def test_hedge_race_loser_gives_back_its_slot_and_is_still_counted():
+    backend = SlowFirstBackend()
+    executor = GeminiExecutor(backend=backend, max_concurrency=2, max_attempts=1, hedge_after=0.05)
+    try:
+        with usage.collect() as collected:
+            response = executor.generate("model", "contents", None)
+
+            # The primary is still in flight, but both slots are free again
+            assert response.text
+            assert all(executor._acquire_slot(blocking=False) for _ in range(2))
+            executor._slots.release()
+            executor._slots.release()
+
+            backend.release_first.set()
+            assert backend.first_done.wait(5)
+            executor._hedge_pool.shutdown(wait=True)
+    finally:
+        executor.close()
+
+    assert backend.calls == 2
+    assert collected.calls == 2
+    assert collected.input_tokens == 2000
@@ -0,0 +1,59 @@
+import datetime
+
+from backend import db_models
+from backend.db_models import JobStatus
+from backend.services import queue as job_queue
+from backend.services import db as db_service
+
+def enqueue(db, user, video_id):
+    note = db_service.create_note(db, user.id, video_id)
+    return job_queue.enqueue_job(db, note.id, user.id, video_id, job_queue.VIDEO_URL_PREFIX + video_id)
+
+def test_lease_takes_turns_between_users(db, make_user, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_MAX_LEASED_PER_USER", 2)
+    heavy, light = make_user("heavy"), make_user("light")
+    for i in range(3):
+        enqueue(db, heavy, f"heavy{i:07d}")
+    enqueue(db, light, "light000000")
+
+    leased = [job_queue.lease_job(db, "worker-1") for _ in range(4)]
+
+    # The light user's job goes second even though it was queued last,
+    # and the heavy user stops at the per-user cap
+    assert [job.user_id if job else None for job in leased] == [heavy.id, light.id, heavy.id, None]
+    assert len({job.id for job in leased if job}) == 3
+    assert all(job.status == JobStatus.LEASED and job.attempts == 1 for job in leased if job)
+
+def test_lease_skips_jobs_not_yet_available(db, make_user):
+    job = enqueue(db, make_user(), "later000000")
+    db.query(db_models.Job).filter(db_models.Job.id == job.id).update(
+        {db_models.Job.available_at: datetime.datetime.utcnow() + datetime.timedelta(minutes=5)}
+    )
+    db.commit()
+
+    assert job_queue.lease_job(db, "worker-1") is None
+
+def test_retry_delay_uses_full_jitter_under_a_capped_ceiling(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_RETRY_BASE_SECONDS", 30)
+    monkeypatch.setattr(job_queue, "JOB_RETRY_MAX_SECONDS", 900)
+    calls = []
+    monkeypatch.setattr(job_queue.random, "uniform", lambda low, high: calls.append((low, high)) or high)
+
+    for attempts in (1, 2, 3, 10):
+        job_queue.retry_delay(attempts)
+
+    assert calls == [(0, 30), (0, 60), (0, 120), (0, 900)]
+
+def test_failed_job_is_retried_until_out_of_attempts(db, make_user, monkeypatch):
+    monkeypatch.setattr(job_queue, "retry_delay", lambda attempts: 0)
+    job = enqueue(db, make_user(), "flaky000000")
+
+    outcomes = []
+    for _ in range(job.max_attempts):
+        leased = job_queue.lease_job(db, "worker-1")
+        outcomes.append(job_queue.fail_job(db, leased, "worker-1", "boom"))
+
+    assert outcomes == [True] * (job.max_attempts - 1) + [False]
+    db.expire_all()
+    assert db.get(db_models.Job, job.id).status == JobStatus.FAILED
+    assert job_queue.lease_job(db, "worker-1") is None
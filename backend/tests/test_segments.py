@@ -0,0 +1,64 @@
+import time
+
+from backend.services import events
+from backend.services import segments
+from backend.services.segments import merge_segments
+
+def test_continued_headings_at_a_boundary_are_dropped():
+    merged = merge_segments([
+        "# Lecture\n\n## Loops\n\nfor loops",
+        "# Lecture\n\n## Loops\n\nwhile loops\n\n## Functions\n\ndef",
+    ])
+
+    assert merged == "# Lecture\n\n## Loops\n\nfor loops\n\nwhile loops\n\n## Functions\n\ndef\n"
+
+def test_repeated_headings_in_different_sections_are_kept():
+    merged = merge_segments([
+        "# Lecture\n\n## Loops\n\n### Example\n\nfor i in range(3)",
+        "# Lecture\n\n## Functions\n\n### Example\n\ndef f(): pass\n\n### Summary\n\nfunctions",
+        "## Classes\n\n### Example\n\nclass A: pass\n\n### Summary\n\nclasses",
+    ])
+
+    assert merged.count("### Example") == 3
+    assert merged.count("### Summary") == 2
+    assert merged.count("# Lecture") == 1
+    assert "### Summary\n\nfunctions\n\n## Classes" in merged
+
+def test_repeats_within_one_segment_are_kept():
+    merged = merge_segments(["## Part 1\n\n### Example\n\na\n\n## Part 2\n\n### Example\n\nb"])
+
+    assert merged.count("### Example") == 2
+
+def test_a_heading_after_content_is_not_treated_as_a_continuation():
+    merged = merge_segments([
+        "## Loops\n\nfor",
+        "more about loops\n\n## Loops\n\nrecap",
+    ])
+
+    assert merged.count("## Loops") == 2
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, message):
+        self.published.append((topic, message))
+
+def test_streamed_deltas_add_up_to_the_merged_notes(monkeypatch):
+    texts = [
+        "# Lecture\n\n## Loops\n\nfor loops",
+        "# Lecture\n\n## Loops\n\nwhile loops",
+        "# Lecture\n\n## Functions\n\ndef",
+    ]
+    def generate_segment(cache_key, video_url, segment):
+        # Later segments finish first
+        time.sleep(0.02 * (segment.total - segment.index))
+        return texts[segment.index]
+    monkeypatch.setattr(segments, "_generate_segment", generate_segment)
+    broker = RecordingBroker()
+    monkeypatch.setattr(events, "_broker", broker)
+
+    merged = segments.generate_segmented("key", "abcdefghijk", "url", duration_seconds=3 * segments.SEGMENT_LENGTH_SECONDS)
+
+    assert merged == merge_segments(texts)
+    assert "".join(message["text"] for topic, message in broker.published) == merged
@@ -0,0 +1,87 @@
+import datetime
+
+import pytest
+
+from backend import db_models
+from backend.services import usage
+
+def tokens(input_tokens=0, output_tokens=0, thinking_tokens=0):
+    return usage.Usage(calls=1, input_tokens=input_tokens, output_tokens=output_tokens, thinking_tokens=thinking_tokens)
+
+@pytest.fixture
+def aggregator(monkeypatch):
+    aggregator = usage.UsageAggregator()
+    monkeypatch.setattr(usage, "_aggregator", aggregator)
+    monkeypatch.setattr(usage, "USAGE_DAILY_TOKEN_QUOTA", 100)
+    return aggregator
+
+def set_quota(db, user, limit):
+    db.add(db_models.UserQuota(user_id=user.id, daily_token_limit=limit))
+    db.commit()
+
+def test_collect_sums_the_calls_of_a_generation():
+    class Metadata:
+        prompt_token_count = 10
+        candidates_token_count = 5
+        thoughts_token_count = None
+
+    with usage.collect() as collected:
+        usage.record(Metadata(), 0.25)
+        usage.record(Metadata(), 0.5)
+        usage.record(None, 0.1)
+
+    assert (collected.calls, collected.input_tokens, collected.output_tokens, collected.thinking_tokens) == (3, 20, 10, 0)
+    assert collected.gemini_ms == 850
+
+def test_flush_adds_to_the_stored_day(db, make_user, aggregator):
+    user = make_user()
+    aggregator.add(user.id, tokens(10, 5, 1))
+    aggregator.add(user.id, tokens(10, 5, 1))
+    assert aggregator.flush() == 1
+    aggregator.add(user.id, tokens(1, 1, 1))
+    aggregator.flush()
+
+    row = db.get(db_models.UsageDaily, (user.id, datetime.datetime.utcnow().date()))
+    assert (row.generations, row.input_tokens, row.output_tokens, row.thinking_tokens) == (3, 21, 11, 3)
+    assert aggregator.flush() == 0
+
+def test_quota_counts_flushed_and_pending_usage(db, make_user, aggregator):
+    user = make_user()
+    aggregator.add(user.id, tokens(40))
+    aggregator.flush()
+    aggregator.add(user.id, tokens(30))
+    aggregator.refresh()
+
+    assert aggregator.quota_remaining(user.id) == 30
+    # Usage added after the refresh counts straight away
+    aggregator.add(user.id, tokens(30))
+    assert aggregator.quota_remaining(user.id) == 0
+
+def test_user_override_replaces_the_default(db, make_user, aggregator):
+    limited, unlimited = make_user("limited"), make_user("unlimited")
+    set_quota(db, limited, 1000)
+    set_quota(db, unlimited, 0)
+    aggregator.refresh()
+
+    assert aggregator.quota_remaining(limited.id) == 1000
+    assert aggregator.quota_remaining(unlimited.id) is None
+
+def test_resetting_an_override_restores_the_default(db, make_user, aggregator):
+    reset, default = make_user("reset"), make_user("default")
+    set_quota(db, reset, None)
+    aggregator.refresh()
+
+    assert aggregator.quota_remaining(reset.id) == 100
+    assert aggregator.quota_remaining(reset.id) == aggregator.quota_remaining(default.id)
+
+def test_check_quota_refuses_until_utc_midnight(db, make_user, aggregator):
+    user = make_user()
+    aggregator.refresh()
+    assert usage.check_quota(user.id) is None
+
+    aggregator.add(user.id, tokens(60, 30, 10))
+    retry_after = usage.check_quota(user.id)
+
+    assert 0 < retry_after <= 24 * 3600
+    # Tokens without a known user id are let through
+    assert usage.check_quota(None) is None
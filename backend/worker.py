@@ -0,0 +1,132 @@
+"""
+Worker pool that drains the durable job queue.
+
+Runs inside the API process (WORKER_MODE=inprocess, the default) or on its own:
+
+    python -m backend.worker
+"""
+import os
+import socket
+import uuid
+import logging
+import asyncio
+import threading
+
+from backend.database import SessionLocal, close_engines
+from backend.db_models import NoteStatus
+from backend.services import db as db_service
+from backend.services import queue as job_queue
+from backend.services import metrics
+from backend.services import logs
+from backend.services import usage
+from backend.tasks import run_background_generate_task
+
+logger = logging.getLogger(__name__)
+
+WORKER_MODE = os.getenv("WORKER_MODE", "inprocess")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+# How often leases are renewed and expired leases / stale notes are recovered
+WORKER_MAINTENANCE_INTERVAL = float(os.getenv("WORKER_MAINTENANCE_INTERVAL", "30"))
+
+class WorkerPool:
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._running_jobs = set()
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        logger.info(f"Starting worker pool {self.worker_id} with {self.concurrency} workers")
+        self._threads = [
+            threading.Thread(target=self._work_loop, name=f"worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        self._threads.append(threading.Thread(target=self._maintenance_loop, name="worker-maintenance", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            try:
+                ran = self._run_one()
+            except Exception as e:
+                logger.exception(f"Worker loop error: {e}")
+                ran = False
+            if not ran:
+                self._stop.wait(WORKER_POLL_INTERVAL)
+
+    def _run_one(self) -> bool:
+        db = SessionLocal()
+        try:
+            job = job_queue.lease_job(db, self.worker_id)
+        finally:
+            db.close()
+        if not job:
+            return False
+
+        with self._running_lock:
+            self._running_jobs.add(job.id)
+        # Logs of the job carry the request that enqueued it
+        with logs.bind(request_id=job.request_id, job_id=job.id, note_id=job.note_id):
+            try:
+                run_background_generate_task(job.note_id, str(job.user_id), job.video_id, job.video_url)
+            except Exception as e:
+                logger.error(f"Job {job.id} attempt {job.attempts} failed: {e}")
+                db = SessionLocal()
+                try:
+                    if not job_queue.fail_job(db, job, self.worker_id, str(e)):
+                        db_service.update_note_status(db, job.note_id, NoteStatus.FAILED)
+                finally:
+                    db.close()
+            else:
+                db = SessionLocal()
+                try:
+                    job_queue.complete_job(db, job.id, self.worker_id)
+                finally:
+                    db.close()
+            finally:
+                with self._running_lock:
+                    self._running_jobs.discard(job.id)
+        return True
+
+    def _maintenance_loop(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                with self._running_lock:
+                    running = list(self._running_jobs)
+                job_queue.extend_lease(db, running, self.worker_id)
+                job_queue.reap_expired_leases(db)
+                job_queue.recover_stale_notes(db)
+            except Exception as e:
+                logger.exception(f"Worker maintenance error: {e}")
+            finally:
+                db.close()
+            self._stop.wait(WORKER_MAINTENANCE_INTERVAL)
+
+def main():
+    logs.configure_logging()
+    if metrics.WORKER_METRICS_PORT:
+        metrics.serve(metrics.WORKER_METRICS_PORT)
+    pool = WorkerPool()
+    usage.get_aggregator().start()
+    pool.start()
+    try:
+        pool._stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        usage.get_aggregator().stop()
+        asyncio.run(close_engines())
+
+if __name__ == "__main__":
+    main()
@@ -112,6 +112,13 @@ async function handleGenerateNotes(button) {
             throw new Error('Unauthorized');
         }
 
+        if (response.status === 429 || response.status === 503) {
+            // Rate limited or server at capacity: don't retry before Retry-After
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 30;
+            showRetryLater(button, retryAfter);
+            return;
+        }
+
         if (!response.ok) throw new Error('Network response was not ok');
 
         // 2. Listen for Events via Fetch Stream (for credentials support)
@@ -123,40 +130,115 @@ async function handleGenerateNotes(button) {
     }
 }
 
-async function streamEvents(videoId, button) {
-    try {
-        const response = await fetch(`http://localhost:8000/notes/${videoId}/events`, {
-            credentials: 'include'
+// One multiplexed status stream per tab (GET /events), shared by every
+// note being generated. It reconnects with Last-Event-ID, so a dropped
+// connection resumes instead of losing updates.
+const noteWatchers = new Map(); // videoId -> { onStatus, onError }
+let eventStream = null;         // AbortController of the open stream
+let lastEventId = null;
+
+function streamEvents(videoId, button) {
+    return new Promise((resolve, reject) => {
+        noteWatchers.set(videoId, {
+            onStatus: (status) => {
+                handleStatusUpdate(status, button, videoId);
+                if (['ready', 'failed'].includes(status)) {
+                    unwatchNote(videoId);
+                    resolve();
+                }
+            },
+            onError: (error) => {
+                unwatchNote(videoId);
+                reject(error);
+            }
         });
+        openEventStream();
+    });
+}
+
+function unwatchNote(videoId) {
+    noteWatchers.delete(videoId);
+    if (noteWatchers.size === 0 && eventStream) {
+        eventStream.abort();
+        eventStream = null;
+    }
+}
+
+function dispatchStreamEvent(data) {
+    const updates = data.type === 'snapshot' ? data.notes : data.type === 'status' ? [data] : [];
+    for (const update of updates) {
+        const watcher = noteWatchers.get(update.videoId);
+        if (watcher) watcher.onStatus(update.status);
+    }
+}
+
+async function openEventStream() {
+    if (eventStream) return;
+    const controller = new AbortController();
+    eventStream = controller;
+    let retryMs = 3000;
+
+    while (eventStream === controller) {
+        try {
+            const response = await fetch('http://localhost:8000/events', {
+                credentials: 'include',
+                headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+                signal: controller.signal
+            });
+            if (response.status === 401) {
+                eventStream = null;
+                noteWatchers.forEach(watcher => watcher.onError(new Error('Unauthorized')));
+                return;
+            }
+            if (response.ok) {
+                retryMs = await readEventStream(response, retryMs);
+            } else {
+                // Connection caps: wait as long as the server asks
+                const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                if (retryAfter) retryMs = retryAfter * 1000;
+            }
+        } catch (error) {
+            if (controller.signal.aborted) return;
+            console.warn('Event stream dropped, reconnecting:', error);
+        }
+        if (eventStream !== controller) return;
+        await new Promise(resolve => setTimeout(resolve, retryMs));
+    }
+}
 
-        if (!response.ok) throw new Error('SSE Connection failed');
-
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-            const { value, done } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    try {
-                        const data = JSON.parse(line.slice(6));
-                        handleStatusUpdate(data.status, button, videoId);
-                        if (['ready', 'failed'].includes(data.status)) {
-                            return; // Stop stream
-                        }
-                    } catch (e) {
-                        // ignore parse errors or keepalive
-                    }
+// Minimal SSE parser for fetch streams.
+// Returns the reconnect delay last suggested by the server.
+async function readEventStream(response, retryMs) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) return retryMs;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('id: ')) {
+                    lastEventId = line.slice(4);
+                } else if (line.startsWith('retry: ')) {
+                    retryMs = parseInt(line.slice(7), 10) || retryMs;
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
                 }
             }
+            if (!data) continue; // heartbeat
+            try {
+                dispatchStreamEvent(JSON.parse(data));
+            } catch (e) {
+                console.error('Bad event from stream:', e);
+            }
         }
-    } catch (error) {
-        throw error;
     }
 }
 
@@ -187,10 +269,23 @@ function handleStatusUpdate(status, button, videoId) {
 }
 
 async function downloadNote(videoId) {
+    const downloadUrl = `http://localhost:8000/notes/${videoId}/download`;
+    let response;
     try {
-        const response = await fetch(`http://localhost:8000/notes/${videoId}/download`, {
+        response = await fetch(downloadUrl, {
             credentials: 'include'
         });
+    } catch (e) {
+        // In redirect mode the API sends us to a signed storage URL that
+        // may not allow credentialed CORS; let the browser download it directly
+        const a = document.createElement('a');
+        a.href = downloadUrl;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        return;
+    }
+    try {
         if (!response.ok) throw new Error('Download failed');
 
         const blob = await response.blob();
@@ -201,8 +296,12 @@ async function downloadNote(videoId) {
         // content-disposition header might have filename
         const contentDisposition = response.headers.get('Content-Disposition');
         let filename = 'note.md';
-        if (contentDisposition && contentDisposition.includes('filename=')) {
-            filename = contentDisposition.split('filename=')[1].replace(/"/g, '');
+        const encodedName = contentDisposition && contentDisposition.match(/filename\*=UTF-8''([^;]+)/i);
+        const plainName = contentDisposition && contentDisposition.match(/filename="?([^";]+)"?/i);
+        if (encodedName) {
+            filename = decodeURIComponent(encodedName[1]);
+        } else if (plainName) {
+            filename = plainName[1];
         }
 
         a.download = filename;
@@ -215,6 +314,14 @@ async function downloadNote(videoId) {
     }
 }
 
+function showRetryLater(button, seconds) {
+    button.classList.remove('loading');
+    button.classList.add('error');
+    button.disabled = true;
+    button.textContent = `Busy, try again in ${seconds}s`;
+    setTimeout(() => updateButtonState(button, 'READY'), seconds * 1000);
+}
+
 function handleError(error, button) {
     if (error.message === 'Unauthorized') {
         alert('Session expired. Please login again.');
@@ -231,6 +338,52 @@ function handleError(error, button) {
         }, 3000);
     }
 }
+// Looks up which of the given videos already have notes, in one request
+async function fetchNoteStatuses(videoIds) {
+    try {
+        const response = await fetch('http://localhost:8000/notes/status', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            credentials: 'include',
+            body: JSON.stringify({ videoIds })
+        });
+        if (!response.ok) return {};
+        const data = await response.json();
+        // A note being regenerated still serves its last version
+        return Object.fromEntries(data.notes.map(note => [note.videoId, note.downloadable ? 'ready' : note.status]));
+    } catch (e) {
+        return {};
+    }
+}
+
+function getThumbnailVideoId(link) {
+    return new URL(link.href, window.location.origin).searchParams.get('v');
+}
+
+// Marks the current video and the thumbnails on the page that already have notes
+async function markExistingNotes(button) {
+    const currentId = getVideoId();
+    const thumbnails = [...document.querySelectorAll('a#thumbnail[href*="watch?v="]')];
+    const videoIds = new Set(thumbnails.map(getThumbnailVideoId).filter(Boolean));
+    if (currentId) videoIds.add(currentId);
+
+    const statuses = await fetchNoteStatuses([...videoIds].slice(0, 200));
+
+    if (currentId && statuses[currentId] === 'ready' && button.isConnected) {
+        handleStatusUpdate('ready', button, currentId);
+    }
+    thumbnails.forEach(link => {
+        if (statuses[getThumbnailVideoId(link)] === 'ready' && !link.querySelector('.yt-notes-badge')) {
+            const badge = document.createElement('span');
+            badge.className = 'yt-notes-badge';
+            badge.textContent = 'Notes';
+            link.appendChild(badge);
+        }
+    });
+}
+
 let isInjecting = false;
 
 async function injectButton() {
@@ -261,6 +414,10 @@ async function injectButton() {
         actionsContainer.insertBefore(button, actionsContainer.firstChild);
         actionsContainer.dataset.notesButtonInjected = 'true';
 
+        if (isAuth) {
+            markExistingNotes(button);
+        }
+
     } finally {
         isInjecting = false;
     }